@@ -1,31 +1,52 @@
 """
 Flask app for data analysis tasks.
 
-* Manages a thread pool.
+* Manages a thread pool (whose tasks may run in worker processes, see 'TP_EXECUTION_MODE').
 * Reads data from "nutrition_activity_obesity_usa_subset.csv".
-* Stores processed data in `DataIngestor.questions_dict`.
-* Tracks jobs with `webserver.job_counter`.
-* Creates the 'results' directory that is used by taskRunners to store
-the result data for a certain job_id
-* Creates and assigns a logger to the webserver
+* Stores processed data in `DataIngestor.questions_dict` and precomputes an
+`AggregateIndex` over it. The environment variable 'DATA_BACKEND' selects what the
+jobs compute on: "index" (default), "dict", "columnar" (a NumPy-backed `ColumnarStore`)
+or "mmap" (a `ColumnarStore` memory-mapped from a snapshot, shared by all the server
+processes started on the same CSV; `questions_dict` is not built).
+When 'DATA_SNAPSHOT_DIR' is set, a binary snapshot of the CSV is kept in that directory
+and later starts load it instead of parsing the CSV again.
+* Job IDs are handed out by the thread pool (`ThreadPool.new_job_id`).
+* Sheds load with a 429 and a Retry-After header: when the task queue is full (see
+'TP_QUEUE_HIGH_WATER') and, if 'RATE_LIMIT' is set, when a client submits more than
+'RATE_LIMIT' jobs per second (bursts of 'RATE_LIMIT_BURST').
+* Creates the store used by taskRunners to keep the result data for a certain job_id:
+in memory, bounded by 'RESULTS_MAX_ENTRIES' and 'RESULTS_TTL' (seconds). When
+'RESULTS_SPILL_TO_DISK' is set, evicted results are pickled to the 'results' directory.
+* Creates and assigns a logger to the webserver, which writes to "webserver.log" from
+a background thread; the level is set with 'LOG_LEVEL'
 """
+import atexit
+import multiprocessing
 import os
 import logging
 import queue
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import time
 from flask import Flask
+from app.admission import RateLimiter
 from app.data_ingestor import DataIngestor
+from app.result_store import DiskResultStore, MemoryResultStore
 from app.task_runner import ThreadPool
 
 webserver = Flask(__name__)
-webserver.tasks_runner = ThreadPool()
 
-# webserver.task_runner.start()
+# Per-client token buckets: 'RATE_LIMIT' jobs per second, in bursts of 'RATE_LIMIT_BURST'
+webserver.rate_limiter = None
+if os.getenv("RATE_LIMIT"):
+    webserver.rate_limiter = RateLimiter(float(os.getenv("RATE_LIMIT")),
+                                         float(os.getenv("RATE_LIMIT_BURST", "0")) or None)
 
-webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
+# webserver.task_runner.start()
 
-webserver.job_counter = 1
+webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv",
+                                       os.getenv("DATA_BACKEND", "index"),
+                                       os.getenv("DATA_SNAPSHOT_DIR"))
 
 # Get the current working directory
 cwd = os.getcwd()
@@ -40,8 +61,6 @@ os.makedirs(results_dir, exist_ok=True)
 os.system("rm -rf results/*")
 print("Empty 'results' directory created successfully")
 
-webserver.tasks_runner.update_results_dir(results_dir)
-
 
 class GMTFormatter(logging.Formatter):
     """
@@ -50,17 +69,22 @@ class GMTFormatter(logging.Formatter):
     converter = time.gmtime
 
 
-def get_webserver_logger():
+def get_webserver_logger(log_queue):
     """
     Configures a logger to be used for the webserver.
-    Uses a RotatingFileHandler and a queue listener for multithreading
+
+    - The logger only has a QueueHandler: callers put their records on `log_queue` and
+    never wait for the disk. A QueueListener thread writes them to a RotatingFileHandler.
+    The listener is returned unstarted, so that worker processes can be forked before
+    its thread runs (see ThreadPool._fork_processes).
+    - The level comes from the environment variable 'LOG_LEVEL' (default: INFO);
+    results and other payloads are only logged at DEBUG.
+    - Worker processes forked from the server inherit the logger, so in "process" mode
+    `log_queue` must be a multiprocessing queue, drained by the same listener.
     """
     # Create logger
     logger = logging.getLogger('webserver_logger')
-    logger.setLevel(logging.INFO)
-
-    # Create a Queue to store log records
-    log_queue = queue.Queue()
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
     # Create a rotating file handler
     handler = RotatingFileHandler('webserver.log', maxBytes=1024 * 1024, backupCount=5)
@@ -69,16 +93,65 @@ def get_webserver_logger():
     formatter = GMTFormatter('%(asctime)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
 
-    # Add the handler to the logger
-    logger.addHandler(handler)
-
-    # Create and start a QueueListener
-    listener = logging.handlers.QueueListener(log_queue, handler)
-    listener.start()
+    # Only the queue handler is attached to the logger, the listener owns the file handler
+    logger.addHandler(QueueHandler(log_queue))
+
+    # Create the QueueListener that writes the records to the file
+    listener = QueueListener(log_queue, handler)
+
+    return logger, listener
+
+
+webserver.my_logger, log_listener = get_webserver_logger(
+    multiprocessing.get_context("fork").Queue()
+    if os.getenv("TP_EXECUTION_MODE") == "process" else queue.Queue())
+
+# Created once the data is ingested and before any thread starts: the worker processes
+# (if any) are forked from a single-threaded process and inherit the data instead of
+# receiving it with every task
+shared_data = (webserver.data_ingestor.data_source,
+               webserver.data_ingestor.questions_best_is_max,
+               webserver.data_ingestor.questions_best_is_min,
+               webserver.my_logger)
+if os.getenv("TP_EXECUTION_MODE") == "process":
+    # Otherwise built on the first year-filtered request, after the fork
+    shared_data += (webserver.data_ingestor.columnar_store,)
+webserver.tasks_runner = ThreadPool(shared=shared_data)
+
+spill_store = DiskResultStore(results_dir) if os.getenv("RESULTS_SPILL_TO_DISK") else None
+webserver.tasks_runner.update_result_store(
+    MemoryResultStore(max_entries=int(os.getenv("RESULTS_MAX_ENTRIES", "10000")),
+                      ttl=float(os.getenv("RESULTS_TTL", "0")) or None,
+                      spill_store=spill_store))
+
+ingest_stats = webserver.data_ingestor.ingest_stats
+webserver.my_logger.info("Ingested %d rows (%d without a value skipped, %d duplicated years "
+                         "kept but not aggregated) in %.3fs, %.0f rows/sec",
+                         ingest_stats['rows'], ingest_stats['skipped'], ingest_stats['duplicates'],
+                         ingest_stats['seconds'], ingest_stats['rows_per_sec'])
+webserver.my_logger.info("Ingest steps: %s", ", ".join(
+    f"{step} {seconds:.3f}s" for step, seconds in ingest_stats['step_seconds'].items()))
+if 'snapshot' in ingest_stats:
+    webserver.my_logger.info("Data snapshot %s", ingest_stats['snapshot'])
+
+# Write the log records from now on, flushing the pending ones at exit
+log_listener.start()
+atexit.register(log_listener.stop)
+
+
+def shutdown_after_main_thread(thread_pool):
+    """
+    Shuts the thread pool down (draining its queue) once the main thread is done, e.g.
+    after CTRL + C or at the end of the unit tests. Its workers are not daemon threads:
+    otherwise the interpreter would wait for them forever.
+    """
+    def watch():
+        threading.main_thread().join()
+        thread_pool.shutdown()
 
-    return logger
+    threading.Thread(target=watch, name="pool-shutdown", daemon=True).start()
 
 
-webserver.my_logger = get_webserver_logger()
+shutdown_after_main_thread(webserver.tasks_runner)
 
 from app import routes
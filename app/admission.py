@@ -0,0 +1,110 @@
+"""
+Admission control for the job submissions.
+
+Provides `Overloaded` (raised when a job is turned away, answered with a 429), the
+`ThroughputMeter` the Retry-After estimates are derived from, and `RateLimiter`,
+optional per-client token buckets applied to the requests submitting jobs.
+"""
+
+import math
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+
+# Bounds (seconds) of the Retry-After estimates
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    """
+    Raised when a job is not accepted: the task queue is full or the client went
+    over its rate limit. `retry_after` is the number of seconds to wait before retrying.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def clamp_retry_after(seconds):
+    """
+    Rounds a wait up to whole seconds, within [MIN_RETRY_AFTER, MAX_RETRY_AFTER].
+    """
+    return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(seconds)))
+
+
+class ThroughputMeter:
+    """
+    Measures the jobs finished per second, over the last `window` finished jobs.
+    """
+
+    def __init__(self, window=256):
+        self.lock = Lock()
+        self.finished_at = deque(maxlen=window)
+
+    def mark(self):
+        """
+        Records a finished job.
+        """
+        with self.lock:
+            self.finished_at.append(time.monotonic())
+
+    def rate(self):
+        """
+        Returns the jobs finished per second, or None before two jobs finished.
+        """
+        with self.lock:
+            if len(self.finished_at) < 2:
+                return None
+            elapsed = time.monotonic() - self.finished_at[0]
+            return len(self.finished_at) / elapsed if elapsed > 0 else None
+
+    def time_to_finish(self, num_jobs):
+        """
+        Estimates the seconds needed to finish `num_jobs` more jobs, as a Retry-After value.
+        """
+        rate = self.rate()
+        return clamp_retry_after(num_jobs / rate if rate else MIN_RETRY_AFTER)
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """
+    Per-client token buckets: every client may submit `rate` jobs per second on
+    average, in bursts of up to `burst` jobs.
+
+    - Buckets are refilled lazily, when their client sends a request.
+    - At most `max_clients` buckets are kept, the least recently used one is dropped
+    (its client starts again with a full bucket).
+    """
+
+    def __init__(self, rate, burst=None, max_clients=10000):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.max_clients = max_clients
+        self.lock = Lock()
+        # client -> (tokens, time of the last update), least recently used first
+        self.buckets = OrderedDict()
+
+    def acquire(self, client):
+        """
+        Takes a token from the bucket of a client.
+
+        Returns:
+            float: 0 if the request is admitted, otherwise the seconds until the
+            bucket holds a token again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[client] = (tokens, now)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
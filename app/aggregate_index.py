@@ -0,0 +1,92 @@
+"""
+Aggregate index over the ingested data.
+
+Provides the `AggregateIndex` class, which precomputes at ingest time the sums and counts
+every endpoint needs, so that requests are answered without touching the rows.
+"""
+
+from app.columnar_store import iter_rows
+
+
+def _add(totals, key, value):
+    """
+    Adds a value to the [sum, count] pair stored under `key`.
+    """
+    pair = totals.get(key)
+    if pair is None:
+        pair = totals[key] = [0, 0]
+    pair[0] += value
+    pair[1] += 1
+
+
+class AggregateIndex:
+    """
+    Sum and count of the data values, grouped at the granularities used by the endpoints.
+
+    **Attributes:**
+
+    * `question_totals` (dict): question -> [sum, count]
+    * `state_totals` (dict): question -> state -> [sum, count]
+    * `group_totals` (dict): question -> state -> (category, stratification) -> [sum, count]
+
+    The rows are added in the traversal order of `DataIngestor.questions_dict`, so every
+    sum (and mean) is identical to the one computed by the loops in `app/routes.py`.
+    """
+
+    def __init__(self, rows):
+        self.question_totals = {}
+        self.state_totals = {}
+        self.group_totals = {}
+
+        for question, state, category, stratification, _, value in rows:
+            value = float(value)
+            if question not in self.state_totals:
+                self.state_totals[question] = {}
+                self.group_totals[question] = {}
+
+            _add(self.question_totals, question, value)
+            _add(self.state_totals[question], state, value)
+            _add(self.group_totals[question].setdefault(state, {}),
+                 (category, stratification), value)
+
+    @classmethod
+    def from_questions_dict(cls, questions_dict):
+        """
+        Builds the index from the nested dictionary produced by `DataIngestor`.
+        """
+        return cls(iter_rows(questions_dict))
+
+    def state_means(self, question, state=None):
+        """
+        Mean value of every state (or only of `state`) for a question.
+
+        Returns:
+            dict: state name -> mean, in order of first appearance.
+        """
+        states_totals = self.state_totals[question]
+        if state is not None:
+            total, count = states_totals[state]
+            return {state: total / count}
+        return {name: total / count for name, (total, count) in states_totals.items()}
+
+    def global_mean(self, question):
+        """
+        Mean value of all the rows of a question.
+        """
+        total, count = self.question_totals[question]
+        return total / count
+
+    def category_means(self, question, state=None):
+        """
+        Mean value of every (state, stratification category, stratification) group
+        of a question, optionally restricted to a single state.
+
+        Returns:
+            list: (state, category, stratification, mean) tuples, in order of first appearance.
+        """
+        states_groups = self.group_totals[question]
+        if state is not None:
+            states_groups = {state: states_groups[state]}
+        return [(name, category, stratification, total / count)
+                for name, groups in states_groups.items()
+                for (category, stratification), (total, count) in groups.items()]
@@ -0,0 +1,289 @@
+"""
+Asynchronous (ASGI) front end of the webserver.
+
+`application` serves the same routes as the Flask app for an asyncio server, e.g.
+`uvicorn app.asgi:application` (uvicorn is optional, `python -m app.asgi` uses it
+when it is installed):
+
+* Requests are handed to the Flask app on a small executor ('ASGI_THREADS' threads,
+default: 8). The views only submit jobs or read their state, so a request holds a
+thread for a very short time.
+* Long polls (/api/get_results/<job_id>?wait=<seconds>) wait for their job on an
+asyncio future completed by the JobRegistry, holding no thread: an idle poller costs
+a coroutine. The result is then read through the Flask view as usual.
+* Streamed results (?stream=...) are written out chunk by chunk.
+* Event streams (/api/events) are written from the event loop, woken up by the
+thread finishing a job: an open dashboard costs a coroutine, not a thread.
+"""
+
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from werkzeug.datastructures import MultiDict
+
+from app.events import KEEPALIVE, KEEPALIVE_SECONDS
+from app.routes import MAX_WAIT, InvalidRequest, job_event_message, open_event_stream, \
+    webserver
+
+# Runs the Flask app, see handle_http
+_executor = ThreadPoolExecutor(int(os.getenv("ASGI_THREADS", "8")),
+                               thread_name_prefix="asgi-wsgi")
+
+_GET_RESULTS_PATH = re.compile(r"^/api/get_results/(\d+)$")
+
+
+def wsgi_environ(scope, body):
+    """
+    Builds the WSGI environ of an ASGI HTTP request.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """
+    Calls the Flask app.
+
+    Returns:
+        tuple: (status code, list of (name, value) headers as bytes, body iterator).
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                               for name, value in headers]
+
+    body = webserver.wsgi_app(environ, start_response)
+    return response["status"], response["headers"], body
+
+
+async def read_body(receive):
+    """
+    Reads the whole body of an ASGI HTTP request.
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def wait_for_job(job_id, timeout):
+    """
+    Waits, without holding a thread, for a job to finish or `timeout` seconds to pass.
+    """
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def resolve():
+        if not finished.done():
+            finished.set_result(None)
+
+    def on_done():
+        try:
+            loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # The event loop is closed, nobody is waiting anymore
+            pass
+
+    job_registry = webserver.tasks_runner.job_registry
+    job_registry.add_done_callback(job_id, on_done)
+    try:
+        await asyncio.wait_for(finished, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        job_registry.remove_done_callback(job_id, on_done)
+
+
+async def long_poll(scope):
+    """
+    Waits for the job of a /api/get_results request with a 'wait' parameter, and
+    returns the query string without it, so that the Flask view answers right away.
+    """
+    match = _GET_RESULTS_PATH.match(scope["path"])
+    query = parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+    if match is None or scope["method"] != "GET" or "wait" not in dict(query):
+        return None
+    try:
+        wait = float(dict(query)["wait"])
+    except ValueError:
+        return None
+    if wait > 0:
+        await wait_for_job(int(match.group(1)), min(wait, MAX_WAIT))
+    return urlencode([(name, value) for name, value in query if name != "wait"])
+
+
+async def stream_events(subscription, stream, ready, disconnected, send):
+    """
+    Writes out the events of a subscription until every job it follows was reported,
+    or the client disconnects.
+
+    Args:
+        subscription (Subscription): the jobs followed by the stream.
+        stream (tuple): (job ids left to report or None, include result), see
+            open_event_stream.
+        ready (asyncio.Event): set when the subscription has new events.
+        disconnected (asyncio.Future): completed when the client goes away.
+        send (callable): ASGI send.
+    """
+    loop = asyncio.get_running_loop()
+    remaining, include_result = stream
+    while remaining is None or remaining:
+        woken = asyncio.ensure_future(ready.wait())
+        done, _ = await asyncio.wait({woken, disconnected},
+                                     timeout=KEEPALIVE_SECONDS,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        woken.cancel()
+        if disconnected in done:
+            return
+        messages = [KEEPALIVE] if woken not in done else []
+        ready.clear()
+        for event in subscription.pop_all():
+            # Results may have been spilled to disk
+            message = await loop.run_in_executor(
+                _executor, job_event_message, event, remaining, include_result) \
+                if include_result else job_event_message(event, remaining, include_result)
+            if message is not None:
+                messages.append(message)
+        for message in messages:
+            await send({"type": "http.response.body", "body": message.encode(),
+                        "more_body": True})
+
+
+async def handle_events(scope, receive, send):
+    """
+    Answers a request to /api/events from the event loop, see events_request.
+
+    Returns False (the request is left to the Flask app) if it is malformed.
+    """
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def wakeup():
+        try:
+            loop.call_soon_threadsafe(ready.set)
+        except RuntimeError:
+            # The event loop is closed, nobody is listening anymore
+            pass
+
+    args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    try:
+        subscription, remaining, include_result = open_event_stream(args, wakeup)
+    except InvalidRequest:
+        return False
+    # The body was read, the next message tells that the client went away
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache")]})
+        await stream_events(subscription, (remaining, include_result), ready,
+                            disconnected, send)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        disconnected.cancel()
+        webserver.tasks_runner.events.unsubscribe(subscription)
+    return True
+
+
+async def handle_http(scope, receive, send):
+    """
+    Answers an HTTP request through the Flask app, long polls and event streams
+    waiting on the event loop.
+    """
+    body = await read_body(receive)
+    if scope["path"] == "/api/events" and scope["method"] == "GET" \
+            and await handle_events(scope, receive, send):
+        return
+    query_string = await long_poll(scope)
+    if query_string is not None:
+        scope = {**scope, "query_string": query_string.encode("latin-1")}
+
+    loop = asyncio.get_running_loop()
+    status, headers, response_body = await loop.run_in_executor(
+        _executor, call_wsgi, wsgi_environ(scope, body))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+
+    chunks = iter(response_body)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(_executor, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        if hasattr(response_body, "close"):
+            await loop.run_in_executor(_executor, response_body.close)
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def handle_lifespan(receive, send):
+    """
+    Acknowledges the startup and shutdown of the server; the app is set up at import.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    ASGI entry point.
+    """
+    if scope["type"] == "http":
+        await handle_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+
+
+def main():
+    """
+    Serves `application` with uvicorn, on 'ASGI_HOST' (default: 127.0.0.1) and
+    'ASGI_PORT' (default: 5000).
+    """
+    try:
+        import uvicorn  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        sys.exit("The ASGI front end needs an ASGI server: pip install uvicorn")
+    uvicorn.run(application, host=os.getenv("ASGI_HOST", "127.0.0.1"),
+                port=int(os.getenv("ASGI_PORT", "5000")))
+
+
+if __name__ == "__main__":
+    main()
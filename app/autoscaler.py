@@ -0,0 +1,131 @@
+"""
+Adaptive sizing of the ThreadPool.
+
+Provides `LoadTracker` (queue waits and busy time of the jobs, between two scaling
+decisions), `scaling_decision` (how many workers the pool should have given its load)
+and `Autoscaler`, the thread that periodically resizes the pool and keeps a log of
+its decisions.
+"""
+
+import time
+from collections import deque
+from threading import Lock, Thread
+
+from app.job_registry import RUNNING
+
+# Below this share of their time spent on jobs, the workers of an idle pool are too many
+LOW_UTILIZATION = 0.3
+
+# Scaling decisions kept for the job API
+MAX_DECISIONS = 100
+
+
+class LoadTracker:
+    """
+    Accumulates the queue waits and execution times of the jobs, until `take` reads them.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.num_jobs = 0
+        self.queue_wait = 0.0
+        self.busy = 0.0
+
+    def record(self, queue_wait, execution_time):
+        """
+        Records a job that waited `queue_wait` seconds in the queue and ran for
+        `execution_time` seconds.
+        """
+        with self.lock:
+            self.num_jobs += 1
+            self.queue_wait += queue_wait
+            self.busy += execution_time
+
+    def take(self):
+        """
+        Returns the load recorded since the previous call and starts over.
+
+        Returns:
+            tuple: (mean queue wait of the jobs in seconds, or 0 without jobs,
+            seconds the workers spent running jobs).
+        """
+        with self.lock:
+            mean_queue_wait = self.queue_wait / self.num_jobs if self.num_jobs else 0.0
+            busy = self.busy
+            self.num_jobs, self.queue_wait, self.busy = 0, 0.0, 0.0
+        return mean_queue_wait, busy
+
+
+def scaling_decision(workers, bounds, load, target_queue_wait):
+    """
+    Decides how many workers the pool should have.
+
+    - Grows (up to doubling) when tasks are queued and they either waited longer than
+    `target_queue_wait` or outnumber the workers.
+    - Shrinks by one worker when nothing is queued and the workers are mostly idle.
+
+    Args:
+        workers (int): current number of workers.
+        bounds (tuple): (min, max) number of workers.
+        load (tuple): (queue depth, mean queue wait in seconds, utilization in [0, 1]).
+        target_queue_wait (float): queue wait (seconds) above which the pool grows.
+
+    Returns:
+        tuple: (number of workers, reason), the reason being None when nothing changes.
+    """
+    min_workers, max_workers = bounds
+    depth, queue_wait, utilization = load
+    if depth > 0 and (queue_wait > target_queue_wait or depth >= workers) \
+            and workers < max_workers:
+        return min(max_workers, workers + min(depth, workers)), \
+            f"{depth} tasks queued, mean queue wait {queue_wait:.3f}s"
+    if depth == 0 and utilization < LOW_UTILIZATION and workers > min_workers:
+        return workers - 1, f"queue empty, utilization {utilization:.2f}"
+    return workers, None
+
+
+class Autoscaler(Thread):
+    """
+    Thread resizing a ThreadPool every `interval` seconds, until the pool shuts down.
+
+    - The utilization of the workers is the share of the interval they spent running
+    jobs, or the share of them running a job right now if that is higher.
+    - Every resize is logged in `decisions` (the latest MAX_DECISIONS of them).
+    """
+
+    def __init__(self, thread_pool, interval, target_queue_wait):
+        # Holds no work of its own, it must not keep the process alive
+        super().__init__(daemon=True)
+        self.thread_pool = thread_pool
+        self.interval = interval
+        self.target_queue_wait = target_queue_wait
+        self.decisions = deque(maxlen=MAX_DECISIONS)
+
+    def run(self):
+        last_time = time.monotonic()
+        while not self.thread_pool.shutdown_event.wait(self.interval):
+            now = time.monotonic()
+            self.step(now - last_time)
+            last_time = now
+
+    def step(self, elapsed):
+        """
+        Measures the load of the last `elapsed` seconds and resizes the pool if needed.
+        """
+        thread_pool = self.thread_pool
+        workers = thread_pool.num_workers
+        queue_wait, busy = thread_pool.load.take()
+        running = thread_pool.job_registry.counts()[RUNNING]
+        utilization = min(1.0, max(busy / (elapsed * workers), running / workers))
+        depth = thread_pool.task_queue.qsize()
+
+        new_workers, reason = scaling_decision(
+            workers, (thread_pool.min_threads, thread_pool.num_threads),
+            (depth, queue_wait, utilization), self.target_queue_wait)
+        if reason is not None and thread_pool.resize(new_workers):
+            self.decisions.append({
+                "time": round(time.time(), 3), "from": workers, "to": new_workers,
+                "reason": reason, "queue_depth": depth,
+                "queue_wait": round(queue_wait, 6),
+                "utilization": round(utilization, 3),
+            })
@@ -0,0 +1,490 @@
+"""
+Calculations behind the analytics endpoints.
+
+- Every 'calculate' function is independent of the webserver: the data source
+(nested dictionary, AggregateIndex or ColumnarStore), the questions, the states
+and the logger are all injected.
+- Every 'calculate' function takes an optional `years` (year_from, year_to) range;
+the data source must then be a ColumnarStore, whose year index selects the rows.
+- The route handlers in routes.py submit these functions as jobs to the thread pool.
+"""
+import heapq
+
+from app.aggregate_index import AggregateIndex
+from app.columnar_store import ColumnarStore, YearRange, iter_rows
+
+
+# Data sources that compute the aggregations themselves, instead of the nested loops below
+AGGREGATING_SOURCES = (AggregateIndex, ColumnarStore, YearRange)
+
+
+def _in_years(questions_dict, years):
+    """
+    Restricts a ColumnarStore to a (year_from, year_to) range, if one is given.
+    """
+    if years is None:
+        return questions_dict
+    if not isinstance(questions_dict, ColumnarStore):
+        raise TypeError("Filtering by years requires a ColumnarStore")
+    return YearRange(questions_dict, years)
+
+
+def calculate_states_mean(question, questions_dict, my_logger, years=None):
+    """
+    Calculates mean data values for each state across all stratifications
+    for a given question.
+
+    Args:
+        question (str): The text of the question to calculate state means for.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: A dictionary with state names as keys and their calculated mean values.
+            States are sorted by mean value in ascending order.
+    """
+    my_logger.info("Calculating answer for states_mean and question: %s", question)
+    questions_dict = _in_years(questions_dict, years)
+
+    if isinstance(questions_dict, AGGREGATING_SOURCES):
+        result = questions_dict.state_means(question)
+    else:
+        result = {}
+        states_dict = questions_dict[question]
+        for state, stratification_categories_dict in states_dict.items():
+            sum_values = 0
+            no_values = 0
+            for _, stratifications_dict in stratification_categories_dict.items():
+                for _, data_values_dict in stratifications_dict.items():
+                    for _, value in data_values_dict.items():
+                        sum_values += float(value)
+                        no_values += 1
+            if no_values > 0:
+                result[state] = sum_values / no_values
+    result = dict(sorted(result.items(), key=lambda item: item[1]))
+
+    my_logger.info("Got answer for states_mean and question: %s.", question)
+    my_logger.debug("Result of states_mean for question: %s is %s", question, result)
+
+    return result
+
+
+def calculate_state_mean(question, state, questions_dict, my_logger, years=None):
+    """
+    Calculates the mean data value for a specific question and state across all stratifications.
+
+    Args:
+        question (str): The text of the question to calculate the mean for.
+        state (str): The name of the state to calculate the mean for.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: A dictionary with the state name as the key and its calculated mean value.
+            Returns an empty dictionary if no data is available for the specified
+            question and state.
+    """
+    my_logger.info("Calculating answer for state_mean and question: %s, state: %s", question, state)
+    questions_dict = _in_years(questions_dict, years)
+
+    if isinstance(questions_dict, AGGREGATING_SOURCES):
+        result = questions_dict.state_means(question, state)
+    else:
+        result = {}
+        states_dict = questions_dict[question]
+        stratification_categories_dict = states_dict[state]
+        sum_values = 0
+        no_values = 0
+        for _, stratifications_dict in stratification_categories_dict.items():
+            for _, data_values_dict in stratifications_dict.items():
+                for _, value in data_values_dict.items():
+                    sum_values += float(value)
+                    no_values += 1
+        if no_values > 0:
+            result[state] = sum_values / no_values
+
+    my_logger.info("Got answer for state_mean and question: %s.", question)
+
+    return result
+
+
+def calculate_best5(question, questions_dict, questions_best_is_max, my_logger, years=None):
+    """
+    Identifies top/bottom 5 states based on mean values (question-dependent).
+
+    Args:
+        question (str): The question to analyze.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        questions_best_is_max: list of questions for which a larger value is better
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: Top/bottom 5 states with mean values (sorted).
+    """
+    my_logger.info("Calculating answer for best5 and question: %s", question)
+
+    temp_result = calculate_states_mean(question, questions_dict, my_logger, years)
+    if question in questions_best_is_max:
+        result = heapq.nlargest(5, temp_result.items(), key=lambda item: item[1])
+        sorted_result = dict(sorted(result, key=lambda item: item[1], reverse=True))
+    else:
+        result = heapq.nsmallest(5, temp_result.items(), key=lambda item: item[1])
+        sorted_result = dict(sorted(result, key=lambda item: item[1]))
+
+    my_logger.info("Got answer for best5 and question: %s.", question)
+    my_logger.debug("Result of best5 for question: %s is %s", question, sorted_result)
+
+    return sorted_result
+
+
+def calculate_worst5(question, questions_dict, questions_best_is_min, my_logger, years=None):
+    """
+    Similar to 'calculate_best5' but identifies bottom 5 states instead of top 5.
+
+    Refer to 'calculate_best5' docstring for details.
+
+    Args:
+        question (str): The question to analyze.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        questions_best_is_min: list of questions for which a smaller value is better
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: Bottom 5 states with mean values (sorted).
+    """
+    my_logger.info("Calculating answer for worst5 and question: %s", question)
+
+    temp_result = calculate_states_mean(question, questions_dict, my_logger, years)
+    if question in questions_best_is_min:
+        result = heapq.nlargest(5, temp_result.items(), key=lambda item: item[1])
+        sorted_result = dict(sorted(result, key=lambda item: item[1], reverse=True))
+    else:
+        result = heapq.nsmallest(5, temp_result.items(), key=lambda item: item[1])
+        sorted_result = dict(sorted(result, key=lambda item: item[1]))
+
+    my_logger.info("Got answer for worst5 and question: %s.", question)
+    my_logger.debug("Result of worst5 for question: %s is %s", question, sorted_result)
+
+    return sorted_result
+
+
+def calculate_global_mean(question, questions_dict, my_logger, years=None):
+    """
+    Calculates the overall mean value for a given question across all states and stratifications.
+
+    Args:
+        question (str): The text of the question to calculate the global mean for.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: A dictionary containing the global mean value under the key "global_mean".
+            Returns an empty dictionary if no data is available for the specified question
+            (e.g. no rows in the years range).
+    """
+    my_logger.info("Calculating answer for global_mean and question: %s", question)
+    questions_dict = _in_years(questions_dict, years)
+
+    result = {}
+    if isinstance(questions_dict, AGGREGATING_SOURCES):
+        global_mean = questions_dict.global_mean(question)
+        if global_mean is not None:
+            result["global_mean"] = global_mean
+    else:
+        sum_values = 0
+        no_values = 0
+        states_dict = questions_dict[question]
+        for _, stratification_categories_dict in states_dict.items():
+            for _, stratifications_dict in stratification_categories_dict.items():
+                for _, data_values_dict in stratifications_dict.items():
+                    for _, value in data_values_dict.items():
+                        sum_values += float(value)
+                        no_values += 1
+        if no_values > 0:
+            result["global_mean"] = sum_values / no_values
+
+    my_logger.info("Got answer for global_mean and question: %s.", question)
+    my_logger.debug("Result of global_mean for question: %s is %s", question, result)
+
+    return result
+
+
+def calculate_diff_from_mean(question, questions_dict, my_logger, years=None):
+    """
+    Calculates state differences from global mean for a question.
+
+    Args:
+        question (str): The question to analyze.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: State names with differences from global mean, empty without data
+            (e.g. no rows in the years range).
+    """
+    my_logger.info("Calculating answer for diff_from_mean and question: %s", question)
+
+    global_mean = calculate_global_mean(question, questions_dict, my_logger, years)
+    states_mean = calculate_states_mean(question, questions_dict, my_logger, years)
+    result = {}
+    if global_mean:
+        result = {key: global_mean["global_mean"] - value for key, value in states_mean.items()}
+
+    my_logger.info("Got answer for diff_from_mean and question: %s.", question)
+    my_logger.debug("Result of diff_from_mean for question: %s is %s", question, result)
+
+    return result
+
+
+def calculate_state_diff_from_mean(question, state, questions_dict, my_logger, years=None):
+    """
+    Calculates difference between global mean and state mean for a question and state.
+
+    Args:
+        question (str): The question to analyze.
+        state (str): The state to compare.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: State and its difference from global mean, empty if the state has no data
+            (e.g. no rows in the years range).
+    """
+    my_logger.info("Calculating answer for state_diff_from_mean and question: %s, state: %s",
+                   question, state)
+
+    global_mean = calculate_global_mean(question, questions_dict, my_logger, years)
+    state_mean = calculate_state_mean(question, state, questions_dict, my_logger, years)
+
+    result = {}
+    if global_mean and state in state_mean:
+        result = {state: global_mean["global_mean"] - state_mean[state]}
+
+    my_logger.info("Got answer for state_diff_from_mean and question: %s, state: %s.",
+                   question, state)
+    my_logger.debug("Result of state_diff_from_mean for question: %s, state: %s is %s",
+                    question, state, result)
+
+    return result
+
+
+def calculate_mean_by_category(question, questions_dict, my_logger, years=None):
+    """
+    Calculates mean values for each category (state, stratification category, stratification)
+    within a question.
+
+    - Iterates through question data structure to calculate mean for each combination of
+    state, stratification category, and stratification.
+    - Skips empty categories or stratifications to avoid division by zero.
+
+    Args:
+        question (str): The text of the question to analyze.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+
+    Returns:
+        dict: A dictionary with keys representing category combinations
+        (state, stratification category, stratification) and their corresponding mean values.
+    """
+    my_logger.info("Calculating answer for mean_by_category and question: %s", question)
+    questions_dict = _in_years(questions_dict, years)
+
+    result = {}
+    if isinstance(questions_dict, AGGREGATING_SOURCES):
+        result = _aggregated_mean_by_category(questions_dict, question)
+    else:
+        for state, stratification_categories_dict in questions_dict[question].items():
+            for stratification_category, stratifications_dict in \
+                    stratification_categories_dict.items():
+                for stratification, data_values_dict in stratifications_dict.items():
+                    sum_values = 0
+                    no_values = 0
+                    for _, value in data_values_dict.items():
+                        sum_values += float(value)
+                        no_values += 1
+                    if no_values > 0 and stratification_category != "" and stratification != "":
+                        new_key = _category_key(state, stratification_category, stratification)
+                        result[new_key] = sum_values / no_values
+
+    my_logger.info("Got answer for mean_by_category and question: %s.", question)
+    my_logger.debug("Result of mean_by_category for question: %s is %s", question, result)
+
+    return result
+
+
+def _category_key(*names):
+    """
+    Formats names like the string representation of a tuple, e.g. "('Gender', 'Male')".
+    """
+    return "(" + ", ".join("\'" + name + "\'" for name in names) + ")"
+
+
+def _aggregated_mean_by_category(source, question, state=None):
+    """
+    'mean_by_category' (or 'state_mean_by_category' when a state is given)
+    on an AggregateIndex or a ColumnarStore.
+    """
+    result = {}
+    for group_state, stratification_category, stratification, mean in \
+            source.category_means(question, state):
+        if stratification_category != "" and stratification != "":
+            names = (stratification_category, stratification)
+            if state is None:
+                names = (group_state,) + names
+            result[_category_key(*names)] = mean
+    return result
+
+
+def calculate_state_mean_by_category(question, state, questions_dict, my_logger, years=None):
+    """
+    Calculates mean values for categories within a specific state of a question.
+
+    - Iterates through the specified state's data to calculate means for each combination of
+    stratification category and stratification.
+    - Skips empty categories or stratifications to avoid division by zero.
+
+    Args:
+        question (str): The text of the question to analyze.
+        state (str): The name of the state to calculate means for.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+
+    Returns:
+        dict: A dictionary with the state name as the key and a nested dictionary containing
+        mean values for category combinations (stratification category, stratification).
+    """
+    my_logger.info("Calculating answer for state_mean_by_category and question: %s, state: %s",
+                   question, state)
+    questions_dict = _in_years(questions_dict, years)
+
+    result = {state: {}}
+    if isinstance(questions_dict, AGGREGATING_SOURCES):
+        result[state] = _aggregated_mean_by_category(questions_dict, question, state)
+    else:
+        stratification_categories_dict = questions_dict[question][state]
+        for stratification_category, stratifications_dict in \
+                stratification_categories_dict.items():
+            for stratification, data_values_dict in stratifications_dict.items():
+                sum_values = 0
+                no_values = 0
+                for _, value in data_values_dict.items():
+                    sum_values += float(value)
+                    no_values += 1
+                if no_values > 0 and stratification_category != "" and stratification != "":
+                    new_key = _category_key(stratification_category, stratification)
+                    result[state][new_key] = sum_values / no_values
+
+    my_logger.info("Got answer for state_mean_by_category and question: %s, state: %s.",
+                   question, state)
+
+    return result
+
+
+def calculate_state_trend(question, state, questions_dict, my_logger, years=None):
+    """
+    Calculates the trend over the years of every state (or of a single state) for a question.
+
+    Args:
+        question (str): The text of the question to analyze.
+        state (str): The name of the state to analyze, or None for all states.
+        questions_dict: the data source, a ColumnarStore
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        dict: A dictionary with state names as keys and, for each state, the mean of every
+        year ("means"), the change from the previous year ("deltas") and the least-squares
+        slope of the means ("slope", None with fewer than two years).
+    """
+    my_logger.info("Calculating answer for state_trend and question: %s, state: %s",
+                   question, state)
+
+    if not isinstance(questions_dict, ColumnarStore):
+        raise TypeError("state_trend requires a ColumnarStore")
+    result = questions_dict.state_trends(question, state, years)
+
+    my_logger.info("Got answer for state_trend and question: %s, state: %s.", question, state)
+
+    return result
+
+
+# Endpoints that can be part of a batch -> (calculate function, whether it takes a state)
+BATCH_ENDPOINTS = {
+    "states_mean": (calculate_states_mean, False),
+    "state_mean": (calculate_state_mean, True),
+    "best5": (calculate_best5, False),
+    "worst5": (calculate_worst5, False),
+    "global_mean": (calculate_global_mean, False),
+    "diff_from_mean": (calculate_diff_from_mean, False),
+    "state_diff_from_mean": (calculate_state_diff_from_mean, True),
+    "mean_by_category": (calculate_mean_by_category, False),
+    "state_mean_by_category": (calculate_state_mean_by_category, True),
+}
+
+
+def calculate_batch(items, questions_dict, questions_best, my_logger, years=None):
+    """
+    Answers several queries (items) with a single job.
+
+    - Groups the items by question and aggregates the data of each question once, in a
+    single pass, into an AggregateIndex. If the data source already is an AggregateIndex,
+    it is used as it is.
+    - Answers every item from those aggregates, with the usual 'calculate' functions.
+
+    Args:
+        items (list): dictionaries with an endpoint, a question and (if needed) a state.
+        questions_dict: the data source (nested dictionary, AggregateIndex or ColumnarStore)
+        questions_best: the questions for which a larger value is better, and
+        the ones for which a smaller value is better
+        my_logger: useful for debug
+        years: optional (year_from, year_to) range of the rows to aggregate
+
+    Returns:
+        list: the items, in order, each with its result under "data"
+        (or the reason it could not be answered under "error").
+    """
+    my_logger.info("Calculating answer for batch of %s items", len(items))
+    questions_dict = _in_years(questions_dict, years)
+
+    # Unknown questions are skipped here, the items asking for them fail below
+    questions = dict.fromkeys(item["question"] for item in items)
+    if isinstance(questions_dict, AggregateIndex):
+        source = questions_dict
+    elif isinstance(questions_dict, (ColumnarStore, YearRange)):
+        source = AggregateIndex(row for question in questions
+                                if question in questions_dict.question_slices
+                                for row in questions_dict.iter_rows(question))
+    else:
+        source = AggregateIndex(iter_rows({question: questions_dict[question]
+                                           for question in questions
+                                           if question in questions_dict}))
+
+    result = []
+    for item in items:
+        compute_function, takes_state = BATCH_ENDPOINTS[item["endpoint"]]
+        args = [item["question"]] + ([item["state"]] if takes_state else []) + [source]
+        if item["endpoint"] == "best5":
+            args.append(questions_best[0])
+        elif item["endpoint"] == "worst5":
+            args.append(questions_best[1])
+        answer = dict(item)
+        try:
+            answer["data"] = compute_function(*args, my_logger)
+        except KeyError as error:
+            answer["error"] = f"KeyError: {error}"
+        result.append(answer)
+
+    my_logger.info("Got answer for batch of %s items", len(items))
+
+    return result
@@ -0,0 +1,389 @@
+"""
+Columnar, NumPy-backed representation of the ingested data.
+
+Provides the `ColumnarStore` class, an alternative to the nested
+`DataIngestor.questions_dict` in which every aggregation is a vectorized group-by.
+"""
+
+from threading import Lock
+
+import numpy as np
+
+# Row indexes of the code columns in `ColumnarStore.codes`
+QUESTION, STATE, CATEGORY, STRATIFICATION, YEAR = range(5)
+
+
+def _grouped_sums(keys, values):
+    """
+    Groups `values` by `keys` and adds them up.
+
+    np.bincount accumulates the weights sequentially, in row order, so every sum
+    is computed exactly like the nested loops over `questions_dict` compute it.
+
+    Returns:
+        tuple: first row of every group, group sums and group counts,
+        all ordered by the first appearance of the group.
+    """
+    _, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(first_rows))
+    counts = np.bincount(inverse, minlength=len(first_rows))
+    order = np.argsort(first_rows, kind='stable')
+    return first_rows[order], sums[order], counts[order]
+
+
+def _least_squares_slopes(groups, x_values, y_values):
+    """
+    Slope of the least-squares line through the (x, y) points of every group.
+
+    Returns:
+        list: the slope of every group, None for groups with fewer than two distinct x values.
+    """
+    sizes = np.bincount(groups)
+    x_diffs = x_values - (np.bincount(groups, x_values) / sizes)[groups]
+    y_diffs = y_values - (np.bincount(groups, y_values) / sizes)[groups]
+    covariances = np.bincount(groups, x_diffs * y_diffs)
+    variances = np.bincount(groups, x_diffs * x_diffs)
+    return [float(covariance / variance) if variance > 0 else None
+            for covariance, variance in zip(covariances, variances)]
+
+
+def iter_rows(questions_dict):
+    """
+    Flattens the nested `questions_dict` into
+    (question, state, category, stratification, year, value) rows, in traversal order.
+    """
+    for question, states_dict in questions_dict.items():
+        for state, stratification_categories_dict in states_dict.items():
+            for category, stratifications_dict in stratification_categories_dict.items():
+                for stratification, data_values_dict in stratifications_dict.items():
+                    for year, value in data_values_dict.items():
+                        yield question, state, category, stratification, year, value
+
+
+class ColumnarStore:  # pylint: disable=too-many-instance-attributes
+    """
+    Stores the ingested data column by column.
+
+    **Attributes:**
+
+    * `values` (np.ndarray): float64 data values, one per row.
+    * `codes` (np.ndarray): int32 matrix of shape (5, rows). Each line is an
+    integer-coded column (question, state, category, stratification, year).
+    * `tables` (list): for each code column, the list of names indexed by code.
+    * `lookup` (list): for each code column, a dict mapping names to codes.
+    * `question_slices` (dict): question -> (start, stop) range of its rows.
+    * `year_ends` (np.ndarray): int32 end year (YearEnd) of every row.
+    * `duplicates` (np.ndarray): bool, True for the rows repeating a year of their
+    (state, category, stratification) group, which `DataIngestor.questions_dict` leaves out.
+    * `year_index` (tuple): int64 row numbers sorted by start year within each question
+    (duplicates excluded), and their int32 start years, see `get_year_index`.
+
+    Rows follow the traversal order of `DataIngestor.questions_dict`, so the means
+    returned here are identical to the ones computed by the loops in `app/routes.py`.
+    The duplicate rows of a question come last in its range. They are kept, but never
+    aggregated: with or without a years range, every request sees the first value of each
+    year, the rows of `questions_dict`.
+
+    The aggregations accept an optional `years` (year_from, year_to) range, either bound
+    may be None. Rows are then selected through the year index with a binary search
+    instead of a scan, and put back in row order so that sums are still accumulated in
+    traversal order. The index is built with the store by `from_rows`, i.e. at ingest time
+    and before the worker processes are forked, and is mapped from the snapshot along
+    with the other arrays (see `app/snapshot.py`).
+    """
+
+    def __init__(self, values, codes, tables, year_ends=None, duplicates=None):
+        self.values = values
+        self.codes = codes
+        self.tables = tables
+        self.year_ends = year_ends if year_ends is not None else self._start_years()
+        self.duplicates = duplicates if duplicates is not None \
+            else np.zeros(len(values), dtype=np.bool_)
+        self.year_index = None
+        self.year_index_lock = Lock()
+        self.lookup = [{name: code for code, name in enumerate(table)} for table in tables]
+
+        # Rows of a question are contiguous, remember where each question starts and stops
+        self.question_slices = {}
+        # question -> end of the rows that are not duplicates, at the start of its range
+        self.unique_stops = {}
+        question_codes = codes[QUESTION]
+        if len(question_codes) > 0:
+            starts = np.flatnonzero(np.diff(question_codes)) + 1
+            starts = np.concatenate(([0], starts))
+            stops = np.concatenate((starts[1:], [len(question_codes)]))
+            for start, stop in zip(starts, stops):
+                question = tables[QUESTION][question_codes[start]]
+                self.question_slices[question] = (int(start), int(stop))
+                self.unique_stops[question] = int(
+                    start + np.count_nonzero(~self.duplicates[start:stop]))
+
+    @classmethod
+    def from_questions_dict(cls, questions_dict, year_ends=None, duplicates=()):
+        """
+        Builds a store from the nested dictionary produced by `DataIngestor`.
+
+        `year_ends` maps (question, state, category, stratification, year) to the end
+        year of the rows whose end year differs from their start year. `duplicates` are
+        the (question, state, category, stratification, year, value, end year) rows left
+        out of `questions_dict`, stored after the rows of their question.
+        """
+        year_ends = year_ends or {}
+        question_duplicates = {}
+        for row in duplicates:
+            question_duplicates.setdefault(row[QUESTION], []).append(tuple(row) + (True,))
+
+        def rows():
+            for question, states_dict in questions_dict.items():
+                for row in iter_rows({question: states_dict}):
+                    yield row + (year_ends.get(row[:5], row[YEAR]), False)
+                yield from question_duplicates.get(question, ())
+
+        return cls.from_rows(rows())
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a store from (question, state, category, stratification, year, value) rows,
+        optionally followed by the end year of the row (the start year by default) and
+        whether it is a duplicate (False by default). The rows of a question must be
+        contiguous, its duplicates last.
+        """
+        tables = [[] for _ in range(5)]
+        lookup = [{} for _ in range(5)]
+        columns = [[] for _ in range(5)]
+        values = []
+        year_ends = []
+        duplicates = []
+
+        for row in rows:
+            for column, name in enumerate(row[:5]):
+                code = lookup[column].get(name)
+                if code is None:
+                    code = len(tables[column])
+                    lookup[column][name] = code
+                    tables[column].append(name)
+                columns[column].append(code)
+            values.append(float(row[5]))
+            year_ends.append(int(row[6] if len(row) > 6 else row[YEAR]))
+            duplicates.append(len(row) > 7 and row[7])
+
+        codes = np.array(columns, dtype=np.int32).reshape(5, len(values))
+        store = cls(np.array(values, dtype=np.float64), codes, tables,
+                    np.array(year_ends, dtype=np.int32), np.array(duplicates, dtype=np.bool_))
+        # Built at ingest time, before any worker process is forked or request served
+        store.get_year_index()
+        return store
+
+    def _start_years(self):
+        """
+        Returns the start year of every row, as int32.
+        """
+        start_years = np.array([int(year) for year in self.tables[YEAR]], dtype=np.int32)
+        return start_years[self.codes[YEAR]]
+
+    def get_year_index(self):
+        """
+        Returns the row numbers sorted by start year within each question, and their start years.
+        Only the rows that are not duplicates are sorted, the others keep their position.
+
+        The index is built once, under a lock, if the store was not given one.
+        """
+        if self.year_index is None:
+            with self.year_index_lock:
+                if self.year_index is None:
+                    start_years = self._start_years()
+                    year_order = np.arange(len(self.values), dtype=np.int64)
+                    for question, (start, _) in self.question_slices.items():
+                        stop = self.unique_stops[question]
+                        year_order[start:stop] = start + np.argsort(start_years[start:stop],
+                                                                    kind='stable')
+                    self.year_index = (year_order, start_years[year_order])
+        return self.year_index
+
+    def _rows_in_years(self, start, stop, years):
+        """
+        Returns the row numbers in [start, stop) whose years fall in the `years` range,
+        in row order.
+        """
+        year_from, year_to = years
+        year_order, sorted_years = self.get_year_index()
+        question_years = sorted_years[start:stop]
+        low = 0 if year_from is None else np.searchsorted(question_years, year_from, 'left')
+        high = len(question_years) if year_to is None \
+            else np.searchsorted(question_years, year_to, 'right')
+        rows = np.sort(year_order[start + low:start + high])
+        if year_to is not None:
+            rows = rows[self.year_ends[rows] <= year_to]
+        return rows
+
+    def _rows(self, question, state=None, years=None):
+        """
+        Returns the values and codes of the rows for a question (and optionally a state
+        and a years range).
+
+        Raises KeyError for an unknown question or state, like `questions_dict` does.
+        A state with rows for the question, but none in the years range, has no rows.
+        Duplicate rows are never selected.
+        """
+        start = self.question_slices[question][0]
+        stop = self.unique_stops[question]
+        if years is None:
+            values = self.values[start:stop]
+            codes = self.codes[:, start:stop]
+        else:
+            rows = self._rows_in_years(start, stop, years)
+            values = self.values[rows]
+            codes = self.codes[:, rows]
+        if state is not None:
+            state_code = self.lookup[STATE][state]
+            mask = codes[STATE] == state_code
+            if not mask.any() and (years is None or
+                                   not (self.codes[STATE, start:stop] == state_code).any()):
+                raise KeyError(state)
+            values = values[mask]
+            codes = codes[:, mask]
+        return values, codes
+
+    def iter_rows(self, question=None, years=None):
+        """
+        Yields the (question, state, category, stratification, year, value) rows that
+        are not duplicates, of a question (optionally in a years range) or of all the
+        questions, in row order.
+        """
+        if question is None:
+            unique = ~self.duplicates
+            values, codes = self.values[unique], self.codes[:, unique]
+        else:
+            values, codes = self._rows(question, years=years)
+        columns = [[self.tables[column][code] for code in codes[column].tolist()]
+                   for column in range(5)]
+        yield from zip(*columns, values.tolist())
+
+    def state_means(self, question, state=None, years=None):
+        """
+        Mean value of every state (or only of `state`) for a question.
+
+        Returns:
+            dict: state name -> mean, in order of first appearance.
+        """
+        values, codes = self._rows(question, state, years)
+        first_rows, sums, counts = _grouped_sums(codes[STATE], values)
+        states = self.tables[STATE]
+        return {states[codes[STATE][row]]: float(total / count)
+                for row, total, count in zip(first_rows, sums, counts)}
+
+    def global_mean(self, question, years=None):
+        """
+        Mean value of all the rows of a question, or None if it has no rows.
+        """
+        values, _ = self._rows(question, years=years)
+        if len(values) == 0:
+            return None
+        total = np.bincount(np.zeros(len(values), dtype=np.intp), weights=values)[0]
+        return float(total / len(values))
+
+    def category_means(self, question, state=None, years=None):
+        """
+        Mean value of every (state, stratification category, stratification) group
+        of a question, optionally restricted to a single state.
+
+        Returns:
+            list: (state, category, stratification, mean) tuples, in order of first appearance.
+        """
+        values, codes = self._rows(question, state, years)
+        num_categories = len(self.tables[CATEGORY])
+        num_stratifications = len(self.tables[STRATIFICATION])
+        keys = ((codes[STATE].astype(np.int64) * num_categories + codes[CATEGORY])
+                * num_stratifications + codes[STRATIFICATION])
+        first_rows, sums, counts = _grouped_sums(keys, values)
+        states, categories, stratifications = (self.tables[STATE], self.tables[CATEGORY],
+                                               self.tables[STRATIFICATION])
+        return [(states[codes[STATE][row]], categories[codes[CATEGORY][row]],
+                 stratifications[codes[STRATIFICATION][row]], float(total / count))
+                for row, total, count in zip(first_rows, sums, counts)]
+
+    def _state_year_groups(self, values, codes):
+        """
+        Groups rows by (state, year), ordered by state first appearance and then by year.
+
+        Returns:
+            tuple: state codes, year codes and means of the groups, the boundaries of the
+            runs of groups of every state and the least-squares slope of every run.
+        """
+        first_rows, sums, counts = _grouped_sums(
+            codes[STATE].astype(np.int64) * len(self.tables[YEAR]) + codes[YEAR], values)
+
+        state_codes, year_codes = codes[STATE][first_rows], codes[YEAR][first_rows]
+        _, first_groups, states = np.unique(state_codes, return_index=True, return_inverse=True)
+        year_numbers = np.array([int(year) for year in self.tables[YEAR]],
+                                dtype=np.float64)[year_codes]
+        order = np.lexsort((year_numbers, first_groups[states]))
+        states, means = states[order], (sums / counts)[order]
+
+        starts = np.flatnonzero(np.diff(states, prepend=-1))
+        slopes = _least_squares_slopes(states, year_numbers[order], means)
+        return (state_codes[order], year_codes[order], means, np.append(starts, len(states)),
+                [slopes[group] for group in states[starts].tolist()])
+
+    def state_trends(self, question, state=None, years=None):
+        """
+        Per-year means of every state (or only of `state`) for a question, their
+        year-over-year deltas and the least-squares slope of the means over the years.
+
+        Everything is computed with grouped sums over the rows of the question,
+        without a pass per year or per state.
+
+        Returns:
+            dict: state name -> {"means": {year: mean}, "deltas": {year: mean minus the
+            mean of the previous year with data}, "slope": slope per year, None with fewer
+            than two years}. States are in order of first appearance, years ascending.
+        """
+        state_codes, year_codes, means, bounds, slopes = \
+            self._state_year_groups(*self._rows(question, state, years))
+
+        result = {}
+        for start, stop, slope in zip(bounds[:-1].tolist(), bounds[1:].tolist(), slopes):
+            year_names = [self.tables[YEAR][code] for code in year_codes[start:stop].tolist()]
+            result[self.tables[STATE][state_codes[start]]] = {
+                "means": dict(zip(year_names, means[start:stop].tolist())),
+                "deltas": dict(zip(year_names[1:], np.diff(means[start:stop]).tolist())),
+                "slope": slope,
+            }
+        return result
+
+
+class YearRange:
+    """
+    A ColumnarStore restricted to a (year_from, year_to) range of years, either bound
+    may be None. Offers the aggregations of the store, applied to the rows in the range.
+    """
+
+    def __init__(self, store, years):
+        self.store = store
+        self.years = years
+        self.question_slices = store.question_slices
+
+    def iter_rows(self, question):
+        """
+        Yields the rows of a question in the range, in row order.
+        """
+        return self.store.iter_rows(question, self.years)
+
+    def state_means(self, question, state=None):
+        """
+        See ColumnarStore.state_means.
+        """
+        return self.store.state_means(question, state, self.years)
+
+    def global_mean(self, question):
+        """
+        See ColumnarStore.global_mean.
+        """
+        return self.store.global_mean(question, self.years)
+
+    def category_means(self, question, state=None):
+        """
+        See ColumnarStore.category_means.
+        """
+        return self.store.category_means(question, state, self.years)
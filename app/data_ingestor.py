@@ -6,9 +6,102 @@ containing information about physical activity levels across various states and
 """
 
 import csv
+import itertools
+import time
+from operator import itemgetter
+from threading import Lock
 
+from app.aggregate_index import AggregateIndex
+from app.columnar_store import ColumnarStore
+from app.snapshot import load_snapshot, snapshot_key, write_snapshot
 
-class DataIngestor:
+BACKENDS = ("dict", "columnar", "index", "mmap")
+
+# Where the "mmap" backend keeps its snapshot when no snapshot directory is given
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+
+# The only CSV columns that are used, in the order they are read
+COLUMNS = ('Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1',
+           'YearStart', 'Data_Value')
+# Read after COLUMNS when the CSV has it, otherwise the start year is used
+YEAR_END_COLUMN = 'YearEnd'
+
+# Questions for which the smallest, respectively the largest value is the best
+QUESTIONS_BEST_IS_MIN = [
+    'Percent of adults aged 18 years and older who have an overweight classification',
+    'Percent of adults aged 18 years and older who have obesity',
+    'Percent of adults who engage in no leisure-time physical activity',
+    'Percent of adults who report consuming fruit less than one time daily',
+    'Percent of adults who report consuming vegetables less than one time daily'
+]
+
+QUESTIONS_BEST_IS_MAX = [
+    'Percent of adults who achieve at least 150 minutes a week of moderate-intensity '
+    'aerobic physical activity or 75 minutes a week of vigorous-intensity '
+    'aerobic activity (or an equivalent combination)',
+
+    'Percent of adults who achieve at least 150 minutes a week of '
+    'moderate-intensity aerobic physical activity or 75 minutes a '
+    'week of vigorous-intensity aerobic physical activity and engage '
+    'in muscle-strengthening activities on 2 or more days a week',
+
+    'Percent of adults who achieve at least 300 minutes a week of '
+    'moderate-intensity aerobic physical activity or 150 minutes a '
+    'week of vigorous-intensity aerobic activity (or an equivalent combination)',
+    'Percent of adults who engage in muscle-strengthening activities on 2 '
+    'or more days a week',
+]
+
+# Every DataIngestor gets a new version, used to tell apart results computed on other data
+_versions = itertools.count(1)
+
+
+def read_rows(csv_path, stats):
+    """
+    Streams the (question, state, category, stratification, year, value, year_end) rows
+    of a CSV file.
+
+    - Rows are read as plain lists and only the COLUMNS (and YEAR_END_COLUMN) are
+    picked out of them.
+    - Data values are parsed to floats once, here; rows without a value are skipped.
+    - `stats` is filled with the number of rows read ("rows") and skipped ("skipped").
+    """
+    stats["rows"] = stats["skipped"] = 0
+    with open(csv_path, 'r', encoding='utf-8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        header = next(csvreader, [])
+        indexes = [header.index(column) for column in COLUMNS]
+        indexes.append(header.index(YEAR_END_COLUMN) if YEAR_END_COLUMN in header
+                       else indexes[COLUMNS.index('YearStart')])
+        pick_columns = itemgetter(*indexes)
+
+        for row in csvreader:
+            question, state_name, stratification_category, stratification, year, \
+                data_value, year_end = pick_columns(row)
+            if data_value.strip() == "":
+                stats["skipped"] += 1
+                continue
+            stats["rows"] += 1
+            yield (question, state_name, stratification_category, stratification, year,
+                   float(data_value), year_end)
+
+
+def nest_rows(rows):
+    """
+    Builds the nested dictionary described in `DataIngestor` from (question, state,
+    category, stratification, year, value) rows, in their order.
+    """
+    questions_dict = {}
+    for question, state_name, stratification_category, stratification, year, data_value \
+            in rows:
+        questions_dict.setdefault(question, {}) \
+            .setdefault(state_name, {}) \
+            .setdefault(stratification_category, {}) \
+            .setdefault(stratification, {})[year] = data_value
+    return questions_dict
+
+
+class DataIngestor:  # pylint: disable=too-many-instance-attributes
     """
        Ingests and organizes data from a CSV file related to physical activity.
 
@@ -24,67 +117,189 @@ class DataIngestor:
                        - Key (inner): Stratification (string)
                        - Value (inner dictionary):
                            - Key (inner): Year (string)
-                           - Value (inner): Data value (string)
+                           - Value (inner): Data value (float)
+       None for the "mmap" backend.
+       * `aggregate_index` (AggregateIndex): sums and counts precomputed at ingest time,
+       None for the "mmap" backend.
+       * `columnar_store` (ColumnarStore): the same data stored column by column,
+       with the end year of every row. It answers the requests filtered by year
+       whatever the backend. With the "dict" and "index" backends, it is only built
+       (from `questions_dict`) when first used.
+       * `data_source`: the representation handed to the `calculate_*` functions,
+       `questions_dict`, `aggregate_index` or `columnar_store` depending on the backend.
+       * `version` (int): identifies the ingested data, e.g. in the keys of cached results.
+       * `ingest_stats` (dict): rows ingested, skipped (no data value) and
+       duplicated (a second value for the same year, only in `columnar_store`), seconds
+       spent building the DataIngestor and rows per second. "step_seconds" breaks the
+       time down by step ("read_csv", "load_snapshot", "write_snapshot", "questions_dict",
+       "aggregate_index", "columnar_store"), a lazily built `columnar_store` being added
+       when it is built. With a snapshot directory, "snapshot" tells whether the snapshot
+       was "loaded", "written" or could not be written ("unavailable").
+
+       When `snapshot_dir` is given, the data is loaded from a binary snapshot of the
+       CSV file (see `app/snapshot.py`) if there is one, and a snapshot is written otherwise.
+       The "mmap" backend always uses a snapshot (in DEFAULT_SNAPSHOT_DIR by default) and
+       computes directly on its read-only memory-mapped arrays: server processes mapping
+       the same snapshot share its pages instead of each holding a copy of the data.
        """
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, backend: str = "index", snapshot_dir: str = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown data backend '{backend}', expected one of {BACKENDS}")
+
+        start_time = time.perf_counter()
+        self.ingest_stats = {"step_seconds": {}}
+        self._columnar_store = None
+        # (year_ends, duplicates) read from the CSV, until the ColumnarStore is built from them
+        self._columnar_rows = None
+        self.columnar_lock = Lock()
+        if backend == "mmap":
+            # Only the memory-mapped snapshot is kept, shared with every process mapping it
+            self.questions_dict = self.aggregate_index = None
+            self._columnar_store = self._map_snapshot(csv_path,
+                                                     snapshot_dir or DEFAULT_SNAPSHOT_DIR)
+        elif snapshot_dir:
+            self.questions_dict = self._load_questions_dict(csv_path, snapshot_dir)
+        else:
+            self.questions_dict = self._timed("read_csv", self._read_questions_dict, csv_path)
+        self.version = next(_versions)
+
+        if self.questions_dict is not None:
+            self.aggregate_index = self._timed("aggregate_index",
+                                               AggregateIndex.from_questions_dict,
+                                               self.questions_dict)
 
-        self.questions_dict = {}
+        self.data_source = self.questions_dict
+        if backend == "mmap":
+            self.data_source = self.columnar_store
+        elif backend == "index":
+            self.data_source = self.aggregate_index
+        elif backend == "columnar":
+            self.data_source = self.columnar_store
 
-        with open(csv_path, 'r', encoding='utf-8') as csvfile:
-            csvreader = csv.DictReader(csvfile)
+        self.questions_best_is_min = QUESTIONS_BEST_IS_MIN
+        self.questions_best_is_max = QUESTIONS_BEST_IS_MAX
+        self._record_time(start_time)
 
-            for row in csvreader:
-                state_name = row['LocationDesc']
-                year = row['YearStart']
-                question = row['Question']
-                data_value = row['Data_Value']
-                stratification_category = row['StratificationCategory1']
-                stratification = row['Stratification1']
+    @property
+    def columnar_store(self):
+        """
+        The ColumnarStore of the data, built under a lock on first use when it was not
+        loaded from a snapshot.
+        """
+        if self._columnar_store is None:
+            with self.columnar_lock:
+                if self._columnar_store is None:
+                    year_ends, duplicates = self._columnar_rows
+                    self._columnar_store = self._timed(
+                        "columnar_store", ColumnarStore.from_questions_dict,
+                        self.questions_dict, year_ends, duplicates)
+                    self._columnar_rows = None
+        return self._columnar_store
 
-                if question not in self.questions_dict:
-                    self.questions_dict[question] = {}
+    def _read_questions_dict(self, csv_path):
+        """
+        Streams the CSV file into the nested dictionary described in the class docstring,
+        and keeps what `columnar_store` is built from.
 
-                states_dict = self.questions_dict[question]
+        The dictionary only keeps the first value of each year. The other rows of the
+        same year are kept (flagged, not aggregated) in `columnar_store` and counted in
+        `ingest_stats["duplicates"]`.
+        """
+        questions_dict = {}
+        # (question, state, category, stratification, year) -> end year, when it is not `year`
+        year_ends = {}
+        duplicates = []
 
-                if state_name not in states_dict:
-                    states_dict[state_name] = {}
+        for question, state_name, stratification_category, stratification, year, data_value, \
+                year_end in read_rows(csv_path, self.ingest_stats):
+            data_values_dict = questions_dict.setdefault(question, {}) \
+                .setdefault(state_name, {}) \
+                .setdefault(stratification_category, {}) \
+                .setdefault(stratification, {})
 
-                stratification_categories_dict = states_dict[state_name]
+            if year not in data_values_dict:
+                data_values_dict[year] = data_value
+                if year_end != year:
+                    year_ends[question, state_name, stratification_category, stratification,
+                              year] = year_end
+            else:
+                duplicates.append((question, state_name, stratification_category,
+                                   stratification, year, data_value, year_end))
 
-                if stratification_category not in stratification_categories_dict:
-                    stratification_categories_dict[stratification_category] = {}
+        self.ingest_stats["duplicates"] = len(duplicates)
+        self._columnar_rows = (year_ends, duplicates)
+        return questions_dict
 
-                stratifications_dict = stratification_categories_dict[stratification_category]
+    def _open_snapshot(self, csv_path, snapshot_dir):
+        """
+        Loads the memory-mapped snapshot of the CSV file, or reads the CSV file and
+        writes its snapshot when there is none.
 
-                if stratification not in stratifications_dict:
-                    stratifications_dict[stratification] = {}
+        Returns:
+            tuple: the ColumnarStore and the nested dictionary read from the CSV file
+            (None when the snapshot was loaded).
+        """
+        key = snapshot_key(csv_path)
+        loaded = self._timed("load_snapshot", load_snapshot, snapshot_dir, key)
+        if loaded is not None:
+            store, meta = loaded
+            self.ingest_stats.update(rows=meta["rows"], skipped=meta["skipped"],
+                                     duplicates=meta["duplicates"], snapshot="loaded")
+            return store, None
 
-                data_values_dict = stratifications_dict[stratification]
+        questions_dict = self._timed("read_csv", self._read_questions_dict, csv_path)
+        year_ends, duplicates = self._columnar_rows
+        store = self._timed("columnar_store", ColumnarStore.from_questions_dict,
+                            questions_dict, year_ends, duplicates)
+        self._columnar_rows = None
+        try:
+            self._timed("write_snapshot", write_snapshot, snapshot_dir, key, store,
+                        {name: self.ingest_stats[name]
+                         for name in ("rows", "skipped", "duplicates")})
+            self.ingest_stats["snapshot"] = "written"
+        except OSError:
+            self.ingest_stats["snapshot"] = "unavailable"
+        return store, questions_dict
 
-                if year not in data_values_dict:
-                    data_values_dict[year] = data_value
+    def _load_questions_dict(self, csv_path, snapshot_dir):
+        """
+        Builds the nested dictionary, from the snapshot of the CSV file if there is one.
+        """
+        self._columnar_store, questions_dict = self._open_snapshot(csv_path, snapshot_dir)
+        if questions_dict is not None:
+            return questions_dict
+        # The rows are stored in traversal order, so the dictionaries get the same order
+        return self._timed("questions_dict", nest_rows, self.columnar_store.iter_rows())
 
-        self.questions_best_is_min = [
-            'Percent of adults aged 18 years and older who have an overweight classification',
-            'Percent of adults aged 18 years and older who have obesity',
-            'Percent of adults who engage in no leisure-time physical activity',
-            'Percent of adults who report consuming fruit less than one time daily',
-            'Percent of adults who report consuming vegetables less than one time daily'
-        ]
+    def _map_snapshot(self, csv_path, snapshot_dir):
+        """
+        Returns the ColumnarStore of the snapshot of the CSV file, memory-mapped read-only.
 
-        self.questions_best_is_max = [
-            'Percent of adults who achieve at least 150 minutes a week of moderate-intensity '
-            'aerobic physical activity or 75 minutes a week of vigorous-intensity '
-            'aerobic activity (or an equivalent combination)',
+        A snapshot written just now is mapped as well, so that the parsed data is
+        dropped; if it could not be written, the in-memory store is kept.
+        """
+        store, questions_dict = self._open_snapshot(csv_path, snapshot_dir)
+        if questions_dict is not None and self.ingest_stats["snapshot"] == "written":
+            loaded = self._timed("load_snapshot", load_snapshot, snapshot_dir,
+                                 snapshot_key(csv_path))
+            if loaded is not None:
+                store = loaded[0]
+        return store
 
-            'Percent of adults who achieve at least 150 minutes a week of '
-            'moderate-intensity aerobic physical activity or 75 minutes a '
-            'week of vigorous-intensity aerobic physical activity and engage '
-            'in muscle-strengthening activities on 2 or more days a week',
+    def _timed(self, step, function, *args):
+        """
+        Calls `function(*args)` and adds its duration to `ingest_stats["step_seconds"][step]`.
+        """
+        start_time = time.perf_counter()
+        result = function(*args)
+        step_seconds = self.ingest_stats["step_seconds"]
+        step_seconds[step] = step_seconds.get(step, 0.0) + time.perf_counter() - start_time
+        return result
 
-            'Percent of adults who achieve at least 300 minutes a week of '
-            'moderate-intensity aerobic physical activity or 150 minutes a '
-            'week of vigorous-intensity aerobic activity (or an equivalent combination)',
-            'Percent of adults who engage in muscle-strengthening activities on 2 '
-            'or more days a week',
-        ]
+    def _record_time(self, start_time):
+        """
+        Adds the ingest time (of the whole DataIngestor) and throughput to `ingest_stats`.
+        """
+        seconds = time.perf_counter() - start_time
+        self.ingest_stats["seconds"] = seconds
+        self.ingest_stats["rows_per_sec"] = self.ingest_stats["rows"] / seconds if seconds else 0.0
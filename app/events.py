@@ -0,0 +1,120 @@
+"""
+Job completion events, pushed to the clients of /api/events as server-sent events.
+
+Provides `JobEvents`, which the JobRegistry notifies of every finished job and which
+fans the events out to the `Subscription` of every open stream, and `sse_message`,
+the text format of an event.
+"""
+
+import json
+from collections import deque
+from threading import Condition, Lock
+
+from app.job_registry import CANCELLED, DONE, FAILED
+
+# Seconds without events after which a stream sends a comment, keeping the connection open
+KEEPALIVE_SECONDS = 15
+
+# Events kept for a subscriber that does not read them, the oldest ones are dropped
+MAX_PENDING_EVENTS = 1000
+
+KEEPALIVE = ": keepalive\n\n"
+
+
+def job_event(job_id, job_info):
+    """
+    Describes a finished job like /api/get_results does: status "done", or "error"
+    with a reason (also for an unknown job, `job_info` being None).
+    """
+    if job_info is None:
+        return {"job_id": job_id, "status": "error", "reason": "Invalid job_id"}
+    if job_info.state == FAILED:
+        return {"job_id": job_id, "status": "error", "reason": job_info.error}
+    if job_info.state == CANCELLED:
+        return {"job_id": job_id, "status": "error", "reason": "Job cancelled"}
+    return {"job_id": job_id, "status": DONE}
+
+
+def sse_message(data, event="job", event_id=None):
+    """
+    Formats a server-sent event carrying `data` as JSON.
+    """
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """
+    Events of the jobs a stream follows (`job_ids`, None for all of them), waiting
+    to be written out.
+
+    - `wakeup` (optional) is called after every new event, e.g. to wake up an asyncio
+    task; it runs in the thread finishing the job and must return quickly.
+    """
+
+    def __init__(self, job_ids=None, wakeup=None):
+        self.job_ids = job_ids
+        self.wakeup = wakeup
+        self.condition = Condition()
+        self.events = deque(maxlen=MAX_PENDING_EVENTS)
+
+    def push(self, event):
+        """
+        Adds an event, dropping the oldest one if MAX_PENDING_EVENTS are waiting.
+        """
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify()
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def pop_all(self, timeout=None):
+        """
+        Returns the waiting events, after waiting up to `timeout` seconds for one if
+        there are none.
+        """
+        with self.condition:
+            if not self.events and timeout:
+                self.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+
+class JobEvents:
+    """
+    Fans out the completion of every job to the subscriptions that follow it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subscriptions = set()
+
+    def subscribe(self, job_ids=None, wakeup=None):
+        """
+        Opens a subscription to the events of `job_ids` (all the jobs if None).
+        """
+        subscription = Subscription(job_ids, wakeup)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Closes a subscription.
+        """
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, job_id, job_info):
+        """
+        Pushes the event of a finished job to the subscriptions following it.
+        """
+        with self.lock:
+            subscriptions = [subscription for subscription in self.subscriptions
+                             if subscription.job_ids is None or job_id in subscription.job_ids]
+        if subscriptions:
+            event = job_event(job_id, job_info)
+            for subscription in subscriptions:
+                subscription.push(event)
@@ -0,0 +1,138 @@
+"""
+Provides the FairQueue class, the task queue of the ThreadPool.
+
+Tasks are queued in one FIFO lane per endpoint and dequeued by weighted fair
+queuing, so that a burst of expensive jobs (e.g. mean_by_category) does not delay
+the cheap ones (e.g. state_mean) queued behind it.
+"""
+
+from collections import deque
+from threading import Condition
+
+from app.metrics import job_endpoint
+
+# Poison pill: a TaskRunner that takes it from the queue stops
+STOP = None
+
+# Execution time (seconds) assumed for an endpoint before any of its jobs finished
+DEFAULT_COST = 0.001
+
+# Weight of the last execution time in the moving average of an endpoint's cost
+COST_SMOOTHING = 0.2
+
+
+def parse_weights(spec):
+    """
+    Parses endpoint weights given as "endpoint=weight,endpoint=weight".
+
+    Returns:
+        dict: endpoint -> weight (float).
+    """
+    weights = {}
+    for item in filter(None, (item.strip() for item in (spec or "").split(","))):
+        endpoint, _, weight = item.partition("=")
+        weights[endpoint.strip()] = float(weight)
+        if weights[endpoint.strip()] <= 0:
+            raise ValueError(f"Weight of endpoint '{endpoint}' must be positive")
+    return weights
+
+
+class _Lane:  # pylint: disable=too-few-public-methods
+    """
+    Tasks of a single endpoint, and the virtual time at which the lane is served next.
+    """
+    __slots__ = ("tasks", "weight", "next_pass")
+
+    def __init__(self, weight):
+        self.tasks = deque()
+        self.weight = weight
+        self.next_pass = 0.0
+
+
+class FairQueue:
+    """
+    Thread-safe task queue with one lane per endpoint.
+
+    - `get` serves the non-empty lane with the smallest virtual time, which then moves
+    forward by the estimated cost of the task (the moving average of the execution
+    times of its endpoint, see `record_cost`) divided by the weight of the endpoint.
+    Every endpoint with queued tasks thus gets a share of the workers' time proportional
+    to its weight, however many tasks it has queued and however long they take.
+    - A lane that was empty starts at the current virtual time: idle endpoints do not
+    save up credit.
+    - STOP pills are only handed out once every lane is empty, so that the pending
+    tasks are drained before the workers stop.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self.condition = Condition()
+        # endpoint -> _Lane
+        self.lanes = {}
+        # endpoint -> moving average of the execution time of its tasks
+        self.costs = {}
+        self.virtual_time = 0.0
+        self.num_tasks = 0
+        self.num_stops = 0
+
+    def put(self, task):
+        """
+        Queues a task (job_id, function, arguments) in the lane of its endpoint, or a STOP.
+        """
+        with self.condition:
+            if task is STOP:
+                self.num_stops += 1
+            else:
+                endpoint = job_endpoint(task)
+                lane = self.lanes.get(endpoint)
+                if lane is None:
+                    lane = self.lanes[endpoint] = _Lane(self.weights.get(endpoint, 1.0))
+                if not lane.tasks:
+                    lane.next_pass = max(lane.next_pass, self.virtual_time)
+                lane.tasks.append(task)
+                self.num_tasks += 1
+            self.condition.notify()
+
+    def get(self):
+        """
+        Blocks until a task (or a STOP, once no task is left) can be returned.
+        """
+        with self.condition:
+            while not self.num_tasks and not self.num_stops:
+                self.condition.wait()
+            if not self.num_tasks:
+                self.num_stops -= 1
+                return STOP
+
+            endpoint, lane = min(((endpoint, lane) for endpoint, lane in self.lanes.items()
+                                  if lane.tasks), key=lambda item: item[1].next_pass)
+            self.virtual_time = lane.next_pass
+            lane.next_pass += self.costs.get(endpoint, DEFAULT_COST) / lane.weight
+            self.num_tasks -= 1
+            return lane.tasks.popleft()
+
+    def drain(self):
+        """
+        Removes and returns all the queued tasks, the STOPs stay queued.
+        """
+        with self.condition:
+            tasks = [task for lane in self.lanes.values() for task in lane.tasks]
+            for lane in self.lanes.values():
+                lane.tasks.clear()
+            self.num_tasks = 0
+            return tasks
+
+    def record_cost(self, endpoint, seconds):
+        """
+        Updates the estimated cost of the tasks of an endpoint with a measured execution time.
+        """
+        with self.condition:
+            cost = self.costs.get(endpoint)
+            self.costs[endpoint] = seconds if cost is None else \
+                cost + COST_SMOOTHING * (seconds - cost)
+
+    def qsize(self):
+        """
+        Returns the number of queued tasks (STOPs are not counted).
+        """
+        return self.num_tasks
@@ -0,0 +1,95 @@
+"""
+Provides the JobCache class, the memoization layer in front of `ThreadPool.submit`.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+# Outcomes of JobCache.claim
+HIT = "hit"
+JOINED = "joined"
+LEADER = "leader"
+REJECTED = "rejected"
+
+
+class JobCache:
+    """
+    Coalesces identical jobs and memoizes their results.
+
+    - Jobs are identified by a cache key, e.g. (endpoint, data version, question, state).
+    - The first job with a given key is the leader and is actually computed; identical jobs
+    submitted while it is in flight join it and get its result when it finishes.
+    - Results of finished jobs are kept in a bounded LRU cache. Keys contain the version
+    of the ingested data, so results computed on older data are never served.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.lock = Lock()
+        # cache_key -> result, least recently used first
+        self.results = OrderedDict()
+        # cache_key -> job_ids waiting for the leader
+        self.in_flight = {}
+        # leader job_id -> cache_key
+        self.leader_keys = {}
+
+    def claim(self, cache_key, job_id, admit=None):
+        """
+        Decides how a newly submitted job is served.
+
+        - `admit` (optional) is called when the job would have to be computed; if it
+        returns False the job is rejected, cached and in flight results are still served.
+
+        Returns:
+            tuple: (HIT, result) if the result is cached, (JOINED, None) if an identical
+            job is in flight, (LEADER, None) if the job must be computed,
+            (REJECTED, None) if it must be computed but was not admitted.
+        """
+        with self.lock:
+            if cache_key in self.results:
+                self.results.move_to_end(cache_key)
+                return HIT, self.results[cache_key]
+            if cache_key in self.in_flight:
+                self.in_flight[cache_key].append(job_id)
+                return JOINED, None
+            if admit is not None and not admit():
+                return REJECTED, None
+            self.in_flight[cache_key] = []
+            self.leader_keys[job_id] = cache_key
+            return LEADER, None
+
+    def complete(self, job_id, result):
+        """
+        Caches the result of a leader job.
+
+        Returns:
+            list: the job_ids that joined it (empty for jobs that are not leaders).
+        """
+        with self.lock:
+            cache_key = self.leader_keys.pop(job_id, None)
+            if cache_key is None:
+                return []
+            self.results[cache_key] = result
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+            return self.in_flight.pop(cache_key)
+
+    def fail(self, job_id):
+        """
+        Forgets a failed leader job, without caching anything.
+
+        Returns:
+            list: the job_ids that joined it, they fail as well.
+        """
+        with self.lock:
+            cache_key = self.leader_keys.pop(job_id, None)
+            if cache_key is None:
+                return []
+            return self.in_flight.pop(cache_key)
+
+    def clear(self):
+        """
+        Drops all the cached results (in flight jobs are not affected).
+        """
+        with self.lock:
+            self.results.clear()
@@ -0,0 +1,197 @@
+"""
+Provides the JobRegistry class, which tracks the state of every job submitted to the ThreadPool.
+"""
+
+import time
+from collections import deque
+from threading import Event, Lock
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobInfo:  # pylint: disable=too-few-public-methods
+    """
+    State and timestamps (seconds since the epoch) of a single job.
+    """
+    __slots__ = ("state", "submitted_at", "started_at", "finished_at", "error")
+
+    def __init__(self):
+        self.state = QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+
+class JobRegistry:  # pylint: disable=too-many-instance-attributes
+    """
+    Thread-safe, in-memory registry of jobs.
+
+    - Keeps a JobInfo per job_id, in submission order.
+    - Is bounded: beyond `max_jobs` jobs, the jobs that finished first are forgotten
+    (queued and running jobs are always kept). The counters still include them.
+    - Keeps a running counter of the jobs in each state, so that the number of
+    pending jobs is known in O(1).
+    - Lets callers block until a job finishes, on a per-job Event that is only
+    created when someone actually waits for that job, or be called back when it does.
+    - Notifies its listeners (e.g. JobEvents) of every finished job.
+    """
+
+    def __init__(self, max_jobs=None):
+        self.lock = Lock()
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        # Finished job_ids, in the order they finished
+        self.finished = deque()
+        self.counters = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        # job_id -> Event set when the job finishes
+        self.completion_events = {}
+        # job_id -> callbacks called when the job finishes
+        self.completion_callbacks = {}
+        # Called with (job_id, JobInfo) whenever a job finishes
+        self.listeners = []
+
+    def add(self, job_id):
+        """
+        Registers a newly submitted job as queued.
+        """
+        with self.lock:
+            self.jobs[job_id] = JobInfo()
+            self.counters[QUEUED] += 1
+
+    def discard(self, job_id):
+        """
+        Forgets a queued job that was not accepted after all.
+        """
+        with self.lock:
+            if self.jobs.pop(job_id, None) is not None:
+                self.counters[QUEUED] -= 1
+
+    def _transition(self, job_id, state):
+        """
+        Moves a job to a new state and updates the counters. Must be called with the lock held.
+        """
+        job_info = self.jobs[job_id]
+        self.counters[job_info.state] -= 1
+        self.counters[state] += 1
+        job_info.state = state
+        if state not in (QUEUED, RUNNING):
+            completion_event = self.completion_events.pop(job_id, None)
+            if completion_event is not None:
+                completion_event.set()
+            for callback in self.completion_callbacks.pop(job_id, ()):
+                callback()
+            for listener in self.listeners:
+                listener(job_id, job_info)
+            self.finished.append(job_id)
+            if self.max_jobs is not None:
+                while len(self.jobs) > self.max_jobs and self.finished:
+                    del self.jobs[self.finished.popleft()]
+        return job_info
+
+    def mark_running(self, job_id):
+        """
+        Marks a job as picked up by a TaskRunner.
+        """
+        with self.lock:
+            self._transition(job_id, RUNNING).started_at = time.time()
+
+    def mark_done(self, job_id):
+        """
+        Marks a job as finished, with its result in the result store.
+        """
+        with self.lock:
+            self._transition(job_id, DONE).finished_at = time.time()
+
+    def mark_failed(self, job_id, error):
+        """
+        Marks a job as failed, remembering the error message.
+        """
+        with self.lock:
+            # Set first, listeners report it
+            self.jobs[job_id].error = error
+            self._transition(job_id, FAILED).finished_at = time.time()
+
+    def mark_cancelled(self, job_id):
+        """
+        Marks a queued job as cancelled, it will never run.
+        """
+        with self.lock:
+            self._transition(job_id, CANCELLED).finished_at = time.time()
+
+    def wait(self, job_id, timeout):
+        """
+        Blocks until a job finishes (done, failed or cancelled), for at most `timeout` seconds.
+        Returns right away for unknown or already finished jobs.
+        """
+        with self.lock:
+            job_info = self.jobs.get(job_id)
+            if job_info is None or job_info.state not in (QUEUED, RUNNING):
+                return
+            completion_event = self.completion_events.setdefault(job_id, Event())
+        completion_event.wait(timeout)
+
+    def add_done_callback(self, job_id, callback):
+        """
+        Calls `callback()` once a job finishes (done, failed or cancelled), right away
+        for unknown or already finished jobs.
+
+        The callback runs in the thread finishing the job, with the registry locked:
+        it must return quickly and not use the registry.
+        """
+        with self.lock:
+            job_info = self.jobs.get(job_id)
+            if job_info is not None and job_info.state in (QUEUED, RUNNING):
+                self.completion_callbacks.setdefault(job_id, []).append(callback)
+                return
+        callback()
+
+    def remove_done_callback(self, job_id, callback):
+        """
+        Unregisters a callback added with `add_done_callback`, e.g. once its caller stopped
+        waiting. Does nothing if the callback already ran.
+        """
+        with self.lock:
+            callbacks = self.completion_callbacks.get(job_id)
+            if callbacks is not None and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.completion_callbacks[job_id]
+
+    def get(self, job_id):
+        """
+        Returns the JobInfo of a job, or None for an unknown job_id.
+        """
+        return self.jobs.get(job_id)
+
+    def num_pending(self):
+        """
+        Returns the number of jobs that are queued or running.
+        """
+        with self.lock:
+            return self.counters[QUEUED] + self.counters[RUNNING]
+
+    def counts(self):
+        """
+        Returns the number of jobs in every state.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def states(self, start=None, limit=None):
+        """
+        Returns (job_id, state) pairs sorted by job_id.
+
+        Without arguments all the jobs are returned. With `start` and `limit`, only
+        the jobs with ids in [start, start + limit) are looked up, in O(limit).
+        """
+        with self.lock:
+            if limit is None:
+                return [(job_id, job_info.state) for job_id, job_info in sorted(self.jobs.items())]
+            start = 1 if start is None else start
+            return [(job_id, self.jobs[job_id].state) for job_id in range(start, start + limit)
+                    if job_id in self.jobs]
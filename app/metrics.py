@@ -0,0 +1,219 @@
+"""
+In-process metrics of the job pipeline, exported in the Prometheus text format.
+
+Provides `Counter` and `Histogram` (thread-safe, labelled, updated in O(1) or
+O(log buckets) under a lock), `JobMetrics` (the ones the ThreadPool updates) and
+`render_metrics`, which builds the text served by the /metrics route.
+"""
+
+import bisect
+from threading import Lock
+
+# Upper bounds (seconds) of the buckets of the job time histograms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """
+    Escapes a label value as required by the text format.
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    """
+    Formats (name, value) pairs as {name="value",...}, or "" without labels.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in labels) + "}"
+
+
+def _format_value(value):
+    """
+    Formats a sample value, integers without a decimal point.
+    """
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _format_samples(name, help_text, metric_type, samples):
+    """
+    Formats a metric given as (labels, value) pairs, labels being a list of (name, value) pairs.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}"
+                 for labels, value in samples)
+    return lines
+
+
+def gauge(name, help_text, samples):
+    """
+    Formats a gauge read from elsewhere, see _format_samples.
+    """
+    return _format_samples(name, help_text, "gauge", samples)
+
+
+def counter(name, help_text, samples):
+    """
+    Formats a counter kept elsewhere, see _format_samples.
+    """
+    return _format_samples(name, help_text, "counter", samples)
+
+
+class Counter:
+    """
+    Monotonic counter, with one value per combination of label values.
+    """
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        """
+        Adds `amount` to the value of the given label values.
+        """
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        """
+        Returns the lines of the counter in the text format.
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        return counter(self.name, self.help_text,
+                       [(list(zip(self.label_names, label_values)), value)
+                        for label_values, value in values])
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, with one distribution per
+    combination of label values.
+    """
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        # label values -> [count of every bucket (not cumulative) and of +Inf, sum]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        """
+        Records a value for the given label values.
+        """
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self):
+        """
+        Returns the lines of the histogram in the text format.
+        """
+        with self.lock:
+            all_series = sorted((label_values, list(series))
+                                for label_values, series in self.series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in all_series:
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(labels + [("le", _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def job_endpoint(task):
+    """
+    Names the endpoint of a task after its function, e.g. "states_mean" for
+    calculate_states_mean.
+    """
+    return getattr(task[1], "__name__", "unknown").removeprefix("calculate_")
+
+
+class JobMetrics:  # pylint: disable=too-few-public-methods
+    """
+    Metrics updated by the ThreadPool and its TaskRunners.
+    """
+
+    def __init__(self):
+        self.jobs_submitted = Counter(
+            "threadpool_jobs_submitted_total",
+            "Jobs submitted, by endpoint and job cache outcome (hit, joined, leader or none)",
+            ("endpoint", "cache"))
+        self.jobs_rejected = Counter(
+            "threadpool_jobs_rejected_total",
+            "Jobs turned away with a 429, by endpoint and reason (queue full or rate limited)",
+            ("endpoint", "reason"))
+        self.queue_wait = Histogram(
+            "threadpool_job_queue_wait_seconds",
+            "Time jobs spent in the task queue before a TaskRunner picked them up",
+            ("endpoint",))
+        self.execution_time = Histogram(
+            "threadpool_job_execution_seconds",
+            "Time TaskRunners spent executing jobs", ("endpoint",))
+
+    def render(self):
+        """
+        Returns the lines of all the job metrics in the text format.
+        """
+        return (self.jobs_submitted.render() + self.jobs_rejected.render()
+                + self.queue_wait.render() + self.execution_time.render())
+
+
+def render_metrics(thread_pool, data_ingestor):
+    """
+    Builds the /metrics page: the job metrics, plus gauges and counters read from
+    the thread pool, its job registry and result store, and the data ingestor.
+    """
+    lines = gauge("threadpool_queue_depth", "Tasks waiting in the task queue",
+                  [([], thread_pool.task_queue.qsize())])
+    lines += gauge("threadpool_workers", "Worker threads of the thread pool",
+                   [([], thread_pool.num_workers)])
+    lines += gauge("threadpool_jobs", "Jobs in every state",
+                   [([("state", state)], count)
+                    for state, count in thread_pool.job_registry.counts().items()])
+    lines += thread_pool.metrics.render()
+
+    store_stats = thread_pool.result_store.stats()
+    if store_stats:
+        lines += counter("result_store_requests_total",
+                         "Result lookups, by outcome (hit in memory, hit in the spill store, miss)",
+                         [([("outcome", outcome)], store_stats[outcome])
+                          for outcome in ("hit", "spill_hit", "miss")])
+        lines += counter("result_store_evictions_total",
+                         "Results evicted from memory (LRU or TTL)",
+                         [([], store_stats["evictions"])])
+        lines += gauge("result_store_entries", "Results kept in memory",
+                       [([], store_stats["entries"])])
+
+    ingest_stats = data_ingestor.ingest_stats
+    lines += gauge("data_ingest_seconds", "Time spent ingesting the data at startup",
+                   [([], ingest_stats["seconds"])])
+    lines += gauge("data_ingest_step_seconds",
+                   "Time spent in each ingest step, e.g. building a data structure",
+                   [([("step", step)], seconds)
+                    for step, seconds in list(ingest_stats["step_seconds"].items())])
+    lines += gauge("data_ingest_rows", "Rows read at startup, by kind",
+                   [([("kind", kind)], ingest_stats.get(kind, 0))
+                    for kind in ("rows", "skipped", "duplicates")])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,159 @@
+"""
+Storage for the results of finished jobs.
+
+Provides a small `ResultStore` interface and two backends:
+
+* `MemoryResultStore` - in-process, thread-safe, bounded by LRU and TTL eviction.
+* `DiskResultStore` - one pickle file per job in the results directory. It can be used
+on its own or as the spill tier of a `MemoryResultStore`.
+"""
+
+import os
+import pickle
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+
+
+class ResultStore(ABC):
+    """
+    Interface of a result store: maps a job_id to the result of that job.
+    """
+
+    @abstractmethod
+    def put(self, job_id, result):
+        """
+        Stores the result of a finished job.
+        """
+
+    @abstractmethod
+    def get(self, job_id):
+        """
+        Returns the result of a job, or None if it is not (or no longer) stored.
+        """
+
+    def stats(self):
+        """
+        Returns the counters of the store (e.g. hits and misses), empty if it keeps none.
+        """
+        return {}
+
+
+class DiskResultStore(ResultStore):
+    """
+    Pickles every result to `<results_dir>/<job_id>.pkl`.
+
+    Files are written to a temporary name and renamed, so readers never see half a pickle.
+    """
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+
+    def _filename(self, job_id):
+        return os.path.join(self.results_dir, f"{job_id}.pkl")
+
+    def put(self, job_id, result):
+        file_descriptor, temp_name = tempfile.mkstemp(dir=self.results_dir, suffix=".tmp")
+        with os.fdopen(file_descriptor, 'wb') as job_file:
+            pickle.dump(result, job_file)
+        os.replace(temp_name, self._filename(job_id))
+
+    def get(self, job_id):
+        try:
+            with open(self._filename(job_id), 'rb') as job_file:
+                return pickle.load(job_file)
+        except FileNotFoundError:
+            return None
+
+
+class MemoryResultStore(ResultStore):
+    """
+    Keeps results in memory, in a thread-safe, bounded OrderedDict.
+
+    - At most `max_entries` results are kept; the least recently used one is evicted first.
+    - If `ttl` (seconds) is set, results not accessed for that long are evicted as well.
+    - Evicted results are moved to `spill_store` (e.g. a DiskResultStore) when one is given,
+    otherwise they are dropped. They are written out after the lock is released, and
+    served from `spilling` until then.
+    - Counts lookups served from memory ("hit"), from the spill store ("spill_hit") or not
+    served ("miss"), and evictions.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, spill_store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill_store = spill_store
+        self.lock = Lock()
+        # job_id -> (expiry time, result), least recently used first
+        self.entries = OrderedDict()
+        # job_id -> result, evicted but not yet written to the spill store
+        self.spilling = {}
+        self.counters = {"hit": 0, "spill_hit": 0, "miss": 0, "evictions": 0}
+
+    def _expiry(self):
+        return time.monotonic() + self.ttl if self.ttl else None
+
+    def put(self, job_id, result):
+        with self.lock:
+            self.entries[job_id] = (self._expiry(), result)
+            self.entries.move_to_end(job_id)
+            evicted = self._evict()
+        self._spill(evicted)
+
+    def get(self, job_id):
+        with self.lock:
+            evicted = self._evict()
+            entry = self.entries.get(job_id)
+            if entry is not None:
+                # Refresh both the LRU position and the expiry time
+                self.entries[job_id] = (self._expiry(), entry[1])
+                self.entries.move_to_end(job_id)
+                self.counters["hit"] += 1
+            elif job_id in self.spilling:
+                entry = (None, self.spilling[job_id])
+                self.counters["spill_hit"] += 1
+        self._spill(evicted)
+
+        if entry is not None:
+            return entry[1]
+        result = self.spill_store.get(job_id) if self.spill_store is not None else None
+        with self.lock:
+            self.counters["miss" if result is None else "spill_hit"] += 1
+        return result
+
+    def _evict(self):
+        """
+        Removes the expired entries and the ones over `max_entries`, keeping them in
+        `spilling` if there is a spill store.
+        Must be called with the lock held; returns the evicted (job_id, result) pairs.
+        """
+        evicted = []
+        if self.ttl:
+            now = time.monotonic()
+            # Expiry times are refreshed on access, so the first ones to expire are at the front
+            while self.entries and next(iter(self.entries.values()))[0] <= now:
+                job_id, (_, result) = self.entries.popitem(last=False)
+                evicted.append((job_id, result))
+        while len(self.entries) > self.max_entries:
+            job_id, (_, result) = self.entries.popitem(last=False)
+            evicted.append((job_id, result))
+        self.counters["evictions"] += len(evicted)
+        if self.spill_store is not None:
+            self.spilling.update(evicted)
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+    def _spill(self, evicted):
+        """
+        Moves evicted results to the spill store, outside of the lock.
+        """
+        if self.spill_store is not None:
+            for job_id, result in evicted:
+                self.spill_store.put(job_id, result)
+                with self.lock:
+                    self.spilling.pop(job_id, None)
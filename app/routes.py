@@ -4,17 +4,39 @@ Webserver for question data analysis.
 - Calculates means & differences for states, categories (state, stratification).
 - Handles asynchronous tasks via thread pool.
 - Provides API endpoints for job submission and retrieval.
+- Every analytics request (and a batch) may restrict the rows it aggregates with
+optional integer 'year_from' / 'year_to' fields (inclusive).
+- A request sent with a 'Cache-Control: no-cache' header bypasses the JobCache: its job
+is always computed, e.g. to benchmark the computation itself.
 
 See API endpoints for details (index route displays list).
 
 Requires webserver & data ingestion modules to be configured.
 """
-import os
-import heapq
-import pickle
-
 from flask import request, jsonify
 from app import webserver
+from app.admission import Overloaded, clamp_retry_after
+from app.aggregate_index import AggregateIndex
+from app.calculations import calculate_states_mean, \
+    calculate_state_mean, \
+    calculate_best5, \
+    calculate_worst5, \
+    calculate_global_mean, \
+    calculate_diff_from_mean, \
+    calculate_state_diff_from_mean, \
+    calculate_mean_by_category, \
+    calculate_state_mean_by_category, \
+    calculate_state_trend, \
+    calculate_batch, \
+    BATCH_ENDPOINTS
+from app.events import KEEPALIVE, KEEPALIVE_SECONDS, job_event, sse_message
+from app.job_registry import CANCELLED, DONE, FAILED
+from app.metrics import render_metrics
+from app.streaming import STREAM_FORMATS
+
+
+# Longest time (seconds) a request to /api/get_results may block waiting for its job
+MAX_WAIT = 30
 
 
 # Example endpoint definition
@@ -48,50 +70,184 @@ def get_response(job_id):
     """
     Checks job status based on ID.
 
+    - Optional query parameter 'wait' (seconds, at most MAX_WAIT): if the job is still
+    running, block until it finishes or the wait is over, instead of returning right away.
+    - Optional query parameter 'stream' ("ndjson" or "json"): the result of a finished job
+    is written out in chunks as newline-delimited JSON, or as the usual JSON document
+    (the same bytes), instead of being serialized in one piece. Only the serialization is
+    chunked, the result itself is already in memory.
+
     Args:
         job_id (int): The ID of the job to inquire about.
 
     Returns:
         JSON: Response containing job status and data (if done) or error message.
     """
-    webserver.my_logger.info(f"Requesting data for job_{job_id}")
+    webserver.my_logger.info("Requesting data for job_%s", job_id)
 
     # Check if job_id is valid
-    if int(job_id) <= webserver.job_counter:
-        # Check if job_id is done and return the result
-        task_data = task_data_for(int(job_id), webserver.my_logger)
-        if task_data is None:
-            webserver.my_logger.info(f"Job {job_id} is running, data cannot be provided yet")
+    job_registry = webserver.tasks_runner.job_registry
+    job_info = job_registry.get(int(job_id))
+    if job_info is None:
+        webserver.my_logger.info("Job %s is invalid", job_id)
+
+        return jsonify({'status': "error", 'reason': "Invalid job_id"})
+
+    stream_format = request.args.get("stream")
+    if stream_format is not None and stream_format not in STREAM_FORMATS:
+        raise InvalidRequest(f"Unknown stream format {stream_format!r}, "
+                             f"expected one of {list(STREAM_FORMATS)}")
+
+    wait = request.args.get("wait", type=float)
+    if wait:
+        job_registry.wait(int(job_id), min(wait, MAX_WAIT))
+
+    if job_info.state in (FAILED, CANCELLED):
+        # Failed jobs keep their error, cancelled ones were still queued at shutdown
+        reason = job_info.error if job_info.state == FAILED else "Job cancelled"
+        webserver.my_logger.info("Job %s has no result: %s", job_id, reason)
+
+        return jsonify({'status': "error", 'reason': reason})
 
-            return jsonify({'status': "running"})
+    if job_info.state != DONE:
+        webserver.my_logger.info("Job %s is running, data cannot be provided yet", job_id)
 
-        webserver.my_logger.info(f"Job {job_id} has data {task_data}")
+        return jsonify({'status': "running"})
 
-        return jsonify({'status': "done", 'data': task_data})
+    # The job is done, return the result
+    task_data = task_data_for(int(job_id), webserver.my_logger)
+    if task_data is None:
+        webserver.my_logger.info("Result of job %s has been evicted", job_id)
 
-    # If not, return running status
-    webserver.my_logger.info(f"Job {job_id} is invalid")
+        return jsonify({'status': "error", 'reason': "Result expired"})
 
-    return jsonify({'status': "error", 'reason': "Invalid job_id"})
+    if stream_format is not None:
+        webserver.my_logger.info("Job %s has data, streamed as %s", job_id, stream_format)
+        stream_writer, mimetype = STREAM_FORMATS[stream_format]
+
+        return webserver.response_class(stream_writer(task_data), mimetype=mimetype)
+
+    webserver.my_logger.info("Job %s has data", job_id)
+    webserver.my_logger.debug("Data of job %s is %s", job_id, task_data)
+
+    return jsonify({'status': "done", 'data': task_data})
 
 
 def task_data_for(job_id, my_logger):
     """
-    Fetches task data (a dictionary) from job_id.pkl,
+    Fetches task data (a dictionary) from the result store,
     or None if not found.
     """
-    results_dir = webserver.tasks_runner.results_dir
+    task_data = webserver.tasks_runner.result_store.get(job_id)
+    if task_data is not None:
+        my_logger.info("Found the result for job %s", job_id)
+    return task_data
 
-    # Construct the filename with .pkl extension
-    filename = os.path.join(results_dir, f"{job_id}.pkl")
 
-    # Check if the file exists
-    if not os.path.exists(filename):
+def _cache_key(endpoint, *args):
+    """
+    Identifies a job by its endpoint, its arguments and the version of the ingested data,
+    so that identical jobs share their computation and results.
+
+    Returns None, i.e. no caching, for a request sent with 'Cache-Control: no-cache'.
+    """
+    if request.cache_control.no_cache:
         return None
-    with open(filename, 'rb') as job_file:
-        # Load the PKL data from the file
-        my_logger.info(f"Found the result file for job {job_id}")
-        return pickle.load(job_file)
+    return (endpoint, webserver.data_ingestor.version) + args
+
+
+class InvalidRequest(ValueError):
+    """
+    Raised by the route handlers for malformed request data.
+    """
+
+
+@webserver.errorhandler(InvalidRequest)
+def invalid_request_handler(error):
+    """
+    Answers a malformed request with a 400 and the reason it was rejected.
+    """
+    webserver.my_logger.info("Invalid request: %s", error)
+
+    return jsonify({"job_id": -1, "reason": str(error)}), 400
+
+
+@webserver.errorhandler(Overloaded)
+def overloaded_handler(error):
+    """
+    Answers a job that was not accepted with a 429 and the seconds to wait before retrying.
+    """
+    webserver.my_logger.info("Job not accepted: %s, retry after %s seconds",
+                             error.reason, error.retry_after)
+
+    response = jsonify({"job_id": -1, "reason": error.reason})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
+@webserver.before_request
+def rate_limit():
+    """
+    Applies the per-client rate limit (if 'RATE_LIMIT' is set) to the requests
+    submitting jobs, i.e. the POST requests.
+    """
+    if webserver.rate_limiter is None or request.method != "POST":
+        return
+    wait = webserver.rate_limiter.acquire(request.remote_addr)
+    if wait:
+        webserver.tasks_runner.metrics.jobs_rejected.inc(request.path.rsplit("/", 1)[-1],
+                                                         "rate limited")
+        raise Overloaded("rate limited", clamp_retry_after(wait))
+
+
+def _year(data, name):
+    """
+    Returns the year given under `name` in the request data, or None.
+    """
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidRequest(f"Invalid {name} {value!r}")
+    try:
+        return int(value)
+    except ValueError as error:
+        raise InvalidRequest(f"Invalid {name} {value!r}") from error
+
+
+def _text(data, name, required=True):
+    """
+    Returns the string given under `name` in the request data, or None if it is
+    missing and not `required`.
+    """
+    value = data.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise InvalidRequest(f"Invalid {name} {value!r}")
+    return value
+
+
+def _data_source(data):
+    """
+    Returns the data source a request is answered from and its (year_from, year_to)
+    range, None when the request does not filter by year.
+
+    Filtered requests are answered from the ColumnarStore, whose year index resolves the range.
+    """
+    years = (_year(data, "year_from"), _year(data, "year_to"))
+    if years == (None, None):
+        return webserver.data_ingestor.data_source, None
+    return webserver.data_ingestor.columnar_store, years
+
+
+def _is_lookup(questions_dict, years):
+    """
+    Tells whether a state_mean, global_mean or state_diff_from_mean request is answered
+    by a few lookups in the sums of the AggregateIndex, and may take the fast lane of the
+    ThreadPool. Year-filtered requests never are.
+    """
+    return years is None and isinstance(questions_dict, AggregateIndex)
 
 
 @webserver.route('/api/states_mean', methods=['POST'])
@@ -101,7 +257,7 @@ def states_mean_request():
 
     - Extracts question text from JSON request data.
     - Submits a job to the thread pool to calculate state means for the question.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -117,55 +273,18 @@ def states_mean_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after states_mean request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after states_mean request", job_id)
 
-    new_task = (webserver.job_counter, calculate_states_mean, question,
-                questions_dict, webserver.logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_states_mean, question,
+                questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("states_mean", question, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_states_mean(question, questions_dict, my_logger):
-    """
-    Calculates mean data values for each state across all stratifications
-    for a given question.
-
-    Args:
-        question (str): The text of the question to calculate state means for.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-    Returns:
-        dict: A dictionary with state names as keys and their calculated mean values.
-            States are sorted by mean value in ascending order.
-    """
-    my_logger.info(f"Calculating answer for states_mean and question: {question}")
-
-    result = {}
-    states_dict = questions_dict[question]
-    for state, stratification_categories_dict in states_dict.items():
-        sum_values = 0
-        no_values = 0
-        for _, stratifications_dict in stratification_categories_dict.items():
-            for _, data_values_dict in stratifications_dict.items():
-                for _, value in data_values_dict.items():
-                    sum_values += float(value)
-                    no_values += 1
-        if no_values > 0:
-            result[state] = sum_values / no_values
-    result = dict(sorted(result.items(), key=lambda item: item[1]))
-
-    my_logger.info(f"Got answer for states_mean and question: {question}. Result is {result}")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/state_mean', methods=['POST'])
@@ -175,7 +294,7 @@ def state_mean_request():
 
     - Extracts question text and state name from JSON request data.
     - Submits a job to the thread pool to calculate the mean for that question and state.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -191,56 +310,20 @@ def state_mean_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
-    state = data["state"]
+    question = _text(data, "question")
+    state = _text(data, "state")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after state_mean request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after state_mean request", job_id)
 
-    new_task = (webserver.job_counter, calculate_state_mean,
-                question, state, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_state_mean,
+                question, state, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("state_mean", question, state, years),
+                                  _is_lookup(questions_dict, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_state_mean(question, state, questions_dict, my_logger):
-    """
-    Calculates the mean data value for a specific question and state across all stratifications.
-
-    Args:
-        question (str): The text of the question to calculate the mean for.
-        state (str): The name of the state to calculate the mean for.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-    Returns:
-        dict: A dictionary with the state name as the key and its calculated mean value.
-            Returns an empty dictionary if no data is available for the specified
-            question and state.
-    """
-    my_logger.info(f"Calculating answer for state_mean and question: {question}, state: {state}")
-
-    result = {}
-    states_dict = questions_dict[question]
-    stratification_categories_dict = states_dict[state]
-    sum_values = 0
-    no_values = 0
-    for _, stratifications_dict in stratification_categories_dict.items():
-        for _, data_values_dict in stratifications_dict.items():
-            for _, value in data_values_dict.items():
-                sum_values += float(value)
-                no_values += 1
-    if no_values > 0:
-        result[state] = sum_values / no_values
-
-    my_logger.info(f"Got answer for state_mean and question: {question}.")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/best5', methods=['POST'])
@@ -251,7 +334,7 @@ def best5_request():
 
     - Extracts question text from JSON request data.
     - Submits a job to the thread pool to identify the top/bottom 5 states for the question.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -267,49 +350,19 @@ def best5_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
     questions_best_is_max = webserver.data_ingestor.questions_best_is_max
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after best5 request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after best5 request", job_id)
 
-    new_task = (webserver.job_counter, calculate_best5, question, questions_dict,
-                questions_best_is_max, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_best5, question, questions_dict,
+                questions_best_is_max, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("best5", question, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_best5(question, questions_dict, questions_best_is_max, my_logger):
-    """
-    Identifies top/bottom 5 states based on mean values (question-dependent).
-
-    Args:
-        question (str): The question to analyze.
-        questions_dict: the dictionary that contains all the necessary data
-        questions_best_is_max: list of questions for which a larger value is better
-        my_logger: useful for debug
-
-    Returns:
-        dict: Top/bottom 5 states with mean values (sorted).
-    """
-    my_logger.info(f"Calculating answer for best5 and question: {question}")
-
-    temp_result = calculate_states_mean(question, questions_dict, my_logger)
-    if question in questions_best_is_max:
-        result = heapq.nlargest(5, temp_result.items(), key=lambda item: item[1])
-        sorted_result = dict(sorted(result, key=lambda item: item[1], reverse=True))
-    else:
-        result = heapq.nsmallest(5, temp_result.items(), key=lambda item: item[1])
-        sorted_result = dict(sorted(result, key=lambda item: item[1]))
-
-    my_logger.info(f"Got answer for best5 and question: {question}. Result is {sorted_result}")
-
-    return sorted_result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/worst5', methods=['POST'])
@@ -332,51 +385,19 @@ def worst5_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
     questions_best_is_min = webserver.data_ingestor.questions_best_is_min
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after worst5 request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after worst5 request", job_id)
 
-    new_task = (webserver.job_counter, calculate_worst5, question, questions_dict,
-                questions_best_is_min, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_worst5, question, questions_dict,
+                questions_best_is_min, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("worst5", question, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_worst5(question, questions_dict, questions_best_is_min, my_logger):
-    """
-    Similar to 'calculate_best5' but identifies bottom 5 states instead of top 5.
-
-    Refer to 'calculate_best5' docstring for details.
-
-    Args:
-        question (str): The question to analyze.
-        questions_dict: the dictionary that contains all the necessary data
-        questions_best_is_min: list of questions for which a smaller value is better
-        my_logger: useful for debug
-
-    Returns:
-        dict: Bottom 5 states with mean values (sorted).
-    """
-    my_logger.info(f"Calculating answer for worst5 and question: {question}")
-
-    temp_result = calculate_states_mean(question, questions_dict, my_logger)
-    if question in questions_best_is_min:
-        result = heapq.nlargest(5, temp_result.items(), key=lambda item: item[1])
-        sorted_result = dict(sorted(result, key=lambda item: item[1], reverse=True))
-    else:
-        result = heapq.nsmallest(5, temp_result.items(), key=lambda item: item[1])
-        sorted_result = dict(sorted(result, key=lambda item: item[1]))
-
-    my_logger.info(f"Got answer for worst5 and question: {question}. Result is {sorted_result}")
-
-    return sorted_result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/global_mean', methods=['POST'])
@@ -386,7 +407,7 @@ def global_mean_request():
 
     - Extracts question text from JSON request data.
     - Submits a job to the thread pool to calculate the global mean for the question.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -402,54 +423,19 @@ def global_mean_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after global_mean request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after global_mean request", job_id)
 
-    new_task = (webserver.job_counter, calculate_global_mean,
-                question, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_global_mean,
+                question, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("global_mean", question, years),
+                                  _is_lookup(questions_dict, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_global_mean(question, questions_dict, my_logger):
-    """
-    Calculates the overall mean value for a given question across all states and stratifications.
-
-    Args:
-        question (str): The text of the question to calculate the global mean for.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-    Returns:
-        dict: A dictionary containing the global mean value under the key "global_mean".
-            Returns an empty dictionary if no data is available for the specified question.
-    """
-    my_logger.info(f"Calculating answer for global_mean and question: {question}")
-
-    result = {}
-    sum_values = 0
-    no_values = 0
-    states_dict = questions_dict[question]
-    for _, stratification_categories_dict in states_dict.items():
-        for _, stratifications_dict in stratification_categories_dict.items():
-            for _, data_values_dict in stratifications_dict.items():
-                for _, value in data_values_dict.items():
-                    sum_values += float(value)
-                    no_values += 1
-    result["global_mean"] = 0
-    if no_values > 0:
-        result["global_mean"] = sum_values / no_values
-
-    my_logger.info(f"Got answer for global_mean and question: {question}. Result is {result}")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/diff_from_mean', methods=['POST'])
@@ -460,7 +446,7 @@ def diff_from_mean_request():
     - Extracts question text from JSON request data.
     - Submits a job to the thread pool to calculate the difference from the global mean
     for each state.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -476,43 +462,18 @@ def diff_from_mean_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after diff_from_mean request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after diff_from_mean request", job_id)
 
-    new_task = (webserver.job_counter, calculate_diff_from_mean,
-                question, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_diff_from_mean,
+                question, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("diff_from_mean", question, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_diff_from_mean(question, questions_dict, my_logger):
-    """
-    Calculates state differences from global mean for a question.
-
-    Args:
-        question (str): The question to analyze.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-    Returns:
-        dict: State names with differences from global mean.
-    """
-    my_logger.info(f"Calculating answer for diff_from_mean and question: {question}")
-
-    global_mean = calculate_global_mean(question, questions_dict, my_logger)
-    states_mean = calculate_states_mean(question, questions_dict, my_logger)
-    result = {key: global_mean["global_mean"] - value for key, value in states_mean.items()}
-
-    my_logger.info(f"Got answer for diff_from_mean and question: {question}. Result is {result}")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/state_diff_from_mean', methods=['POST'])
@@ -522,7 +483,7 @@ def state_diff_from_mean_request():
 
     - Extracts question text and state name from JSON request data.
     - Submits a job to calculate the difference from the global mean for the specified state.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -538,48 +499,22 @@ def state_diff_from_mean_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
-    state = data["state"]
+    question = _text(data, "question")
+    state = _text(data, "state")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after state_diff_from_mean request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after state_diff_from_mean request",
+                             job_id)
 
-    new_task = (webserver.job_counter, calculate_state_diff_from_mean,
-                question, state, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_state_diff_from_mean,
+                question, state, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task,
+                                  _cache_key("state_diff_from_mean", question, state, years),
+                                  _is_lookup(questions_dict, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_state_diff_from_mean(question, state, questions_dict, my_logger):
-    """
-    Calculates difference between global mean and state mean for a question and state.
-
-    Args:
-        question (str): The question to analyze.
-        state (str): The state to compare.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-    Returns:
-        dict: State and its difference from global mean.
-    """
-    my_logger.info(f"Calculating answer for state_diff_from_mean "
-                   f"and question: {question}, state: {state}")
-
-    global_mean = calculate_global_mean(question, questions_dict, my_logger)
-    state_mean = calculate_state_mean(question, state, questions_dict, my_logger)
-
-    result = {state: global_mean["global_mean"] - state_mean[state]}
-
-    my_logger.info(f"Got answer for state_diff_from_mean "
-                   f"and question: {question}, state: {state}. Result is {result}")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/mean_by_category', methods=['POST'])
@@ -589,7 +524,7 @@ def mean_by_category_request():
 
     - Extracts question text from JSON request data.
     - Submits a job to the thread pool to calculate mean values by category for the question.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -605,61 +540,18 @@ def mean_by_category_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
+    question = _text(data, "question")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after mean_by_category request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after mean_by_category request", job_id)
 
-    new_task = (webserver.job_counter, calculate_mean_by_category,
-                question, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_mean_by_category,
+                question, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("mean_by_category", question, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
-
-
-def calculate_mean_by_category(question, questions_dict, my_logger):
-    """
-    Calculates mean values for each category (state, stratification category, stratification)
-    within a question.
-
-    - Iterates through question data structure to calculate mean for each combination of
-    state, stratification category, and stratification.
-    - Skips empty categories or stratifications to avoid division by zero.
-
-    Args:
-        question (str): The text of the question to analyze.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
-
-
-    Returns:
-        dict: A dictionary with keys representing category combinations
-        (state, stratification category, stratification) and their corresponding mean values.
-    """
-    my_logger.info(f"Calculating answer for mean_by_category and question: {question}")
-
-    result = {}
-    states_dict = questions_dict[question]
-    for state, stratification_categories_dict in states_dict.items():
-        for stratification_category, stratifications_dict in stratification_categories_dict.items():
-            for stratification, data_values_dict in stratifications_dict.items():
-                sum_values = 0
-                no_values = 0
-                for _, value in data_values_dict.items():
-                    sum_values += float(value)
-                    no_values += 1
-                if no_values > 0 and stratification_category != "" and stratification != "":
-                    new_key = ("(\'" + state + "\', \'" + stratification_category +
-                               "\', \'" + stratification + "\')")
-                    result[new_key] = sum_values / no_values
-
-    my_logger.info(f"Got answer for mean_by_category and question: {question}. Result is {result}")
-
-    return result
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/state_mean_by_category', methods=['POST'])
@@ -670,7 +562,7 @@ def state_mean_by_category_request():
     - Extracts question text and state name from JSON request data.
     - Submits a job to calculate mean values by category for the specified state
     within the question.
-    - Increments the job counter.
+    - Gets a new job ID from the thread pool.
     - Returns the job ID associated with the submitted task.
 
     Returns:
@@ -686,63 +578,116 @@ def state_mean_by_category_request():
         return jsonify({"job_id": -1, "reason": "shutting down"})
     # Get request data
     data = request.json
-    question = data["question"]
-    state = data["state"]
+    question = _text(data, "question")
+    state = _text(data, "state")
     # Register job. Don't wait for task to finish
-    questions_dict = webserver.data_ingestor.questions_dict
+    questions_dict, years = _data_source(data)
 
-    webserver.my_logger.info(f"Submitting new job with id {webserver.job_counter} "
-                             f"after state_mean_by_category request")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after state_mean_by_category request",
+                             job_id)
 
-    new_task = (webserver.job_counter, calculate_state_mean_by_category,
-                question, state, questions_dict, webserver.my_logger)
-    webserver.tasks_runner.submit(new_task)
-    # Increment job_id counter
-    webserver.job_counter += 1
+    new_task = (job_id, calculate_state_mean_by_category,
+                question, state, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task,
+                                  _cache_key("state_mean_by_category", question, state, years))
     # Return associated job_id
-    return jsonify({"job_id": new_task[0]})
+    return jsonify({"job_id": job_id})
 
 
-def calculate_state_mean_by_category(question, state, questions_dict, my_logger):
+@webserver.route('/api/state_trend', methods=['POST'])
+def state_trend_request():
     """
-    Calculates mean values for categories within a specific state of a question.
+    Handles requests to calculate the trend over the years for a given question.
 
-    - Iterates through the specified state's data to calculate means for each combination of
-    stratification category and stratification.
-    - Skips empty categories or stratifications to avoid division by zero.
+    - Extracts question text and the optional state name from JSON request data.
+    - Submits a job to the thread pool to calculate, for every state (or only that state),
+    the per-year means, their year-over-year deltas and the least-squares slope.
+    - The job always runs on the ColumnarStore, whatever the data backend.
+    - Gets a new job ID from the thread pool.
+    - Returns the job ID associated with the submitted task.
 
-    Args:
-        question (str): The text of the question to analyze.
-        state (str): The name of the state to calculate means for.
-        questions_dict: the dictionary that contains all the necessary data
-        my_logger: useful for debug
+    Returns:
+        JSON: Response containing the submitted job's ID.
+    """
+    webserver.my_logger.info("Requesting state_trend")
+
+    # check if the threadpool is accepting requests
+    if webserver.tasks_runner.is_shutting_down():
+        webserver.my_logger.info("Threadpool is shutting down, "
+                                 "state_trend request not accepted")
 
+        return jsonify({"job_id": -1, "reason": "shutting down"})
+    # Get request data
+    data = request.json
+    question = _text(data, "question")
+    state = _text(data, "state", required=False)
+    # Register job. Don't wait for task to finish
+    _, years = _data_source(data)
+    questions_dict = webserver.data_ingestor.columnar_store
+
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after state_trend request", job_id)
+
+    new_task = (job_id, calculate_state_trend,
+                question, state, questions_dict, webserver.my_logger, years)
+    webserver.tasks_runner.submit(new_task, _cache_key("state_trend", question, state, years))
+    # Return associated job_id
+    return jsonify({"job_id": job_id})
+
+
+@webserver.route('/api/batch', methods=['POST'])
+def batch_request():
+    """
+    Handles requests to answer several analytics queries with a single job.
+
+    - Extracts the list of items ({endpoint, question, state}) from JSON request data.
+    - Rejects the request if the items are not a list of objects, or if an item names
+    an unknown endpoint or lacks its arguments.
+    - Submits a single job to the thread pool to answer all the items.
+    - Gets a new job ID from the thread pool.
+    - Returns the job ID associated with the submitted task.
 
     Returns:
-        dict: A dictionary with the state name as the key and a nested dictionary containing
-        mean values for category combinations (stratification category, stratification).
+        JSON: Response containing the submitted job's ID.
+        JSON (400): Error message for invalid items.
     """
-    my_logger.info(f"Calculating answer for state_mean_by_category "
-                   f"and question: {question}, state: {state}")
+    webserver.my_logger.info("Requesting batch")
 
-    result = {state: {}}
-    states_dict = questions_dict[question]
-    stratification_categories_dict = states_dict[state]
-    for stratification_category, stratifications_dict in stratification_categories_dict.items():
-        for stratification, data_values_dict in stratifications_dict.items():
-            sum_values = 0
-            no_values = 0
-            for _, value in data_values_dict.items():
-                sum_values += float(value)
-                no_values += 1
-            if no_values > 0 and stratification_category != "" and stratification != "":
-                new_key = "(\'" + stratification_category + "\', \'" + stratification + "\')"
-                result[state][new_key] = sum_values / no_values
+    # check if the threadpool is accepting requests
+    if webserver.tasks_runner.is_shutting_down():
+        webserver.my_logger.info("Threadpool is shutting down, "
+                                 "batch request not accepted")
+
+        return jsonify({"job_id": -1, "reason": "shutting down"})
+    # Get request data and keep only the fields used by each endpoint
+    data = request.json
+    if not isinstance(data.get("items"), list):
+        raise InvalidRequest(f"Invalid batch items {data.get('items')!r}, expected a list")
+    items = []
+    for item in data["items"]:
+        if not isinstance(item, dict) or item.get("endpoint") not in BATCH_ENDPOINTS or \
+                "question" not in item or \
+                (BATCH_ENDPOINTS[item["endpoint"]][1] and "state" not in item):
+            raise InvalidRequest(f"Invalid batch item {item}")
+        new_item = {"endpoint": item["endpoint"], "question": _text(item, "question")}
+        if BATCH_ENDPOINTS[item["endpoint"]][1]:
+            new_item["state"] = _text(item, "state")
+        items.append(new_item)
+    # Register job. Don't wait for task to finish
+    questions_dict, years = _data_source(data)
+    questions_best = (webserver.data_ingestor.questions_best_is_max,
+                      webserver.data_ingestor.questions_best_is_min)
 
-    my_logger.info(f"Got answer for state_mean_by_category "
-                   f"and question: {question}, state: {state}.")
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.my_logger.info("Submitting new job with id %s after batch request", job_id)
 
-    return result
+    new_task = (job_id, calculate_batch,
+                items, questions_dict, questions_best, webserver.my_logger, years)
+    batch_key = tuple(tuple(item.values()) for item in items)
+    webserver.tasks_runner.submit(new_task, _cache_key("batch", batch_key, years))
+    # Return associated job_id
+    return jsonify({"job_id": job_id})
 
 
 @webserver.route('/api/graceful_shutdown', methods=['GET'])
@@ -750,61 +695,169 @@ def graceful_shutdown_request():
     """
     Gracefully shuts down the ThreadPool task runner.
 
+    - Pending jobs are drained before the workers stop.
+    - Optional query parameter 'deadline' (seconds): jobs still queued after it
+    are cancelled.
+
     Returns:
         JSONResponse: 202 Accepted response with shutdown message.
     """
     webserver.my_logger.info("Requesting threadpool shutdown")
-    webserver.tasks_runner.shutdown()
+    webserver.tasks_runner.shutdown(request.args.get("deadline", type=float))
     return jsonify({'message': 'Graceful shutdown initiated'}), 202
 
 
 @webserver.route('/api/num_jobs', methods=['GET'])
 def num_jobs_request():
     """
-    Gets the number of tasks yet to be processed.
+    Gets the number of tasks yet to be processed (queued or running).
     """
     webserver.my_logger.info("Requesting number of running jobs")
-    results_dir = webserver.tasks_runner.results_dir
-    num_processed = len(os.listdir(results_dir))
-    num_encountered = len(webserver.tasks_runner.encountered_tasks)
-    num_jobs = num_encountered - num_processed
-    webserver.my_logger.info(f"There are {num_jobs} jobs running")
+    num_jobs = webserver.tasks_runner.job_registry.num_pending()
+    webserver.my_logger.info("There are %s jobs running", num_jobs)
     return jsonify({'Number of tasks': num_jobs}), 200
 
 
 @webserver.route('/api/jobs', methods=['GET'])
 def jobs_request():
     """
-    Gets completed & running jobs info, sorts by ID.
+    Gets the state of the submitted jobs, sorted by ID.
+
+    - Optional query parameters 'start' (first job_id) and 'limit' (page size)
+    return a single page of jobs, together with the 'start' of the next page.
 
     Returns:
-        JSONResponse: Status ("done"), data (job_id: "done" or "running"), sorted by ID.
+        JSONResponse: Status ("done"), data (job_id: "queued", "running", "done" or "failed").
     """
     webserver.my_logger.info("Requesting data about jobs")
-    return_data = {"status": "done", "data": []}
-    results_dir = webserver.tasks_runner.results_dir
-    # Iterate through files in the results directory
-    webserver.my_logger.info("Searching for finished jobs")
-    for filename in os.listdir(results_dir):
-        # Extract job ID from filename
-        job_id = int(filename.split(".")[0])
-        return_data["data"].append({"job_id_" + str(job_id): "done"})
-
-    potential_running_jobs = webserver.tasks_runner.encountered_tasks
-    webserver.my_logger.info("Searching for running jobs")
-    for job_id in potential_running_jobs:
-        key_to_search = "job_id_" + str(job_id)
-        if {key_to_search: "done"} not in return_data["data"]:
-            return_data["data"].append({key_to_search: "running"})
-
-    # sorts the list of dictionaries by the job_id (obtained by split)
-    # in the key of the first item in each dictionary
-    return_data["data"] = sorted(return_data["data"],
-                                 key=lambda item: int(list(item.keys())[0].split("_")[2]))
+    start = request.args.get("start", type=int)
+    limit = request.args.get("limit", type=int)
+
+    job_states = webserver.tasks_runner.job_registry.states(start, limit)
+    return_data = {"status": "done",
+                   "data": [{"job_id_" + str(job_id): state} for job_id, state in job_states]}
+    if limit is not None:
+        return_data["next"] = (1 if start is None else start) + limit
 
     return jsonify(return_data), 200
 
 
+@webserver.route('/api/pool', methods=['GET'])
+def pool_request():
+    """
+    Gets the number of workers of the thread pool, its bounds and its latest scaling
+    decisions (empty unless 'TP_MIN_THREADS' makes the pool adaptive).
+
+    Returns:
+        JSONResponse: Status ("done"), data (workers, min_workers, max_workers, decisions).
+    """
+    webserver.my_logger.info("Requesting data about the worker pool")
+    thread_pool = webserver.tasks_runner
+    autoscaler = thread_pool.autoscaler
+    return jsonify({"status": "done",
+                    "data": {"workers": thread_pool.num_workers,
+                             "min_workers": thread_pool.min_threads,
+                             "max_workers": thread_pool.num_threads,
+                             "decisions": list(autoscaler.decisions) if autoscaler else []}}), 200
+
+
+def open_event_stream(args, wakeup=None):
+    """
+    Subscribes a stream of /api/events to the completion of the jobs it asks for.
+
+    - Query parameter 'job_id' (repeated, or comma-separated ids): follow only these
+    jobs. Those already finished (or unknown) are reported right away, and the stream
+    ends once every one of them has been reported. Without it, every job is followed.
+    - Query parameter 'result' ("1", "true" or "yes"): events of done jobs carry
+    their result in 'data'.
+
+    Args:
+        args (MultiDict): query parameters of the request.
+        wakeup (callable): called after every event, see Subscription.
+
+    Returns:
+        tuple: (Subscription, set of the job ids left to report or None, include result).
+    """
+    job_ids = None
+    values = [value for arg in args.getlist("job_id") for value in arg.split(",") if value]
+    if values:
+        try:
+            job_ids = {int(value) for value in values}
+        except ValueError as error:
+            raise InvalidRequest(f"Invalid job_id in {values!r}") from error
+    include_result = args.get("result", "").lower() in ("1", "true", "yes")
+
+    subscription = webserver.tasks_runner.events.subscribe(job_ids, wakeup)
+    job_registry = webserver.tasks_runner.job_registry
+    for job_id in sorted(job_ids or ()):
+        job_info = job_registry.get(job_id)
+        if job_info is None or job_info.state in (DONE, FAILED, CANCELLED):
+            subscription.push(job_event(job_id, job_info))
+    return subscription, None if job_ids is None else set(job_ids), include_result
+
+
+def job_event_message(event, remaining, include_result):
+    """
+    Formats the event of a finished job, or returns None if the stream already
+    reported it (a job may finish while being looked up by open_event_stream).
+    """
+    job_id = event["job_id"]
+    if remaining is not None:
+        if job_id not in remaining:
+            return None
+        remaining.discard(job_id)
+    if include_result and event["status"] == DONE:
+        event = {**event, "data": task_data_for(job_id, webserver.my_logger)}
+    return sse_message(event, event_id=job_id)
+
+
+@webserver.route('/api/events', methods=['GET'])
+def events_request():
+    """
+    Streams the completion of jobs as server-sent events (text/event-stream), saving
+    clients from polling /api/get_results.
+
+    - Every finished job is sent as an event "job" whose data is its job_id and
+    status ("done", or "error" with a reason), see open_event_stream for the query
+    parameters.
+    - A comment is sent every KEEPALIVE_SECONDS without events.
+
+    Returns:
+        Response: The event stream.
+    """
+    subscription, remaining, include_result = open_event_stream(request.args)
+    webserver.my_logger.info("Streaming events of jobs %s",
+                             "all" if remaining is None else sorted(remaining))
+
+    def stream():
+        try:
+            while remaining is None or remaining:
+                events = subscription.pop_all(KEEPALIVE_SECONDS)
+                if not events:
+                    yield KEEPALIVE
+                for event in events:
+                    message = job_event_message(event, remaining, include_result)
+                    if message is not None:
+                        yield message
+        finally:
+            webserver.tasks_runner.events.unsubscribe(subscription)
+
+    return webserver.response_class(stream(), mimetype="text/event-stream",
+                                    headers={"Cache-Control": "no-cache"})
+
+
+@webserver.route('/metrics', methods=['GET'])
+def metrics_request():
+    """
+    Exports the metrics of the job pipeline in the Prometheus text format: queue depth,
+    jobs per state and per endpoint, queue wait and execution time histograms,
+    result store lookups and ingest time.
+    """
+    return webserver.response_class(render_metrics(webserver.tasks_runner,
+                                                   webserver.data_ingestor),
+                                    mimetype="text/plain; version=0.0.4")
+
+
 # You can check localhost in your browser to see what this displays
 @webserver.route('/')
 @webserver.route('/index')
@@ -0,0 +1,110 @@
+"""
+Binary snapshots of the ingested data.
+
+A snapshot is a directory holding the arrays of a `ColumnarStore` (including its year
+index) as .npy files (loaded memory-mapped) and its name tables as JSON. It is keyed by the size,
+modification time and content hash of the CSV file, so a server restarted on the
+same CSV loads the snapshot instead of parsing the CSV again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from app.columnar_store import ColumnarStore
+
+# Bumped whenever the layout of a snapshot changes; older snapshots are then ignored
+SNAPSHOT_FORMAT = 5
+
+SNAPSHOT_PREFIX = "snapshot-"
+
+
+def snapshot_key(csv_path):
+    """
+    Identifies the content of a CSV file (and the snapshot format).
+
+    Returns:
+        str: hex digest of the format version, the file size, mtime and content hash.
+    """
+    file_stat = os.stat(csv_path)
+    content_hash = hashlib.sha256()
+    with open(csv_path, 'rb') as csv_file:
+        for chunk in iter(lambda: csv_file.read(1 << 20), b""):
+            content_hash.update(chunk)
+
+    key = hashlib.sha256(f"{SNAPSHOT_FORMAT}:{file_stat.st_size}:{file_stat.st_mtime_ns}:"
+                         f"{content_hash.hexdigest()}".encode())
+    return key.hexdigest()[:32]
+
+
+def snapshot_path(snapshot_dir, key):
+    """
+    Returns the directory of the snapshot with the given key.
+    """
+    return os.path.join(snapshot_dir, f"{SNAPSHOT_PREFIX}{key}")
+
+
+def write_snapshot(snapshot_dir, key, store, meta=None):
+    """
+    Writes a ColumnarStore as the snapshot `key` and removes the snapshots of other keys.
+
+    The files are written to a temporary directory which is then renamed, so
+    concurrent readers either see a complete snapshot or none at all.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=snapshot_dir, prefix=".tmp-")
+    try:
+        np.save(os.path.join(temp_dir, "values.npy"), store.values)
+        np.save(os.path.join(temp_dir, "codes.npy"), store.codes)
+        np.save(os.path.join(temp_dir, "year_ends.npy"), store.year_ends)
+        np.save(os.path.join(temp_dir, "duplicates.npy"), store.duplicates)
+        year_order, sorted_years = store.get_year_index()
+        np.save(os.path.join(temp_dir, "year_order.npy"), year_order)
+        np.save(os.path.join(temp_dir, "sorted_years.npy"), sorted_years)
+        with open(os.path.join(temp_dir, "tables.json"), 'w', encoding='utf-8') as tables_file:
+            json.dump(store.tables, tables_file)
+        with open(os.path.join(temp_dir, "meta.json"), 'w', encoding='utf-8') as meta_file:
+            json.dump({"format": SNAPSHOT_FORMAT, "key": key, **(meta or {})}, meta_file)
+        os.replace(temp_dir, snapshot_path(snapshot_dir, key))
+    except OSError:
+        # Another process may have renamed an identical snapshot in place first
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.isdir(snapshot_path(snapshot_dir, key)):
+            raise
+
+    for name in os.listdir(snapshot_dir):
+        if name.startswith(SNAPSHOT_PREFIX) and name != f"{SNAPSHOT_PREFIX}{key}":
+            shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def load_snapshot(snapshot_dir, key, mmap=True):
+    """
+    Loads the snapshot `key`, with its arrays memory-mapped read-only when `mmap` is set.
+
+    Returns:
+        tuple: (ColumnarStore, meta dict), or None if there is no usable snapshot.
+    """
+    path = snapshot_path(snapshot_dir, key)
+    try:
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("format") != SNAPSHOT_FORMAT or meta.get("key") != key:
+            return None
+        with open(os.path.join(path, "tables.json"), 'r', encoding='utf-8') as tables_file:
+            tables = json.load(tables_file)
+        mmap_mode = 'r' if mmap else None
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode)
+        codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mmap_mode)
+        year_ends = np.load(os.path.join(path, "year_ends.npy"), mmap_mode=mmap_mode)
+        duplicates = np.load(os.path.join(path, "duplicates.npy"), mmap_mode=mmap_mode)
+        year_index = (np.load(os.path.join(path, "year_order.npy"), mmap_mode=mmap_mode),
+                      np.load(os.path.join(path, "sorted_years.npy"), mmap_mode=mmap_mode))
+    except (OSError, ValueError):
+        return None
+    store = ColumnarStore(values, codes, tables, year_ends, duplicates)
+    store.year_index = year_index
+    return store, meta
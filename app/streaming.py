@@ -0,0 +1,96 @@
+"""
+Incremental serialization of job results.
+
+Large results (e.g. mean_by_category) are written out in chunks by generators,
+instead of being serialized into a single string:
+
+* `iter_ndjson` - one JSON document per line: a single-entry object per entry of
+a dict result, one line per item of a list result.
+* `iter_json` - the same bytes as the non-streamed response (jsonify),
+{"data": ..., "status": "done"}, produced a few entries at a time.
+
+Only the serialization is bounded: the `calculate_*` functions still build the whole
+result before it is written out, so streaming cuts the size of the serialized copy,
+not the peak memory of the job.
+"""
+
+import json
+
+# Entries serialized per chunk written to the response
+CHUNK_ENTRIES = 256
+
+# How Flask's jsonify serializes (outside debug mode): sorted keys, compact, ASCII only
+JSONIFY_ARGS = {"sort_keys": True, "separators": (",", ":"), "ensure_ascii": True}
+
+
+def _entries(data, dumps_args=None):
+    """
+    Serializes the entries of a dict ("key": value) or a list (value), one by one.
+
+    With `dumps_args` (e.g. JSONIFY_ARGS), the values are serialized with them, and
+    with their "sort_keys" the entries of a dict come in key order.
+    """
+    dumps_args = dumps_args or {}
+    if isinstance(data, dict):
+        key_separator = dumps_args.get("separators", (", ", ": "))[1]
+        items = sorted(data.items()) if dumps_args.get("sort_keys") else data.items()
+        for key, value in items:
+            yield json.dumps(key, **dumps_args) + key_separator + \
+                json.dumps(value, **dumps_args)
+    else:
+        for value in data:
+            yield json.dumps(value, **dumps_args)
+
+
+def _chunks(lines, separator):
+    """
+    Joins serialized entries into chunks of at most CHUNK_ENTRIES entries.
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_ENTRIES:
+            yield separator.join(chunk)
+            chunk = []
+    if chunk:
+        yield separator.join(chunk)
+
+
+def iter_ndjson(data):
+    """
+    Yields the result of a job as newline-delimited JSON.
+    """
+    if isinstance(data, dict):
+        lines = ("{" + entry + "}" for entry in _entries(data))
+    elif isinstance(data, list):
+        lines = _entries(data)
+    else:
+        lines = iter([json.dumps(data)])
+    for chunk in _chunks(lines, "\n"):
+        yield chunk + "\n"
+
+
+def iter_json(data):
+    """
+    Yields {"data": <result>, "status": "done"} as JSON, a chunk of entries at a time,
+    byte for byte like jsonify({'status': "done", 'data': <result>}).
+    """
+    yield '{"data":'
+    if isinstance(data, (dict, list)):
+        opening, closing = ("{", "}") if isinstance(data, dict) else ("[", "]")
+        yield opening
+        first = True
+        for chunk in _chunks(_entries(data, JSONIFY_ARGS), ","):
+            yield chunk if first else "," + chunk
+            first = False
+        yield closing
+    else:
+        yield json.dumps(data, **JSONIFY_ARGS)
+    yield ',"status":"done"}\n'
+
+
+# Formats of /api/get_results/<job_id>?stream=<format> -> (generator, mimetype)
+STREAM_FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+    "json": (iter_json, "application/json"),
+}
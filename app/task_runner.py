@@ -2,22 +2,83 @@
 Provides a ThreadPool class for managing asynchronous task execution.
 """
 
+import itertools
 import os
-import pickle
-import queue
-from threading import Thread, Event
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread, Event, Lock
 
+from app.admission import Overloaded, ThroughputMeter
+from app.autoscaler import Autoscaler, LoadTracker
+from app.events import JobEvents
+from app.fair_queue import FairQueue, STOP, parse_weights
+from app.job_cache import JobCache, HIT, LEADER, REJECTED
+from app.job_registry import JobRegistry
+from app.metrics import JobMetrics, job_endpoint
+from app.result_store import MemoryResultStore
 
-class ThreadPool:
+EXECUTION_MODES = ("thread", "process")
+
+# Objects that worker processes inherit through fork instead of receiving them pickled
+# with every task, see ThreadPool._fork_processes
+_SHARED_OBJECTS = []
+
+
+class _SharedRef:  # pylint: disable=too-few-public-methods
+    """
+    Stands for an entry of _SHARED_OBJECTS in the arguments sent to a worker process.
+    """
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _run_shared(compute_function, args):
+    """
+    Runs a task in a worker process, resolving the shared objects it refers to.
+    """
+    args = [_SHARED_OBJECTS[arg.index] if isinstance(arg, _SharedRef) else arg for arg in args]
+    return compute_function(*args)
+
+
+class ThreadPool:  # pylint: disable=too-many-instance-attributes
     """
     Manages a pool of worker threads
 
     - Utilizes environment variable 'TP_NUM_OF_THREADS' to configure thread count
     (default: CPU cores).
+    - With 'TP_MIN_THREADS' below that count, the pool starts with 'TP_MIN_THREADS' workers
+    and an Autoscaler grows and shrinks it between the two every 'TP_SCALE_INTERVAL'
+    seconds (default: 1), from the queue depth, the queue wait (target:
+    'TP_TARGET_QUEUE_WAIT', default: 0.1 seconds) and the utilization of the workers.
     - Provides methods to submit tasks, wait for completion, and shut down gracefully.
+    - Hands out job IDs, safe to call from concurrent request handlers.
+    - Tracks the state of every submitted job in a JobRegistry, which forgets the oldest
+    finished jobs beyond 'JOB_REGISTRY_SIZE' jobs.
+    - Publishes the completion of every job to the subscribers of `events` (/api/events).
+    - Coalesces identical jobs and memoizes their results in a JobCache
+    (size given by environment variable 'JOB_CACHE_SIZE').
+    - Queues the tasks per endpoint in a FairQueue, which shares the workers between
+    the endpoints according to their weights ('TP_ENDPOINT_WEIGHTS', e.g.
+    "state_mean=4,batch=0.5", default: 1) and the measured cost of their jobs.
+    - Runs the jobs submitted as lookups (a constant number of reads of the unfiltered
+    AggregateIndex, see `submit`) right away in the submitting thread, instead of queuing
+    them behind slower jobs. 'TP_FAST_LANE' set to 0 disables this.
+    - Bounds the task queue: once 'TP_QUEUE_HIGH_WATER' tasks (default: 1024, 0 for no
+    bound) are waiting, jobs that would have to be computed are rejected with `Overloaded`
+    until the queue drains below 'TP_QUEUE_LOW_WATER' (default: 3/4 of the high-water
+    mark). Cached and in flight results are still served.
+    - Counts submitted jobs and times their wait in the queue and their execution
+    in `metrics` (see app/metrics.py).
+    - Utilizes environment variable 'TP_EXECUTION_MODE' to choose where the tasks run:
+    "thread" (default) runs them on the worker threads, "process" has every worker thread
+    dispatch its tasks to a pool of as many forked worker processes, sidestepping the GIL.
+    The processes inherit the `shared` objects (e.g. the ingested data), see _fork_processes.
     """
 
-    def __init__(self):
+    def __init__(self, shared=()):
         # You must implement a ThreadPool of TaskRunners
         # Your ThreadPool should check if an environment variable TP_NUM_OF_THREADS is defined
         # If the env var is defined, that is the number of threads to be used by the thread pool
@@ -28,44 +89,249 @@ class ThreadPool:
         #   * recreate threads for each task
 
         self.num_threads = int(os.getenv("TP_NUM_OF_THREADS", os.cpu_count() or 1))
-        self.task_queue = queue.Queue()
-        self.results_dir = ""
-        self.encountered_tasks = []
+        self.execution_mode = os.getenv("TP_EXECUTION_MODE", "thread")
+        if self.execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode '{self.execution_mode}', "
+                             f"expected one of {EXECUTION_MODES}")
+        self.process_pool = None
+        self.shared_indexes = {}
+        self.task_queue = FairQueue(parse_weights(os.getenv("TP_ENDPOINT_WEIGHTS")))
+        self.fast_lane = os.getenv("TP_FAST_LANE", "1") != "0"
+        self.high_water = int(os.getenv("TP_QUEUE_HIGH_WATER", "1024"))
+        self.low_water = int(os.getenv("TP_QUEUE_LOW_WATER", str(self.high_water * 3 // 4)))
+        self.shedding = False
+        self.throughput = ThroughputMeter()
+        self.result_store = MemoryResultStore()
+        # next() on an itertools.count is atomic, no two callers get the same job ID
+        self.job_ids = itertools.count(1)
+        self.job_registry = JobRegistry(int(os.getenv("JOB_REGISTRY_SIZE", "100000")))
+        self.events = JobEvents()
+        self.job_registry.listeners.append(self.events.publish)
+        self.job_cache = JobCache(int(os.getenv("JOB_CACHE_SIZE", "1024")))
+        self.metrics = JobMetrics()
         self.shutdown_event = Event()
         self.task_runners = []
+        self.runners_lock = Lock()
+        self.load = LoadTracker()
+        self.min_threads = min(self.num_threads,
+                               max(1, int(os.getenv("TP_MIN_THREADS", str(self.num_threads)))))
+        self.num_workers = 0
+        if self.execution_mode == "process":
+            # Before any thread of the pool starts, see _fork_processes
+            self._fork_processes(shared)
 
         # Create and start TaskRunner threads
-        for _ in range(self.num_threads):
-            task_runner = TaskRunner(self.task_queue, self.results_dir, self.shutdown_event)
-            task_runner.start()
-            self.task_runners.append(task_runner)
+        self.resize(self.min_threads)
+        self.autoscaler = None
+        if self.min_threads < self.num_threads:
+            self.autoscaler = Autoscaler(self, float(os.getenv("TP_SCALE_INTERVAL", "1")),
+                                         float(os.getenv("TP_TARGET_QUEUE_WAIT", "0.1")))
+            self.autoscaler.start()
 
-    def submit(self, task):
+    def resize(self, num_workers):
+        """
+        Starts or stops TaskRunners until there are `num_workers` of them.
+
+        - Stopping workers are sent a STOP, which they only get once the queue is empty.
+        - Nothing changes once the pool is shutting down.
+
+        Returns:
+            bool: whether the pool was resized.
+        """
+        with self.runners_lock:
+            if self.shutdown_event.is_set() or num_workers == self.num_workers:
+                return False
+            for _ in range(num_workers - self.num_workers):
+                task_runner = TaskRunner(self)
+                task_runner.start()
+                self.task_runners.append(task_runner)
+            for _ in range(self.num_workers - num_workers):
+                self.task_queue.put(STOP)
+            self.num_workers = num_workers
+            return True
+
+    def runner_stopped(self, task_runner):
+        """
+        Forgets a TaskRunner that took a STOP because the pool shrank (the ones
+        stopped by shutdown are kept).
+        """
+        with self.runners_lock:
+            if not self.shutdown_event.is_set():
+                self.task_runners.remove(task_runner)
+
+    def new_job_id(self):
+        """
+        Returns a job ID that was never handed out before (1, 2, 3...).
+        """
+        return next(self.job_ids)
+
+    def submit(self, task, cache_key=None, lookup=False):
         """
         Submits a task (function, arguments) to the queue for asynchronous execution.
+
+        - If a cache_key is given, a cached result for it is served right away and
+        a job identical to one already in flight shares its computation.
+        - A `lookup` task (the caller vouches that it is answered in O(1), e.g. from the
+        sums of the AggregateIndex) runs right away in the calling thread.
+        - Raises Overloaded, with a Retry-After estimate, if the job must be computed
+        and the task queue is over its high-water mark.
+        """
+        job_id = task[0]
+        # Registered before the claim: a job joining one in flight may finish right away
+        self.job_registry.add(job_id)
+        try:
+            if cache_key is None:
+                outcome, result = (LEADER if self._has_room() else REJECTED), None
+            else:
+                outcome, result = self.job_cache.claim(cache_key, job_id, self._has_room)
+        except Exception:
+            # e.g. a cache key that cannot be hashed: the job was never accepted
+            self.job_registry.discard(job_id)
+            raise
+
+        if outcome == REJECTED:
+            self.job_registry.discard(job_id)
+            self.metrics.jobs_rejected.inc(job_endpoint(task), "queue full")
+            raise Overloaded("queue full", self.throughput.time_to_finish(
+                self.task_queue.qsize() - self.low_water + 1))
+
+        self.metrics.jobs_submitted.inc(job_endpoint(task), "none" if cache_key is None
+                                        else outcome)
+        if outcome == HIT:
+            self.result_store.put(job_id, result)
+            self.job_registry.mark_done(job_id)
+        elif outcome == LEADER:
+            if lookup and self.fast_lane:
+                self.run_task(task)
+            else:
+                self.task_queue.put(task)
+
+    def _has_room(self):
+        """
+        Tells whether a task may be queued: once the queue reaches the high-water mark,
+        no task is queued until it drains below the low-water mark.
         """
-        self.task_queue.put(task)
-        self.encountered_tasks.append(task[0])
+        if self.high_water <= 0:
+            return True
+        depth = self.task_queue.qsize()
+        if depth >= self.high_water:
+            self.shedding = True
+        elif depth < self.low_water:
+            self.shedding = False
+        return not self.shedding
 
-    def shutdown(self):
+    def _fork_processes(self, objects):
+        """
+        Starts the worker processes, which inherit `objects` through fork. Tasks then
+        refer to them instead of pickling them.
+
+        Must run before the pool starts its threads: a process forked while another
+        thread holds a lock (of the logger, the queue, the registry...) starts with that
+        lock held forever. The caller must not have started threads either.
+        """
+        _SHARED_OBJECTS[:] = objects
+        self.shared_indexes = {id(shared_object): index
+                               for index, shared_object in enumerate(objects)}
+        self.process_pool = ProcessPoolExecutor(self.num_threads,
+                                                mp_context=multiprocessing.get_context("fork"))
+        # With fork, all the worker processes are started by the first submit, before the
+        # executor's own management thread
+        self.process_pool.submit(int).result()
+
+    def execute(self, task):
+        """
+        Runs a task (job_id, function, arguments) and returns its result.
+        """
+        (_, compute_function, *args) = task
+        if self.process_pool is None:
+            return compute_function(*args)
+        args = [_SharedRef(self.shared_indexes[id(arg)]) if id(arg) in self.shared_indexes
+                else arg for arg in args]
+        return self.process_pool.submit(_run_shared, compute_function, args).result()
+
+    def run_task(self, task):
+        """
+        Runs a queued job and hands its result (or error) to job_done (or job_failed).
+        """
+        job_id = task[0]
+        endpoint = job_endpoint(task)
+        job_info = self.job_registry.get(job_id)
+        self.job_registry.mark_running(job_id)
+        self.metrics.queue_wait.observe(job_info.started_at - job_info.submitted_at, endpoint)
+        start_time = time.perf_counter()
+        try:
+            result = self.execute(task)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # A failing job must not take its worker thread down with it
+            self.job_failed(job_id, f"{type(error).__name__}: {error}")
+            return
+        finally:
+            execution_time = time.perf_counter() - start_time
+            self.metrics.execution_time.observe(execution_time, endpoint)
+            self.task_queue.record_cost(endpoint, execution_time)
+            self.load.record(job_info.started_at - job_info.submitted_at, execution_time)
+        self.job_done(job_id, result)
+
+    def job_done(self, job_id, result):
+        """
+        Stores the result of a finished job and of the identical jobs that joined it.
+        """
+        self.throughput.mark()
+        for done_job_id in [job_id] + self.job_cache.complete(job_id, result):
+            self.result_store.put(done_job_id, result)
+            self.job_registry.mark_done(done_job_id)
+
+    def job_failed(self, job_id, error):
+        """
+        Marks a job, and the identical jobs that joined it, as failed.
+        """
+        self.throughput.mark()
+        for failed_job_id in [job_id] + self.job_cache.fail(job_id):
+            self.job_registry.mark_failed(failed_job_id, error)
+
+    def shutdown(self, deadline=None):
         """
         Initiates a graceful shutdown of the thread pool.
 
         - Signals worker threads to stop accepting new tasks.
-        - Waits for all pending tasks to complete.
+        - Queues one STOP per worker thread, only handed out once the pending tasks
+        are all taken, so that the queue is drained before the workers stop.
+        - If a deadline (seconds) is given, the tasks still queued when it passes are
+        cancelled instead of being run.
         - Joins worker threads to ensure proper termination.
         """
-        self.shutdown_event.set()
-        for task_runner in self.task_runners:
+        with self.runners_lock:
+            self.shutdown_event.set()
+            task_runners = list(self.task_runners)
+            for _ in range(self.num_workers):
+                self.task_queue.put(STOP)
+
+        if deadline is not None:
+            deadline_time = time.monotonic() + deadline
+            for task_runner in task_runners:
+                task_runner.join(max(0.0, deadline_time - time.monotonic()))
+            self._cancel_queued()
+
+        for task_runner in task_runners:
             task_runner.join()
+        # Tasks submitted while the shutdown started never run
+        self._cancel_queued()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+
+    def _cancel_queued(self):
+        """
+        Empties the queue, cancelling the tasks in it and keeping the STOPs.
+        """
+        for task in self.task_queue.drain():
+            for job_id in [task[0]] + self.job_cache.fail(task[0]):
+                self.job_registry.mark_cancelled(job_id)
 
-    def update_results_dir(self, results_dir):
+    def update_result_store(self, result_store):
         """
-        Updates the results directory for the thread pool and its task runners.
+        Updates the result store for the thread pool and its task runners.
         """
-        self.results_dir = results_dir
-        for task_runner in self.task_runners:
-            task_runner.results_dir = results_dir
+        self.result_store = result_store
 
     def is_shutting_down(self):
         """
@@ -78,35 +344,21 @@ class TaskRunner(Thread):
     """
     Worker thread responsible for retrieving tasks from the queue and executing them.
 
-    - Continuously checks for tasks until signaled to shut down.
-    - Executes retrieved tasks and stores results in a shared list.
+    - Blocks on the queue until a task (or the STOP poison pill) arrives.
+    - Has the ThreadPool run the retrieved tasks.
     """
 
-    def __init__(self, task_queue, results_dir, shutdown_event):
+    def __init__(self, thread_pool):
         super().__init__()
-        self.task_queue = task_queue
-        self.results_dir = results_dir
-        self.shutdown_event = shutdown_event
+        self.thread_pool = thread_pool
+        self.task_queue = thread_pool.task_queue
 
     def run(self):
         while True:
-            # Stop if graceful_shutdown and there are no tasks to poll
-            if self.shutdown_event.is_set() and self.task_queue.empty():
+            # Wait for a pending job, stop at the poison pill queued by shutdown
+            task = self.task_queue.get()
+            if task is STOP:
+                self.thread_pool.runner_stopped(self)
                 return
-            try:
-                # Get pending job
-                task = self.task_queue.get(timeout=1)  # Wait for a task for 1 second
-            except queue.Empty:
-                continue  # If no task is available, check again
-            # Execute the job and save the result to disk
-            job_id, result = self._execute_task(task)
-            filename = os.path.join(self.results_dir, f"{job_id}.pkl")
-
-            with open(filename, 'wb') as job_file:
-                pickle.dump(result, job_file)
-
-    @staticmethod
-    def _execute_task(task):
-        (job_id, compute_function, *args) = task
-        result = compute_function(*args)
-        return job_id, result
+            # Execute the job and save the result
+            self.thread_pool.run_task(task)
@@ -0,0 +1,319 @@
+"""
+Load-testing harness for the webserver API.
+
+Drives a running server at a configurable concurrency against every endpoint of
+app/routes.py, using the tests/<endpoint>/input payloads as the request corpus:
+
+* POST endpoints submit a job, then poll /api/get_results/<job_id> (with ?wait) until
+the job is done; each endpoint is benchmarked in its own phase.
+* /api/state_trend and /api/batch have no test directory, their payloads are derived
+from the state_mean inputs; GET endpoints (num_jobs, jobs, metrics) are probed as is.
+
+The corpus is replayed, so after its first round the server answers the POST endpoints
+from the cache of its JobCache. Each endpoint is therefore run twice (--cache both):
+
+* cold: the requests are sent with a 'Cache-Control: no-cache' header, which makes the
+server bypass its JobCache, so that every job is computed by the configured backend.
+* warm: the requests are sent without it, measuring the cached path.
+
+For every endpoint it reports the throughput, the p50/p95/p99 latency of the HTTP
+requests and the completion time of the jobs (submission to result), and can write
+them as JSON (--output) and compare them with a previous run (--baseline), failing
+when a percentile regressed by more than --max-regression.
+
+Usage:
+    python checker/benchmark.py --concurrency 16 --requests 200 --output bench.json
+    python checker/benchmark.py --baseline bench.json --max-regression 0.2
+    python checker/benchmark.py --cache cold --endpoints state_mean best5
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import cycle, islice
+
+import requests
+
+# Endpoints answered directly, without submitting a job
+GET_ENDPOINTS = {
+    "num_jobs": "/api/num_jobs",
+    "jobs": "/api/jobs?limit=100",
+    "metrics": "/metrics",
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_corpus(tests_dir):
+    """
+    Reads the request payloads of every endpoint from tests_dir/<endpoint>/input/*.json.
+
+    Returns:
+        dict: endpoint -> list of payloads, including the derived state_trend and batch ones.
+    """
+    corpus = {}
+    for endpoint in sorted(os.listdir(tests_dir)):
+        input_dir = os.path.join(tests_dir, endpoint, "input")
+        if not os.path.isdir(input_dir):
+            continue
+        payloads = []
+        for input_file in sorted(os.listdir(input_dir)):
+            with open(os.path.join(input_dir, input_file), "r", encoding="utf-8") as fin:
+                payloads.append(json.load(fin))
+        corpus[endpoint] = payloads
+
+    # The trend of a state and a batch of per-state queries reuse the state_mean inputs
+    state_payloads = corpus.get("state_mean", [])
+    corpus.setdefault("state_trend", [dict(payload) for payload in state_payloads])
+    corpus.setdefault("batch", [
+        {"items": [{"endpoint": endpoint, **payload}
+                   for endpoint in ("state_mean", "state_diff_from_mean", "global_mean")]}
+        for payload in state_payloads])
+    return corpus
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list, None if it is empty.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples):
+    """
+    Summarizes durations in seconds: count, mean, max and the PERCENTILES, in milliseconds.
+    """
+    values = sorted(samples)
+    summary = {"count": len(values)}
+    if values:
+        summary["mean_ms"] = round(1000 * sum(values) / len(values), 3)
+        summary["max_ms"] = round(1000 * values[-1], 3)
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f"p{pct}_ms"] = None if value is None else round(1000 * value, 3)
+    return summary
+
+
+class Phase:  # pylint: disable=too-few-public-methods
+    """
+    Samples collected while benchmarking one endpoint, shared by the client threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.completions = []
+        self.errors = {}
+
+    def record(self, latencies, completion=None, error=None):
+        """
+        Adds the HTTP request latencies of one operation, and its job completion time
+        or the reason it failed.
+        """
+        with self.lock:
+            self.latencies.extend(latencies)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            elif completion is not None:
+                self.completions.append(completion)
+
+
+def timed(session, method, url, **kwargs):
+    """
+    Sends a request and returns (response, latency in seconds).
+    """
+    start = time.perf_counter()
+    response = session.request(method, url, **kwargs)
+    return response, time.perf_counter() - start
+
+
+def run_job(session, base_url, endpoint, payload, options):
+    """
+    Submits a job and polls its result until it is done.
+
+    Returns:
+        tuple: (list of request latencies, completion time or None, error or None).
+    """
+    latencies = []
+    start = time.perf_counter()
+    response, latency = timed(session, "POST", f"{base_url}/api/{endpoint}", json=payload,
+                              timeout=options.timeout)
+    latencies.append(latency)
+    job_id = response.json().get("job_id", -1) if response.ok else -1
+    if job_id == -1:
+        return latencies, None, f"submit: HTTP {response.status_code}"
+
+    while True:
+        response, latency = timed(session, "GET", f"{base_url}/api/get_results/{job_id}",
+                                  params={"wait": options.poll_wait}, timeout=options.timeout)
+        latencies.append(latency)
+        answer = response.json() if response.ok else {}
+        if answer.get("status") == "done":
+            return latencies, time.perf_counter() - start, None
+        if answer.get("status") != "running":
+            return latencies, None, f"result: {answer.get('reason', response.status_code)}"
+        if time.perf_counter() - start > options.job_timeout:
+            return latencies, None, "result: timeout"
+
+
+def run_probe(session, base_url, path, options):
+    """
+    Sends a GET request to an endpoint answered without a job.
+    """
+    response, latency = timed(session, "GET", f"{base_url}{path}", timeout=options.timeout)
+    return [latency], None, None if response.ok else f"HTTP {response.status_code}"
+
+
+def run_phase(endpoint, work, options, cold=False):
+    """
+    Runs `options.requests` operations of an endpoint on `options.concurrency` threads,
+    bypassing the JobCache of the server if `cold`.
+
+    Returns:
+        dict: throughput, errors, request latency and job completion time summaries.
+    """
+    phase = Phase()
+    local = threading.local()
+
+    def operation(item):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            if cold:
+                local.session.headers["Cache-Control"] = "no-cache"
+        try:
+            if endpoint in GET_ENDPOINTS:
+                phase.record(*run_probe(local.session, options.url, item, options))
+            else:
+                phase.record(*run_job(local.session, options.url, endpoint, item, options))
+        except (requests.RequestException, ValueError) as error:
+            phase.record([], error=type(error).__name__)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        list(executor.map(operation, islice(cycle(work), options.requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "operations": options.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(options.requests / elapsed, 2) if elapsed else None,
+        "errors": phase.errors,
+        "latency": summarize(phase.latencies),
+        "completion": summarize(phase.completions),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compares the percentiles of two runs.
+
+    Returns:
+        list: descriptions of the percentiles more than `max_regression` (a ratio) slower.
+    """
+    regressions = []
+    for endpoint, result in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        for metric in ("latency", "completion"):
+            for pct in PERCENTILES:
+                key = f"p{pct}_ms"
+                new, old = result[metric].get(key), previous[metric].get(key)
+                if new is not None and old and new > old * (1 + max_regression):
+                    regressions.append(f"{endpoint} {metric} {key}: {old} -> {new}")
+    return regressions
+
+
+def print_report(results):
+    """
+    Prints one line per endpoint: throughput, errors and the latency/completion percentiles.
+    """
+    print(f"{'endpoint':<32}{'ops/s':>10}{'errors':>8}  latency p50/p95/p99 ms"
+          "       completion p50/p95/p99 ms")
+    for endpoint, result in results["endpoints"].items():
+        latency = "/".join(str(result["latency"][f"p{pct}_ms"]) for pct in PERCENTILES)
+        completion = "/".join(str(result["completion"][f"p{pct}_ms"]) for pct in PERCENTILES)
+        print(f"{endpoint:<32}{result['throughput_per_s']:>10}"
+              f"{sum(result['errors'].values()):>8}  {latency:<29}{completion}")
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line options.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server base URL")
+    parser.add_argument("--tests-dir", default="tests", help="request corpus directory")
+    parser.add_argument("--endpoints", nargs="+", help="endpoints to run (default: all)")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="operations per endpoint")
+    parser.add_argument("--poll-wait", type=float, default=1.0,
+                        help="?wait (seconds) of each get_results poll")
+    parser.add_argument("--timeout", type=float, default=10.0, help="HTTP request timeout")
+    parser.add_argument("--job-timeout", type=float, default=30.0,
+                        help="time after which a job still running counts as an error")
+    parser.add_argument("--cache", choices=("cold", "warm", "both"), default="both",
+                        help="run the job endpoints bypassing the job cache of the server "
+                             "(cold), through it (warm) or both, reported separately")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="tolerated slowdown of a percentile over the baseline (ratio)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the benchmark and returns the exit status: 1 if a percentile regressed.
+    """
+    options = parse_args(argv)
+    corpus = load_corpus(options.tests_dir)
+    work = {**corpus, **{name: [path] for name, path in GET_ENDPOINTS.items()}}
+    endpoints = options.endpoints or list(work)
+    unknown = [endpoint for endpoint in endpoints if not work.get(endpoint)]
+    if unknown:
+        sys.exit(f"No requests for endpoints {unknown}")
+
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {name: getattr(options, name)
+                   for name in ("url", "concurrency", "requests", "poll_wait", "cache")},
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        # The GET endpoints are not cached, they only have the one phase
+        if endpoint in GET_ENDPOINTS:
+            results["endpoints"][endpoint] = run_phase(endpoint, work[endpoint], options)
+            continue
+        if options.cache in ("cold", "both"):
+            results["endpoints"][f"{endpoint} (cold)"] = run_phase(
+                endpoint, work[endpoint], options, cold=True)
+        if options.cache in ("warm", "both"):
+            results["endpoints"][f"{endpoint} (warm)"] = run_phase(
+                endpoint, work[endpoint], options)
+    print_report(results)
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as fout:
+            json.dump(results, fout, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, "r", encoding="utf-8") as fin:
+            regressions = compare(results, json.load(fin), options.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
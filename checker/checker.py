@@ -120,7 +120,8 @@ class TestAPI(unittest.TestCase):
                 job_id = job_id["job_id"]
 
                 self.check_res_timeout(
-                    res_callable = lambda: requests.get(f"http://127.0.0.1:5000/api/get_results/{job_id}"),
+                    res_callable = lambda: requests.get(f"http://127.0.0.1:5000/api/get_results/{job_id}",
+                                                        params={"wait": 1}),
                     ref_result = ref_result,
                     timeout_sec = 1)
 
@@ -0,0 +1,209 @@
+"""
+Micro-benchmarks of DataIngestor and the calculate_* functions, without a server.
+
+For every scale (default 1x, 10x and 100x the rows of the real CSV), a synthetic
+dataset is written by checker/synthetic_data.py and:
+
+* `DataIngestor` is built with every backend (the "mmap" one from an existing
+snapshot, i.e. the restart path; its snapshot is written once beforehand).
+* Every calculate_* function is run on the data source of every backend, with the
+first question and state of the data (calculate_state_trend only on ColumnarStore).
+
+Like pytest-benchmark, each benchmark is calibrated to run for at least --min-time
+per round and reports the min/median/mean time per call over --rounds rounds. The
+report shows the median at every scale and the scaling exponent between the
+smallest and the largest scale (about 1 for linear work, 0 for constant time), so
+algorithmic regressions show up as a higher exponent.
+
+Usage (from the root folder):
+    PYTHONPATH=. python checker/microbench.py --scales 1 10 100 --output microbench.json
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Importing a module of the app package runs app/__init__.py, which builds the webserver:
+# it ingests the CSV, starts the thread pool and clears results/. None of it is needed to
+# benchmark the data structures, so the package is registered without running it.
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+APP_SPEC = importlib.util.spec_from_file_location("app", os.path.join(APP_DIR, "__init__.py"),
+                                                  submodule_search_locations=[APP_DIR])
+sys.modules.setdefault("app", importlib.util.module_from_spec(APP_SPEC))
+
+# pylint: disable=wrong-import-position
+from synthetic_data import write_csv
+
+from app.calculations import calculate_states_mean, calculate_state_mean, calculate_best5, \
+    calculate_worst5, calculate_global_mean, calculate_diff_from_mean, \
+    calculate_state_diff_from_mean, calculate_mean_by_category, \
+    calculate_state_mean_by_category, calculate_state_trend, calculate_batch, BATCH_ENDPOINTS
+from app.columnar_store import ColumnarStore
+from app.data_ingestor import BACKENDS, DataIngestor
+
+# Records are built but not written: the calculate_* functions log every call
+LOGGER = logging.getLogger("microbench")
+LOGGER.addHandler(logging.NullHandler())
+LOGGER.propagate = False
+
+
+def measure(function, min_time, rounds):
+    """
+    Times `function` over `rounds` rounds of as many calls as fit in `min_time`.
+
+    Returns:
+        dict: min, median and mean seconds per call, rounds and calls per round.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed == 0 else max(2, math.ceil(min_time / elapsed))
+
+    per_call = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        per_call.append((time.perf_counter() - start) / loops)
+    return {"min_s": min(per_call), "median_s": statistics.median(per_call),
+            "mean_s": statistics.fmean(per_call), "rounds": rounds, "loops": loops}
+
+
+def calculate_benchmarks(ingestor, source):
+    """
+    Returns (name, zero-argument callable) pairs calling every calculate_* function
+    on `source`, with the first question and state of the data.
+    """
+    questions_dict = ingestor.questions_dict
+    question = next(iter(questions_dict))
+    state = next(iter(questions_dict[question]))
+    best = (ingestor.questions_best_is_max, ingestor.questions_best_is_min)
+    items = [{"endpoint": endpoint, "question": question, "state": state}
+             for endpoint in BATCH_ENDPOINTS]
+
+    benchmarks = [
+        ("states_mean", lambda: calculate_states_mean(question, source, LOGGER)),
+        ("state_mean", lambda: calculate_state_mean(question, state, source, LOGGER)),
+        ("best5", lambda: calculate_best5(question, source, best[0], LOGGER)),
+        ("worst5", lambda: calculate_worst5(question, source, best[1], LOGGER)),
+        ("global_mean", lambda: calculate_global_mean(question, source, LOGGER)),
+        ("diff_from_mean", lambda: calculate_diff_from_mean(question, source, LOGGER)),
+        ("state_diff_from_mean",
+         lambda: calculate_state_diff_from_mean(question, state, source, LOGGER)),
+        ("mean_by_category", lambda: calculate_mean_by_category(question, source, LOGGER)),
+        ("state_mean_by_category",
+         lambda: calculate_state_mean_by_category(question, state, source, LOGGER)),
+        ("batch", lambda: calculate_batch(items, source, best, LOGGER)),
+    ]
+    if isinstance(source, ColumnarStore):
+        benchmarks.append(("state_trend",
+                           lambda: calculate_state_trend(question, state, source, LOGGER)))
+    return benchmarks
+
+
+def run_scale(scale, options, work_dir):
+    """
+    Runs every benchmark on a dataset `scale` times the size of the template CSV.
+
+    Returns:
+        list: one result dict per (benchmark, backend).
+    """
+    csv_path = os.path.join(work_dir, f"synthetic-{scale}x.csv")
+    rows = write_csv(options.csv, csv_path, scale, options.seed)
+    snapshot_dir = os.path.join(work_dir, f"snapshots-{scale}x")
+    results = []
+
+    def record(name, backend, function):
+        result = measure(function, options.min_time, options.rounds)
+        results.append({"benchmark": name, "backend": backend, "scale": scale,
+                        "rows": rows, **result})
+
+    ingestors = {}
+    for backend in options.backends:
+        arguments = (csv_path, backend, snapshot_dir if backend == "mmap" else None)
+        ingestors[backend] = DataIngestor(*arguments)
+        record("DataIngestor", backend, lambda arguments=arguments: DataIngestor(*arguments))
+
+    # The mmap backend has no nested dictionary to pick the question and state from
+    reference = ingestors.get("dict") or DataIngestor(csv_path, "dict")
+    for backend, ingestor in ingestors.items():
+        for name, function in calculate_benchmarks(reference, ingestor.data_source):
+            record(name, backend, function)
+    return results
+
+
+def print_report(results, scales):
+    """
+    Prints the median time per call of every benchmark at every scale, and its
+    scaling exponent between the smallest and the largest scale.
+    """
+    medians = {}
+    rows = {}
+    for result in results:
+        medians.setdefault((result["benchmark"], result["backend"]), {})[result["scale"]] = \
+            result["median_s"]
+        rows[result["scale"]] = result["rows"]
+
+    print(f"{'benchmark':<24}{'backend':<10}"
+          + "".join(f"{f'{scale}x ({rows[scale]} rows)':>20}" for scale in scales)
+          + f"{'exponent':>10}")
+    for (name, backend), by_scale in medians.items():
+        cells = "".join(f"{by_scale[scale] * 1e6:>17.1f} us" for scale in scales)
+        exponent = ""
+        if len(scales) > 1:
+            first, last = scales[0], scales[-1]
+            exponent = math.log(by_scale[last] / by_scale[first]) / \
+                math.log(rows[last] / rows[first])
+            exponent = f"{exponent:>10.2f}"
+        print(f"{name:<24}{backend:<10}{cells}{exponent}")
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line options.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--csv", default="nutrition_activity_obesity_usa_subset.csv",
+                        help="template CSV (schema, value pools and 1x size)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="dataset sizes, in multiples of the template rows")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--seed", type=int, default=0, help="synthetic data seed")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.02,
+                        help="minimum duration of a round (seconds)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the micro-benchmarks at every scale and prints their report.
+    """
+    options = parse_args(argv)
+    scales = sorted(set(options.scales))
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in scales:
+            results.extend(run_scale(scale, options, work_dir))
+    print_report(results, scales)
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as fout:
+            json.dump({"seed": options.seed, "results": results}, fout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
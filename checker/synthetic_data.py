@@ -0,0 +1,77 @@
+"""
+Deterministic generator of synthetic datasets in the schema of the real CSV.
+
+The rows are drawn from the questions of `app.data_ingestor`, the states, stratifications
+and years found in a template CSV (states named "State <n>" are added when the
+template has too few of them for the requested size), with values in [5, 70).
+Every (question, state, stratification, year) is used at most once, so a dataset
+of N rows ingests N values. The same template, size and seed give the same file.
+"""
+
+import csv
+import random
+
+from app.data_ingestor import QUESTIONS_BEST_IS_MAX, QUESTIONS_BEST_IS_MIN
+
+QUESTIONS = tuple(QUESTIONS_BEST_IS_MIN + QUESTIONS_BEST_IS_MAX)
+
+
+def read_template(template_csv):
+    """
+    Reads the header and the value pools of a template CSV.
+
+    Returns:
+        tuple: (header, number of data rows, states, (category, stratification) pairs,
+        years), the pools sorted so they do not depend on the order of the rows.
+    """
+    with open(template_csv, 'r', encoding='utf-8', newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        rows = list(reader)
+    header = reader.fieldnames
+    states = sorted({row['LocationDesc'] for row in rows})
+    stratifications = sorted({(row['StratificationCategory1'], row['Stratification1'])
+                              for row in rows})
+    years = sorted({row['YearStart'] for row in rows})
+    return header, len(rows), states, stratifications, years
+
+
+def generate_rows(template_csv, num_rows, seed=0):
+    """
+    Yields `num_rows` rows (dicts of the template columns) with distinct keys.
+    """
+    _, _, states, stratifications, years = read_template(template_csv)
+    per_state = len(QUESTIONS) * len(stratifications) * len(years)
+    # Add states until the key space holds the requested rows twice
+    extra_states = max(0, -(-2 * num_rows // per_state) - len(states))
+    states = states + [f"State {number}" for number in range(1, extra_states + 1)]
+
+    rng = random.Random(seed)
+    for key in rng.sample(range(per_state * len(states)), num_rows):
+        key, year_index = divmod(key, len(years))
+        key, stratification_index = divmod(key, len(stratifications))
+        state_index, question_index = divmod(key, len(QUESTIONS))
+        yield {
+            'YearStart': years[year_index],
+            'YearEnd': years[year_index],
+            'LocationDesc': states[state_index],
+            'Question': QUESTIONS[question_index],
+            'Data_Value': f"{rng.uniform(5, 70):.1f}",
+            'StratificationCategory1': stratifications[stratification_index][0],
+            'Stratification1': stratifications[stratification_index][1],
+        }
+
+
+def write_csv(template_csv, path, scale, seed=0):
+    """
+    Writes a dataset `scale` times the size of the template CSV, in its schema.
+
+    Returns:
+        int: the number of rows written.
+    """
+    header, template_rows, _, _, _ = read_template(template_csv)
+    num_rows = scale * template_rows
+    with open(path, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=header, restval='')
+        writer.writeheader()
+        writer.writerows(generate_rows(template_csv, num_rows, seed))
+    return num_rows
@@ -0,0 +1,85 @@
+"""
+Testing module for the admission control in app/admission.py and app/task_runner.py
+"""
+import time
+from unittest import mock
+from app.admission import Overloaded, RateLimiter, ThroughputMeter
+from app.job_registry import DONE
+from app.routes import webserver
+from unittests.helpers import TIMEOUT, ThreadPoolTestCase, slow_task
+
+
+class TestAdmission(ThreadPoolTestCase):
+    """
+    Testing class for the bounded task queue, the Retry-After estimates and the rate limits
+    """
+
+    def test_rate_limiter(self):
+        """
+        A client gets `burst` requests right away, then one every 1 / rate seconds
+        """
+        rate_limiter = RateLimiter(rate=10, burst=2)
+        self.assertEqual(rate_limiter.acquire("a"), 0)
+        self.assertEqual(rate_limiter.acquire("a"), 0)
+        self.assertAlmostEqual(rate_limiter.acquire("a"), 0.1, delta=0.01)
+        # Every client has its own bucket
+        self.assertEqual(rate_limiter.acquire("b"), 0)
+        time.sleep(0.1)
+        self.assertEqual(rate_limiter.acquire("a"), 0)
+
+    def test_throughput(self):
+        """
+        Retry-After estimates are derived from the measured throughput
+        """
+        throughput = ThroughputMeter()
+        self.assertIsNone(throughput.rate())
+        self.assertEqual(throughput.time_to_finish(100), 1)
+        throughput.finished_at.extend([time.monotonic() - 9.9] + [time.monotonic()] * 19)
+        self.assertAlmostEqual(throughput.rate(), 2, delta=0.1)
+        self.assertEqual(throughput.time_to_finish(10), 5)
+        self.assertEqual(throughput.time_to_finish(10 ** 6), 60)
+
+    def test_queue_high_water(self):
+        """
+        Jobs are rejected once the queue is full, until it drains below the low-water mark;
+        cached results are still served
+        """
+        thread_pool = self.new_thread_pool(TP_NUM_OF_THREADS=1, TP_QUEUE_HIGH_WATER=2,
+                                           TP_QUEUE_LOW_WATER=1)
+        thread_pool.submit((1, slow_task, 0), "fast")
+        thread_pool.job_registry.wait(1, TIMEOUT)
+        # The worker is busy with job 2, jobs 3 and 4 fill the queue
+        jobs = [self.blocking_job(job_id) for job_id in (2, 3, 4)]
+        thread_pool.submit(jobs[0][0])
+        jobs[0][1].wait(TIMEOUT)
+        for task, _, _ in jobs[1:]:
+            thread_pool.submit(task)
+        with self.assertRaises(Overloaded) as context:
+            thread_pool.submit((5, slow_task, 0))
+        self.assertEqual(context.exception.reason, "queue full")
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        self.assertIsNone(thread_pool.job_registry.get(5))
+
+        thread_pool.submit((6, slow_task, 0.01), "fast")
+        self.assertEqual(thread_pool.job_registry.get(6).state, DONE)
+
+        # Job 3 started: one task queued is still above the low-water mark
+        jobs[0][2].set()
+        jobs[1][1].wait(TIMEOUT)
+        with self.assertRaises(Overloaded):
+            thread_pool.submit((7, slow_task, 0))
+
+    def test_rate_limited_request(self):
+        """
+        Requests over the rate limit are answered with a 429 and a Retry-After header
+        """
+        client = webserver.test_client()
+        with mock.patch.object(webserver, "rate_limiter", RateLimiter(rate=0.5, burst=1)):
+            response = client.post("/api/states_mean", json={"question": "Atlantis"})
+            self.assertEqual(response.status_code, 200)
+            response = client.post("/api/states_mean", json={"question": "Atlantis"})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers["Retry-After"], "2")
+            self.assertEqual(response.get_json(), {"job_id": -1, "reason": "rate limited"})
+            # Only the requests submitting jobs are limited
+            self.assertEqual(client.get("/api/num_jobs").status_code, 200)
@@ -0,0 +1,104 @@
+"""
+Testing module for the ASGI front end in app/asgi.py
+"""
+import asyncio
+import json
+import threading
+import time
+import unittest
+from app.asgi import application
+from app.routes import webserver
+
+
+async def request(method, path, query_string=b"", payload=None):
+    """
+    Sends a request to the ASGI application and returns (status, headers, body)
+    """
+    body = json.dumps(payload).encode() if payload is not None else b""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string,
+             "headers": [(b"content-type", b"application/json"),
+                         (b"content-length", str(len(body)).encode())],
+             "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 5000)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], dict(messages[0]["headers"]), body
+
+
+class TestAsgi(unittest.TestCase):
+    """
+    Testing class for the routes served through the ASGI application
+    """
+
+    def test_routes(self):
+        """
+        Jobs are submitted and their results read just like through Flask
+        """
+        question, state = next((question, state) for question, states
+                               in webserver.data_ingestor.questions_dict.items()
+                               for state in states)
+
+        async def scenario():
+            status, _, body = await request("POST", "/api/state_mean",
+                                            payload={"question": question, "state": state})
+            self.assertEqual(status, 200)
+            job_id = json.loads(body)["job_id"]
+            status, headers, body = await request("GET", f"/api/get_results/{job_id}",
+                                                  b"wait=5")
+            self.assertEqual(status, 200)
+            self.assertEqual(headers[b"content-type"], b"application/json")
+            self.assertEqual(json.loads(body)["status"], "done")
+            _, _, body = await request("GET", f"/api/get_results/{job_id}", b"stream=ndjson")
+            self.assertEqual(len(body.splitlines()), 1)
+
+        asyncio.run(scenario())
+
+    def test_idle_pollers(self):
+        """
+        Long polls wait on the event loop, without holding a thread each
+        """
+        job_registry = webserver.tasks_runner.job_registry
+        job_id = webserver.tasks_runner.new_job_id()
+        job_registry.add(job_id)
+
+        async def scenario():
+            pollers = [asyncio.create_task(request("GET", f"/api/get_results/{job_id}",
+                                                   b"wait=5")) for _ in range(200)]
+            await asyncio.sleep(0.2)
+            self.assertLess(threading.active_count(), 100)
+            start = time.monotonic()
+            job_registry.mark_running(job_id)
+            webserver.tasks_runner.job_failed(job_id, "KeyError: 'Atlantis'")
+            answers = await asyncio.gather(*pollers)
+            self.assertLess(time.monotonic() - start, 2)
+            return answers
+
+        for status, _, body in asyncio.run(scenario()):
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)["reason"], "KeyError: 'Atlantis'")
+
+    def test_timed_out_pollers(self):
+        """
+        Long polls that time out unregister from the job they waited for
+        """
+        job_registry = webserver.tasks_runner.job_registry
+        job_id = webserver.tasks_runner.new_job_id()
+        job_registry.add(job_id)
+
+        async def scenario():
+            return await asyncio.gather(*(request("GET", f"/api/get_results/{job_id}",
+                                                  b"wait=0.05") for _ in range(3)))
+
+        for status, _, body in asyncio.run(scenario()):
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)["status"], "running")
+        self.assertNotIn(job_id, job_registry.completion_callbacks)
+        job_registry.mark_running(job_id)
+        webserver.tasks_runner.job_done(job_id, {})
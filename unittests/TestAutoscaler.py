@@ -0,0 +1,75 @@
+"""
+Testing module for the adaptive pool sizing in app/autoscaler.py
+"""
+from app.autoscaler import LoadTracker, scaling_decision
+from app.routes import webserver
+from unittests.helpers import TIMEOUT, ThreadPoolTestCase
+
+
+class TestAutoscaler(ThreadPoolTestCase):
+    """
+    Testing class for the scaling decisions and the resizing of the ThreadPool
+    """
+
+    def test_scaling_decision(self):
+        """
+        The pool grows on queueing, shrinks when idle and stays within its bounds
+        """
+        # 6 tasks queued: up to twice the workers
+        self.assertEqual(scaling_decision(2, (1, 8), (6, 0.0, 1.0), 0.1)[0], 4)
+        self.assertEqual(scaling_decision(6, (1, 8), (6, 0.0, 1.0), 0.1)[0], 8)
+        # A single task queued, but it waited too long
+        self.assertEqual(scaling_decision(4, (1, 8), (1, 0.5, 1.0), 0.1)[0], 5)
+        self.assertEqual(scaling_decision(4, (1, 8), (1, 0.01, 1.0), 0.1), (4, None))
+        # Idle workers are stopped one at a time, down to the minimum
+        self.assertEqual(scaling_decision(4, (1, 8), (0, 0.0, 0.1), 0.1)[0], 3)
+        self.assertEqual(scaling_decision(1, (1, 8), (0, 0.0, 0.0), 0.1), (1, None))
+        self.assertEqual(scaling_decision(8, (1, 8), (9, 1.0, 1.0), 0.1), (8, None))
+
+    def test_load_tracker(self):
+        """
+        The load is reset every time it is read
+        """
+        load = LoadTracker()
+        load.record(0.1, 1.0)
+        load.record(0.3, 0.5)
+        mean_queue_wait, busy = load.take()
+        self.assertAlmostEqual(mean_queue_wait, 0.2)
+        self.assertAlmostEqual(busy, 1.5)
+        self.assertEqual(load.take(), (0.0, 0.0))
+
+    def test_resize(self):
+        """
+        The pool grows under load and shrinks back to its minimum once idle
+        """
+        thread_pool = self.new_thread_pool(TP_NUM_OF_THREADS=4, TP_MIN_THREADS=1,
+                                           TP_SCALE_INTERVAL=3600)
+        self.assertEqual(thread_pool.num_workers, 1)
+        jobs = [self.blocking_job(job_id) for job_id in range(1, 6)]
+        for task, _, _ in jobs:
+            thread_pool.submit(task)
+        # Jobs are held until the pool reached its maximum: the queue never empties before
+        thread_pool.autoscaler.step(0.1)
+        self.assertEqual(thread_pool.num_workers, 2)
+        thread_pool.autoscaler.step(0.1)
+        self.assertEqual(thread_pool.num_workers, 4)
+        for task, _, release in jobs:
+            release.set()
+            thread_pool.job_registry.wait(task[0], TIMEOUT)
+        for _ in range(3):
+            thread_pool.autoscaler.step(10)
+        self.assertEqual(thread_pool.num_workers, 1)
+        # The stopped workers take their STOP and leave the pool
+        self.wait_until(lambda: len(thread_pool.task_runners) == 1)
+        self.assertEqual([decision["to"] for decision in thread_pool.autoscaler.decisions],
+                         [2, 4, 3, 2, 1])
+        thread_pool.shutdown()
+        self.assertFalse(any(task_runner.is_alive() for task_runner in thread_pool.task_runners))
+
+    def test_pool_request(self):
+        """
+        The job API reports the size of the pool
+        """
+        data = webserver.test_client().get("/api/pool").get_json()["data"]
+        self.assertEqual(data["workers"], webserver.tasks_runner.num_workers)
+        self.assertLessEqual(data["min_workers"], data["max_workers"])
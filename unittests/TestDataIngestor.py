@@ -0,0 +1,136 @@
+"""
+Testing module for the CSV ingestion in app/data_ingestor.py
+"""
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from app.data_ingestor import DataIngestor, read_rows
+
+CSV_CONTENT = """YearStart,LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1,Total
+2011,Utah,Q1,30.5,Gender,Male,
+2011,Utah,Q1,31.5,Gender,Male,
+2012,Utah,Q1,,Gender,Male,
+2013,Utah,Q1,29,Gender,Female,
+"""
+
+
+class TestDataIngestor(unittest.TestCase):
+    """
+    Testing class for read_rows and DataIngestor
+    """
+
+    def setUp(self):
+        """
+        Writes a small CSV file with an empty value and a repeated year
+        """
+        file_descriptor, self.csv_path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as csv_file:
+            csv_file.write(CSV_CONTENT)
+
+    def tearDown(self):
+        """
+        Removes the CSV file
+        """
+        os.remove(self.csv_path)
+
+    def test_read_rows(self):
+        """
+        Rows without a value are skipped and values are parsed to floats
+        """
+        stats = {}
+        rows = list(read_rows(self.csv_path, stats))
+        self.assertEqual(rows[0], ("Q1", "Utah", "Gender", "Male", "2011", 30.5, "2011"))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(stats, {"rows": 3, "skipped": 1})
+
+    def test_questions_dict(self):
+        """
+        Only the first value of each year is kept
+        """
+        data_ingestor = DataIngestor(self.csv_path)
+        self.assertEqual(data_ingestor.questions_dict,
+                         {"Q1": {"Utah": {"Gender": {"Male": {"2011": 30.5},
+                                                     "Female": {"2013": 29.0}}}}})
+        self.assertEqual(data_ingestor.ingest_stats["rows"], 3)
+        self.assertEqual(data_ingestor.ingest_stats["duplicates"], 1)
+        step_seconds = data_ingestor.ingest_stats["step_seconds"]
+        self.assertEqual(list(step_seconds), ["read_csv", "aggregate_index"])
+        self.assertGreaterEqual(data_ingestor.ingest_stats["seconds"], sum(step_seconds.values()))
+
+    def test_snapshot(self):
+        """
+        The second ingestor loads the snapshot written by the first one and gets the same data
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            first = DataIngestor(self.csv_path, "columnar", snapshot_dir)
+            second = DataIngestor(self.csv_path, "columnar", snapshot_dir)
+            self.assertEqual(first.ingest_stats["snapshot"], "written")
+            self.assertEqual(second.ingest_stats["snapshot"], "loaded")
+            self.assertEqual(second.ingest_stats["skipped"], 1)
+            self.assertEqual(list(second.questions_dict["Q1"]["Utah"]["Gender"]),
+                             ["Male", "Female"])
+            self.assertEqual(second.questions_dict, first.questions_dict)
+            self.assertEqual(second.data_source.state_means("Q1"),
+                             first.data_source.state_means("Q1"))
+
+            # Changing the CSV file invalidates the snapshot
+            with open(self.csv_path, 'a', encoding='utf-8') as csv_file:
+                csv_file.write("2014,Ohio,Q1,10,Gender,Male,\n")
+            third = DataIngestor(self.csv_path, "index", snapshot_dir)
+            self.assertEqual(third.ingest_stats["snapshot"], "written")
+            self.assertIn("Ohio", third.questions_dict["Q1"])
+            self.assertEqual(len(os.listdir(snapshot_dir)), 1)
+
+    def test_mmap_backend(self):
+        """
+        The "mmap" backend computes on the memory-mapped snapshot, without a questions_dict
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            for expected_snapshot in ("written", "loaded"):
+                data_ingestor = DataIngestor(self.csv_path, "mmap", snapshot_dir)
+                self.assertEqual(data_ingestor.ingest_stats["snapshot"], expected_snapshot)
+                self.assertIsNone(data_ingestor.questions_dict)
+                self.assertIsInstance(data_ingestor.data_source.values, np.memmap)
+                for year_index_array in data_ingestor.data_source.year_index:
+                    self.assertIsInstance(year_index_array, np.memmap)
+                self.assertEqual(data_ingestor.data_source.state_means("Q1"),
+                                 DataIngestor(self.csv_path).data_source.state_means("Q1"))
+
+    def test_lazy_columnar_store(self):
+        """
+        The "index" backend builds its ColumnarStore once, on first use
+        """
+        data_ingestor = DataIngestor(self.csv_path)
+        self.assertIsNone(data_ingestor._columnar_store)  # pylint: disable=protected-access
+        stores = []
+        readers = [threading.Thread(target=lambda: stores.append(data_ingestor.columnar_store))
+                   for _ in range(8)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(len({id(store) for store in stores}), 1)
+        self.assertEqual(stores[0].state_means("Q1", years=(2011, 2011)), {"Utah": 30.5})
+
+    def test_duplicates(self):
+        """
+        Rows repeating a year are kept but never aggregated: a years range covering
+        every year answers like no range, also once loaded from a snapshot
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            for data_ingestor in (DataIngestor(self.csv_path, "columnar", snapshot_dir),
+                                  DataIngestor(self.csv_path, "mmap", snapshot_dir)):
+                store = data_ingestor.columnar_store
+                self.assertEqual(store.duplicates.tolist(), [False, False, True])
+                self.assertEqual(store.state_means("Q1"), {"Utah": 29.75})
+                self.assertEqual(store.state_means("Q1", years=(2011, 2011)), {"Utah": 30.5})
+                for years in ((None, None), (0, 9999)):
+                    self.assertEqual(store.state_means("Q1", years=years),
+                                     store.state_means("Q1"))
+                    self.assertEqual(store.global_mean("Q1", years=years),
+                                     store.global_mean("Q1"))
+                    self.assertEqual(store.category_means("Q1", years=years),
+                                     store.category_means("Q1"))
+                self.assertEqual(len(list(store.iter_rows())), 2)
@@ -0,0 +1,146 @@
+"""
+Testing module for the AggregateIndex and ColumnarStore backends of the 'calculate' methods
+"""
+import json
+import unittest
+import numpy as np
+from app.aggregate_index import AggregateIndex
+from app.columnar_store import ColumnarStore
+from app.calculations import calculate_states_mean, \
+    calculate_state_mean, \
+    calculate_global_mean, \
+    calculate_diff_from_mean, \
+    calculate_state_diff_from_mean, \
+    calculate_mean_by_category, \
+    calculate_state_mean_by_category, \
+    calculate_state_trend
+from app.routes import webserver
+
+
+class TestDataSources(unittest.TestCase):
+    """
+    Checks that AggregateIndex and ColumnarStore give exactly the same answers
+    as the nested dictionary
+    """
+
+    def setUp(self):
+        """
+        Reads small_dict.json and builds an AggregateIndex and a ColumnarStore out of it
+        """
+        with open("unittests/small_dict.json", "r", encoding='utf-8') as file:
+            self.questions_dict = json.load(file)
+        self.sources = [AggregateIndex.from_questions_dict(self.questions_dict),
+                        ColumnarStore.from_questions_dict(self.questions_dict)]
+        self.my_logger = webserver.my_logger
+
+    def test_question_functions(self):
+        """
+        Compares the functions that take only a question
+        """
+        for question in self.questions_dict:
+            for function in (calculate_states_mean, calculate_global_mean,
+                             calculate_diff_from_mean, calculate_mean_by_category):
+                expected = function(question, self.questions_dict, self.my_logger)
+                for source in self.sources:
+                    result = function(question, source, self.my_logger)
+                    self.assertEqual(list(result.items()), list(expected.items()))
+
+    def test_state_functions(self):
+        """
+        Compares the functions that take a question and a state
+        """
+        for question, states_dict in self.questions_dict.items():
+            for state in states_dict:
+                for function in (calculate_state_mean, calculate_state_diff_from_mean,
+                                 calculate_state_mean_by_category):
+                    expected = function(question, state, self.questions_dict, self.my_logger)
+                    for source in self.sources:
+                        result = function(question, state, source, self.my_logger)
+                        self.assertEqual(result, expected)
+
+    def test_unknown_state(self):
+        """
+        An unknown state raises KeyError, like the nested dictionary does
+        """
+        question = next(iter(self.questions_dict))
+        for source in self.sources:
+            with self.assertRaises(KeyError):
+                source.state_means(question, "Atlantis")
+
+    def test_year_range(self):
+        """
+        Filtering by years gives the answers of the nested dictionary restricted to those years,
+        and the whole range gives the unfiltered answers
+        """
+        store = self.sources[1]
+        for years, first_year, last_year in (((None, None), 0, 9999), ((2013, 2015), 2013, 2015),
+                                             ((2020, None), 2020, 9999)):
+            questions_dict = {
+                question: {state: {category: {stratification: {
+                    year: value for year, value in data_values_dict.items()
+                    if first_year <= int(year) <= last_year}
+                    for stratification, data_values_dict in stratifications_dict.items()}
+                    for category, stratifications_dict in categories_dict.items()}
+                    for state, categories_dict in states_dict.items()}
+                for question, states_dict in self.questions_dict.items()}
+            for question in self.questions_dict:
+                for function in (calculate_states_mean, calculate_global_mean,
+                                 calculate_mean_by_category):
+                    expected = function(question, questions_dict, self.my_logger)
+                    result = function(question, store, self.my_logger, years)
+                    self.assertEqual(list(result.items()), list(expected.items()))
+
+    def test_year_end(self):
+        """
+        Rows whose end year is after year_to are left out
+        """
+        store = ColumnarStore.from_rows([("Q", "Utah", "Gender", "Male", "2011", 1.0, "2012"),
+                                         ("Q", "Utah", "Gender", "Male", "2012", 3.0)])
+        self.assertEqual(store.state_means("Q", years=(None, 2012)), {"Utah": 2.0})
+        self.assertEqual(store.state_means("Q", years=(None, 2011)), {})
+        self.assertEqual(store.state_means("Q", "Utah", (2013, None)), {})
+        with self.assertRaises(KeyError):
+            store.state_means("Q", "Ohio", (2011, 2012))
+
+    def test_empty_range(self):
+        """
+        A years range without rows gives empty answers, neither an error nor a mean of 0
+        """
+        store = self.sources[1]
+        question = next(iter(self.questions_dict))
+        state = next(iter(self.questions_dict[question]))
+        self.assertEqual(calculate_global_mean(question, store, self.my_logger, (2030, None)), {})
+        self.assertEqual(calculate_diff_from_mean(question, store, self.my_logger,
+                                                  (2030, None)), {})
+        self.assertEqual(calculate_state_diff_from_mean(question, state, store, self.my_logger,
+                                                        (2030, None)), {})
+
+    def test_state_trend(self):
+        """
+        The trend of a state matches the per-year means of the nested dictionary
+        and the slope of a least-squares fit
+        """
+        store = self.sources[1]
+        for question, states_dict in self.questions_dict.items():
+            trends = calculate_state_trend(question, None, store, self.my_logger)
+            self.assertEqual(list(trends), list(states_dict))
+            for state, stratification_categories_dict in states_dict.items():
+                year_values = {}
+                for stratifications_dict in stratification_categories_dict.values():
+                    for data_values_dict in stratifications_dict.values():
+                        for year, value in data_values_dict.items():
+                            year_values.setdefault(year, []).append(float(value))
+                means = {year: np.mean(values) for year, values in sorted(year_values.items())}
+
+                trend = trends[state]
+                self.assertEqual(list(trend["means"]), list(means))
+                for year, mean in means.items():
+                    self.assertAlmostEqual(trend["means"][year], mean)
+                self.assertEqual(list(trend["deltas"]), list(means)[1:])
+                if len(means) > 1:
+                    slope = np.polyfit([int(year) for year in means], list(means.values()), 1)[0]
+                    self.assertAlmostEqual(trend["slope"], slope)
+                else:
+                    self.assertIsNone(trend["slope"])
+                self.assertEqual(calculate_state_trend(question, state, store, self.my_logger),
+                                 {state: trend})
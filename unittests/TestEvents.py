@@ -0,0 +1,133 @@
+"""
+Testing module for the job completion events in app/events.py and /api/events
+"""
+import asyncio
+import json
+import unittest
+from app.asgi import application
+from app.events import JobEvents, sse_message
+from app.job_registry import JobRegistry
+from app.routes import webserver
+
+
+def parse_events(body):
+    """
+    Returns the data of the events in a text/event-stream body
+    """
+    return [json.loads(line[len("data: "):]) for line in body.splitlines()
+            if line.startswith("data: ")]
+
+
+def new_job():
+    """
+    Registers a job as if it had been submitted, returns its id
+    """
+    job_id = webserver.tasks_runner.new_job_id()
+    webserver.tasks_runner.job_registry.add(job_id)
+    return job_id
+
+
+def finish_job(job_id, error=None):
+    """
+    Finishes a job, failing it if `error` is given
+    """
+    webserver.tasks_runner.job_registry.mark_running(job_id)
+    if error is None:
+        webserver.tasks_runner.job_done(job_id, {"Atlantis": 42})
+    else:
+        webserver.tasks_runner.job_failed(job_id, error)
+
+
+class TestEvents(unittest.TestCase):
+    """
+    Testing class for the job completion events
+    """
+
+    def test_publish(self):
+        """
+        Finished jobs are pushed to the subscriptions that follow them
+        """
+        job_registry = JobRegistry()
+        job_events = JobEvents()
+        job_registry.listeners.append(job_events.publish)
+        every_job = job_events.subscribe()
+        job_2 = job_events.subscribe({2})
+        for job_id in (1, 2):
+            job_registry.add(job_id)
+            job_registry.mark_running(job_id)
+        job_registry.mark_done(1)
+        job_registry.mark_failed(2, "KeyError: 'Atlantis'")
+
+        self.assertEqual(every_job.pop_all(), [
+            {"job_id": 1, "status": "done"},
+            {"job_id": 2, "status": "error", "reason": "KeyError: 'Atlantis'"}])
+        self.assertEqual(job_2.pop_all(), [
+            {"job_id": 2, "status": "error", "reason": "KeyError: 'Atlantis'"}])
+        job_events.unsubscribe(every_job)
+        self.assertEqual(job_events.subscriptions, {job_2})
+        self.assertEqual(sse_message({"job_id": 1}, event_id=1),
+                         'id: 1\nevent: job\ndata: {"job_id": 1}\n\n')
+
+    def test_finished_jobs(self):
+        """
+        A stream of given jobs reports those already finished, and ends with the last one
+        """
+        job_id, failed_id = new_job(), new_job()
+        finish_job(job_id)
+        finish_job(failed_id, "KeyError: 'Atlantis'")
+        client = webserver.test_client()
+
+        response = client.get(f"/api/events?job_id={job_id},{failed_id}&job_id=0&result=1")
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(parse_events(response.get_data(as_text=True)), [
+            {"job_id": 0, "status": "error", "reason": "Invalid job_id"},
+            {"job_id": job_id, "status": "done", "data": {"Atlantis": 42}},
+            {"job_id": failed_id, "status": "error", "reason": "KeyError: 'Atlantis'"}])
+        self.assertEqual(client.get("/api/events?job_id=Atlantis").status_code, 400)
+
+    def test_asgi_stream(self):
+        """
+        The ASGI front end pushes the jobs as they finish, until the last one or a disconnect
+        """
+        job_ids = [new_job(), new_job()]
+
+        async def open_stream(query_string, messages):
+            disconnect = asyncio.get_running_loop().create_future()
+            scope = {"type": "http", "method": "GET", "path": "/api/events",
+                     "query_string": query_string, "headers": [],
+                     "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 5000)}
+            received = []
+
+            async def receive():
+                if received:
+                    return await disconnect
+                received.append(True)
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+
+            return asyncio.create_task(application(scope, receive, send)), disconnect
+
+        async def scenario():
+            messages, dashboard_messages = [], []
+            stream, _ = await open_stream(f"job_id={job_ids[0]},{job_ids[1]}".encode(),
+                                          messages)
+            dashboard, disconnect = await open_stream(b"", dashboard_messages)
+            await asyncio.sleep(0.1)
+            for job_id in job_ids:
+                finish_job(job_id)
+            await asyncio.wait_for(stream, 2)
+            await asyncio.sleep(0.1)
+            disconnect.set_result({"type": "http.disconnect"})
+            await asyncio.wait_for(dashboard, 2)
+            return messages, dashboard_messages
+
+        messages, dashboard_messages = asyncio.run(scenario())
+        self.assertEqual(dict(messages[0]["headers"])[b"content-type"],
+                         b"text/event-stream; charset=utf-8")
+        for stream_messages in (messages, dashboard_messages):
+            body = b"".join(message.get("body", b"") for message in stream_messages[1:])
+            self.assertEqual(parse_events(body.decode()),
+                             [{"job_id": job_id, "status": "done"} for job_id in job_ids])
+        self.assertEqual(webserver.tasks_runner.events.subscriptions, set())
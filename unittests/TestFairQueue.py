@@ -0,0 +1,90 @@
+"""
+Testing module for the FairQueue in app/fair_queue.py
+"""
+from unittest import mock
+from app.fair_queue import FairQueue, STOP, parse_weights
+from app.job_registry import DONE
+from unittests.helpers import ThreadPoolTestCase
+
+
+def calculate_cheap(value):
+    """
+    Task of the "cheap" endpoint
+    """
+    return value
+
+
+def calculate_heavy(value):
+    """
+    Task of the "heavy" endpoint
+    """
+    return value
+
+
+class TestFairQueue(ThreadPoolTestCase):
+    """
+    Testing class for the per-endpoint lanes, their weights and the STOP pills
+    """
+
+    def test_fair_share(self):
+        """
+        A burst of heavy tasks does not hold back the cheap ones queued after it
+        """
+        task_queue = FairQueue()
+        task_queue.record_cost("heavy", 0.01)
+        task_queue.record_cost("cheap", 0.0001)
+        for job_id in range(1, 11):
+            task_queue.put((job_id, calculate_heavy, job_id))
+        for job_id in range(11, 16):
+            task_queue.put((job_id, calculate_cheap, job_id))
+        self.assertEqual(task_queue.qsize(), 15)
+        order = [task_queue.get()[0] for _ in range(15)]
+        self.assertEqual(order[:7], [1, 11, 12, 13, 14, 15, 2])
+        self.assertEqual(order[7:], list(range(3, 11)))
+
+    def test_weights(self):
+        """
+        Lanes of the same cost are served in proportion to their weights
+        """
+        task_queue = FairQueue({"cheap": 3})
+        for job_id in range(1, 9):
+            task_queue.put((job_id, calculate_heavy, job_id))
+            task_queue.put((100 + job_id, calculate_cheap, job_id))
+        order = [task_queue.get()[1] for _ in range(8)]
+        self.assertEqual(order.count(calculate_cheap), 6)
+
+    def test_stops_last(self):
+        """
+        STOPs are only handed out once no task is left, drain keeps them
+        """
+        task_queue = FairQueue()
+        task_queue.put(STOP)
+        task_queue.put((1, calculate_cheap, 1))
+        task_queue.put((2, calculate_heavy, 2))
+        self.assertEqual(task_queue.get()[0], 1)
+        self.assertEqual(task_queue.drain(), [(2, calculate_heavy, 2)])
+        self.assertIs(task_queue.get(), STOP)
+        self.assertEqual(task_queue.qsize(), 0)
+
+    def test_parse_weights(self):
+        """
+        Weights are read from "endpoint=weight" pairs and must be positive
+        """
+        self.assertEqual(parse_weights("state_mean=4, batch=0.5"),
+                         {"state_mean": 4.0, "batch": 0.5})
+        self.assertEqual(parse_weights(None), {})
+        with self.assertRaises(ValueError):
+            parse_weights("batch=0")
+
+    def test_fast_lane(self):
+        """
+        Lookups run without being queued, every other job is queued however cheap it was
+        """
+        thread_pool = self.new_thread_pool(TP_NUM_OF_THREADS=1)
+        with mock.patch.object(thread_pool.task_queue, "put") as put:
+            thread_pool.submit((2, calculate_cheap, 2), lookup=True)
+            put.assert_not_called()
+            thread_pool.submit((3, calculate_cheap, 3))
+            put.assert_called_once()
+        self.assertEqual(thread_pool.job_registry.get(2).state, DONE)
+        self.assertEqual(thread_pool.result_store.get(2), 2)
@@ -0,0 +1,45 @@
+"""
+Testing module for the JobCache in app/job_cache.py
+"""
+import unittest
+from app.job_cache import JobCache, HIT, JOINED, LEADER
+
+
+class TestJobCache(unittest.TestCase):
+    """
+    Testing class for request coalescing and result memoization
+    """
+
+    def test_coalescing(self):
+        """
+        Identical jobs join the one in flight and are served from the cache afterwards
+        """
+        cache = JobCache()
+        self.assertEqual(cache.claim(("best5", 1, "q"), 1), (LEADER, None))
+        self.assertEqual(cache.claim(("best5", 1, "q"), 2), (JOINED, None))
+        self.assertEqual(cache.claim(("best5", 1, "q"), 3), (JOINED, None))
+        self.assertEqual(cache.complete(1, {"a": 1}), [2, 3])
+        self.assertEqual(cache.claim(("best5", 1, "q"), 4), (HIT, {"a": 1}))
+        # Another version of the data is a different key
+        self.assertEqual(cache.claim(("best5", 2, "q"), 5), (LEADER, None))
+
+    def test_failure_is_not_cached(self):
+        """
+        The jobs that joined a failed leader fail with it and nothing is cached
+        """
+        cache = JobCache()
+        cache.claim(("state_mean", 1, "q", "s"), 1)
+        cache.claim(("state_mean", 1, "q", "s"), 2)
+        self.assertEqual(cache.fail(1), [2])
+        self.assertEqual(cache.claim(("state_mean", 1, "q", "s"), 3), (LEADER, None))
+
+    def test_bounded(self):
+        """
+        The least recently used result is evicted once the cache is full
+        """
+        cache = JobCache(max_entries=1)
+        for job_id, key in enumerate(["a", "b"]):
+            cache.claim(key, job_id)
+            cache.complete(job_id, {key: job_id})
+        self.assertEqual(cache.claim("a", 2), (LEADER, None))
+        self.assertEqual(cache.claim("b", 3), (HIT, {"b": 1}))
@@ -0,0 +1,74 @@
+"""
+Testing module for the JobRegistry in app/job_registry.py
+"""
+import threading
+import time
+import unittest
+from app.job_registry import JobRegistry, QUEUED, RUNNING, DONE, FAILED
+
+
+class TestJobRegistry(unittest.TestCase):
+    """
+    Testing class for the job states, counters and pagination
+    """
+
+    def setUp(self):
+        """
+        Registers five jobs and moves them through different states
+        """
+        self.registry = JobRegistry()
+        for job_id in range(1, 6):
+            self.registry.add(job_id)
+        self.registry.mark_running(1)
+        self.registry.mark_done(1)
+        self.registry.mark_running(2)
+        self.registry.mark_failed(2, "KeyError: 'Atlantis'")
+        self.registry.mark_running(3)
+
+    def test_states(self):
+        """
+        Every job reports its current state, sorted by job_id
+        """
+        self.assertEqual(self.registry.states(),
+                         [(1, DONE), (2, FAILED), (3, RUNNING), (4, QUEUED), (5, QUEUED)])
+        self.assertEqual(self.registry.get(2).error, "KeyError: 'Atlantis'")
+        self.assertIsNone(self.registry.get(6))
+
+    def test_num_pending(self):
+        """
+        Queued and running jobs are counted as pending
+        """
+        self.assertEqual(self.registry.num_pending(), 3)
+
+    def test_pagination(self):
+        """
+        A page only contains the jobs with ids in [start, start + limit)
+        """
+        self.assertEqual(self.registry.states(start=4, limit=3), [(4, QUEUED), (5, QUEUED)])
+        self.assertEqual(self.registry.states(limit=2), [(1, DONE), (2, FAILED)])
+
+    def test_wait(self):
+        """
+        Waiting on a running job returns as soon as it finishes
+        """
+        threading.Timer(0.05, self.registry.mark_done, args=(3,)).start()
+        start = time.monotonic()
+        self.registry.wait(3, 5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.registry.get(3).state, DONE)
+        # Finished and unknown jobs do not block
+        self.registry.wait(1, 5)
+        self.registry.wait(42, 5)
+
+    def test_bounded(self):
+        """
+        Beyond max_jobs, the jobs that finished first are forgotten, pending ones are kept
+        """
+        registry = JobRegistry(max_jobs=3)
+        for job_id in range(1, 6):
+            registry.add(job_id)
+        for job_id in (4, 1, 2):
+            registry.mark_running(job_id)
+            registry.mark_done(job_id)
+        self.assertEqual(registry.states(), [(2, DONE), (3, QUEUED), (5, QUEUED)])
+        self.assertEqual(registry.counts()[DONE], 3)
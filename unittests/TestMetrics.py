@@ -0,0 +1,51 @@
+"""
+Testing module for the metrics in app/metrics.py
+"""
+import unittest
+from app.metrics import Counter, Histogram, gauge, job_endpoint
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Testing class for the Prometheus text format of the metrics
+    """
+
+    def test_counter(self):
+        """
+        Every combination of label values is counted separately
+        """
+        jobs = Counter("jobs_total", "Jobs", ("endpoint",))
+        jobs.inc("best5")
+        jobs.inc("best5", amount=2)
+        jobs.inc("say \"hi\"")
+        self.assertEqual(jobs.render(), ['# HELP jobs_total Jobs', '# TYPE jobs_total counter',
+                                         'jobs_total{endpoint="best5"} 3',
+                                         'jobs_total{endpoint="say \\"hi\\""} 1'])
+
+    def test_histogram(self):
+        """
+        Buckets are cumulative and end with +Inf
+        """
+        times = Histogram("time_seconds", "Time", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            times.observe(value)
+        self.assertEqual(times.render()[2:], ['time_seconds_bucket{le="0.1"} 2',
+                                              'time_seconds_bucket{le="1"} 3',
+                                              'time_seconds_bucket{le="+Inf"} 4',
+                                              'time_seconds_sum 3.65',
+                                              'time_seconds_count 4'])
+
+    def test_gauge(self):
+        """
+        Gauges are formatted from (labels, value) pairs
+        """
+        self.assertEqual(gauge("depth", "Depth", [([], 2), ([("state", "done")], 1.5)])[2:],
+                         ['depth 2', 'depth{state="done"} 1.5'])
+
+    def test_job_endpoint(self):
+        """
+        Endpoints are named after the calculate functions
+        """
+        def calculate_states_mean():
+            pass
+        self.assertEqual(job_endpoint((1, calculate_states_mean)), "states_mean")
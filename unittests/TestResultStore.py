@@ -0,0 +1,86 @@
+"""
+Testing module for the result stores in app/result_store.py
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from app.result_store import DiskResultStore, MemoryResultStore
+
+
+class BlockingStore(DiskResultStore):
+    """
+    DiskResultStore whose writes wait for `release`, signalling `writing` first
+    """
+
+    def __init__(self, results_dir):
+        super().__init__(results_dir)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def put(self, job_id, result):
+        self.writing.set()
+        self.release.wait(5)
+        super().put(job_id, result)
+
+
+class TestResultStore(unittest.TestCase):
+    """
+    Testing class for MemoryResultStore and DiskResultStore
+    """
+
+    def test_lru_eviction(self):
+        """
+        The least recently used result is evicted first
+        """
+        store = MemoryResultStore(max_entries=2)
+        store.put(1, {"a": 1})
+        store.put(2, {"b": 2})
+        store.get(1)
+        store.put(3, {"c": 3})
+        self.assertEqual(store.get(1), {"a": 1})
+        self.assertIsNone(store.get(2))
+        self.assertEqual(sorted(store.entries), [1, 3])
+
+    def test_ttl_eviction(self):
+        """
+        Results not accessed for 'ttl' seconds are evicted
+        """
+        store = MemoryResultStore(ttl=0.05)
+        store.put(1, {"a": 1})
+        time.sleep(0.1)
+        self.assertIsNone(store.get(1))
+        self.assertEqual(store.stats()["entries"], 0)
+
+    def test_spill_to_disk(self):
+        """
+        Evicted results are moved to the spill store and can still be read
+        """
+        with tempfile.TemporaryDirectory() as results_dir:
+            store = MemoryResultStore(max_entries=1, spill_store=DiskResultStore(results_dir))
+            store.put(1, {"a": 1})
+            store.put(2, {"b": 2})
+            self.assertEqual(os.listdir(results_dir), ["1.pkl"])
+            self.assertEqual(store.get(1), {"a": 1})
+            self.assertEqual(store.get(2), {"b": 2})
+            self.assertIsNone(store.get(3))
+            self.assertEqual(store.stats(), {"hit": 1, "spill_hit": 1, "miss": 1,
+                                             "evictions": 1, "entries": 1})
+
+    def test_pending_spill(self):
+        """
+        A result being written to the spill store can still be read
+        """
+        with tempfile.TemporaryDirectory() as results_dir:
+            spill_store = BlockingStore(results_dir)
+            store = MemoryResultStore(max_entries=1, spill_store=spill_store)
+            store.put(1, {"a": 1})
+            writer = threading.Thread(target=store.put, args=(2, {"b": 2}))
+            writer.start()
+            self.assertTrue(spill_store.writing.wait(5))
+            self.assertEqual(store.get(1), {"a": 1})
+            spill_store.release.set()
+            writer.join()
+            self.assertEqual(store.spilling, {})
+            self.assertEqual(store.get(1), {"a": 1})
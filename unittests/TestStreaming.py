@@ -0,0 +1,59 @@
+"""
+Testing module for the streamed results in app/streaming.py
+"""
+import json
+import unittest
+from flask import jsonify
+from app.routes import webserver
+from app.streaming import CHUNK_ENTRIES, iter_json, iter_ndjson
+
+
+class TestStreaming(unittest.TestCase):
+    """
+    Testing class for iter_json and iter_ndjson
+    """
+
+    def setUp(self):
+        """
+        Results of several shapes, one of them larger than a chunk
+        """
+        self.results = [
+            {"('Ohio', 'Gender', 'Male')": 30.5, "('Utah', 'Age', '18 - 24')": 29.0},
+            {f"state {index}": index / 3 for index in range(CHUNK_ENTRIES * 2 + 1)},
+            [{"endpoint": "global_mean", "data": {"global_mean": 1.5}}, {"error": "KeyError"}],
+            {},
+            [],
+            {"global_mean": 0},
+            {"Zăbrăuți": {"b": 1, "a": [2, "ș"]}, "Arad": None},
+        ]
+
+    def test_json(self):
+        """
+        The chunks make up the same bytes as the non-streamed response
+        """
+        with webserver.app_context():
+            for result in self.results:
+                streamed = "".join(iter_json(result))
+                self.assertEqual(streamed, jsonify({"status": "done", "data": result})
+                                 .get_data(as_text=True))
+                self.assertEqual(json.loads(streamed), {"status": "done", "data": result})
+
+    def test_ndjson(self):
+        """
+        Every line is an entry of a dict result or an item of a list result
+        """
+        for result in self.results:
+            lines = "".join(iter_ndjson(result)).splitlines()
+            entries = [json.loads(line) for line in lines]
+            if isinstance(result, dict):
+                self.assertEqual(entries, [{key: value} for key, value in result.items()])
+            else:
+                self.assertEqual(entries, result)
+
+    def test_chunks(self):
+        """
+        Large results are written in several chunks
+        """
+        result = self.results[1]
+        self.assertEqual(len(list(iter_ndjson(result))), 3)
+        self.assertGreater(len(list(iter_json(result))), 3)
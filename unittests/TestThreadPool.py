@@ -0,0 +1,108 @@
+"""
+Testing module for the ThreadPool in app/task_runner.py
+"""
+import json
+import threading
+from app.job_registry import CANCELLED, DONE, FAILED
+from app.calculations import calculate_states_mean, calculate_state_mean
+from app.routes import webserver
+from unittests.helpers import TIMEOUT, ThreadPoolTestCase, slow_task
+
+
+class TestThreadPool(ThreadPoolTestCase):
+    """
+    Runs jobs through a ThreadPool in both execution modes
+    """
+
+    def setUp(self):
+        """
+        Reads small_dict.json, which is shared with the worker processes
+        """
+        super().setUp()
+        with open("unittests/small_dict.json", "r", encoding='utf-8') as file:
+            self.questions_dict = json.load(file)
+        self.question = next(iter(self.questions_dict))
+        self.my_logger = webserver.my_logger
+
+    def run_jobs(self, execution_mode):
+        """
+        Submits a successful and a failing job and waits for both of them
+        """
+        thread_pool = self.new_thread_pool((self.questions_dict, self.my_logger),
+                                           TP_NUM_OF_THREADS=2, TP_EXECUTION_MODE=execution_mode)
+        thread_pool.submit((1, calculate_states_mean, self.question,
+                            self.questions_dict, self.my_logger))
+        thread_pool.submit((2, calculate_state_mean, self.question, "Atlantis",
+                            self.questions_dict, self.my_logger))
+        for job_id in (1, 2):
+            thread_pool.job_registry.wait(job_id, TIMEOUT)
+        return thread_pool
+
+    def test_new_job_id(self):
+        """
+        Job IDs handed out to concurrent callers are all distinct
+        """
+        thread_pool = self.new_thread_pool()
+        job_ids = []
+        callers = [threading.Thread(target=lambda: job_ids.extend(
+            thread_pool.new_job_id() for _ in range(1000))) for _ in range(8)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        self.assertEqual(sorted(job_ids), list(range(1, 8001)))
+
+    def test_unhashable_cache_key(self):
+        """
+        A job whose cache key cannot be hashed is not left queued in the registry
+        """
+        thread_pool = self.new_thread_pool()
+        with self.assertRaises(TypeError):
+            thread_pool.submit((1, calculate_states_mean, [self.question],
+                                self.questions_dict, self.my_logger),
+                               ("states_mean", [self.question]))
+        self.assertNotIn(1, thread_pool.job_registry.jobs)
+
+    def test_execution_modes(self):
+        """
+        Worker processes compute exactly what worker threads compute
+        """
+        expected = calculate_states_mean(self.question, self.questions_dict, self.my_logger)
+        for execution_mode in ("thread", "process"):
+            thread_pool = self.run_jobs(execution_mode)
+            self.assertEqual(thread_pool.job_registry.get(1).state, DONE)
+            self.assertEqual(thread_pool.result_store.get(1), expected)
+            self.assertEqual(thread_pool.job_registry.get(2).state, FAILED)
+
+    def test_shutdown_deadline(self):
+        """
+        Jobs still queued when the shutdown deadline passes are cancelled, the running one
+        finishes
+        """
+        thread_pool = self.new_thread_pool(TP_NUM_OF_THREADS=1, TP_EXECUTION_MODE="thread")
+        task, started, release = self.blocking_job(1)
+        thread_pool.submit(task)
+        for job_id in (2, 3):
+            thread_pool.submit((job_id, slow_task, 0))
+        started.wait(TIMEOUT)
+        shutdown = threading.Thread(target=thread_pool.shutdown, kwargs={"deadline": 0.01})
+        shutdown.start()
+        # Job 1 keeps the worker busy past the deadline
+        thread_pool.job_registry.wait(3, TIMEOUT)
+        release.set()
+        shutdown.join(TIMEOUT)
+        self.assertEqual(thread_pool.job_registry.get(1).state, DONE)
+        self.assertEqual(thread_pool.job_registry.get(2).state, CANCELLED)
+        self.assertEqual(thread_pool.job_registry.get(3).state, CANCELLED)
+        self.assertFalse(thread_pool.task_runners[0].is_alive())
+
+    def test_shutdown_drains_queue(self):
+        """
+        Without a deadline, every queued job runs before the workers stop
+        """
+        thread_pool = self.new_thread_pool(TP_NUM_OF_THREADS=1, TP_EXECUTION_MODE="thread")
+        for job_id in range(1, 4):
+            thread_pool.submit((job_id, slow_task, 0.01))
+        thread_pool.shutdown()
+        self.assertEqual([state for _, state in thread_pool.job_registry.states()],
+                         [DONE, DONE, DONE])
@@ -11,7 +11,8 @@ from app.routes import calculate_states_mean, \
     calculate_diff_from_mean, \
     calculate_state_diff_from_mean, \
     calculate_mean_by_category, \
-    calculate_state_mean_by_category
+    calculate_state_mean_by_category, \
+    calculate_batch
 from app.routes import webserver
 
 
@@ -175,3 +176,62 @@ class TestWebserver(unittest.TestCase):
                                                "('Race/Ethnicity', 'Other')": 49.8,
                                                "('Gender', 'Female')": 42.5,
                                                "('Gender', 'Male')": 49.95}})
+
+    def test_calculate_batch(self):
+        """
+        Calculates the result and compares it to the separate 'calculate' methods
+        """
+        items = [{"endpoint": "state_mean", "question": self.question_1, "state": "Utah"},
+                 {"endpoint": "global_mean", "question": self.question_2},
+                 {"endpoint": "best5", "question": self.question_1},
+                 {"endpoint": "state_mean", "question": self.question_1, "state": "Atlantis"}]
+        result = calculate_batch(items, self.questions_dict,
+                                 (self.questions_best_is_max, self.questions_best_is_min),
+                                 self.my_logger)
+        self.assertEqual([answer.get("data") for answer in result],
+                         [{'Utah': 32.725},
+                          {'global_mean': 46.369565217391305},
+                          calculate_best5(self.question_1, self.questions_dict,
+                                          self.questions_best_is_max, self.my_logger),
+                          None])
+        self.assertEqual(result[3]["error"], "KeyError: 'Atlantis'")
+
+    def test_invalid_batch(self):
+        """
+        Batch requests whose items are not a list of valid objects are answered with a 400
+        """
+        client = webserver.test_client()
+        for items in ("xx", [1], [{"endpoint": "state_mean", "question": self.question_1}]):
+            response = client.post("/api/batch", json={"items": items})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()["job_id"], -1)
+        self.assertEqual(client.post("/api/batch", json={}).status_code, 400)
+
+    def test_no_cache(self):
+        """
+        Requests sent with 'Cache-Control: no-cache' are computed, never served from the cache
+        """
+        client = webserver.test_client()
+        submitted = webserver.tasks_runner.metrics.jobs_submitted.values
+        no_cache = submitted.get(("states_mean", "none"), 0)
+        for _ in range(2):
+            response = client.post("/api/states_mean", json={"question": self.question_1},
+                                   headers={"Cache-Control": "no-cache"})
+            self.assertNotEqual(response.get_json()["job_id"], -1)
+        self.assertEqual(submitted[("states_mean", "none")], no_cache + 2)
+
+    def test_invalid_arguments(self):
+        """
+        Questions and states that are not strings are answered with a 400, and no job is left
+        """
+        client = webserver.test_client()
+        num_jobs = client.get("/api/num_jobs").get_json()
+        for endpoint, data in (("states_mean", {"question": [self.question_1]}),
+                               ("state_mean", {"question": self.question_1, "state": {}}),
+                               ("state_trend", {"question": self.question_1, "state": 1}),
+                               ("batch", {"items": [{"endpoint": "global_mean",
+                                                     "question": [self.question_1]}]})):
+            response = client.post(f"/api/{endpoint}", json=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()["job_id"], -1)
+        self.assertEqual(client.get("/api/num_jobs").get_json(), num_jobs)
@@ -0,0 +1,75 @@
+"""
+Helpers shared by the tests that run jobs through a ThreadPool of their own
+"""
+import os
+import time
+import unittest
+from threading import Event
+from unittest import mock
+from app.task_runner import ThreadPool
+
+# Longest time (seconds) a test waits for something that should happen right away
+TIMEOUT = 5
+
+
+def slow_task(seconds):
+    """
+    Task that keeps its worker busy for a while
+    """
+    time.sleep(seconds)
+    return {"slept": seconds}
+
+
+def blocking_task(started, release):
+    """
+    Task that sets `started` and keeps its worker busy until `release` is set
+    """
+    started.set()
+    release.wait(TIMEOUT)
+    return {"released": True}
+
+
+class ThreadPoolTestCase(unittest.TestCase):
+    """
+    Creates ThreadPools for the tests and shuts them down after every test, releasing
+    the blocking tasks first, so that no worker thread outlives its test
+    """
+
+    def setUp(self):
+        self.thread_pools = []
+        self.releases = []
+
+    def tearDown(self):
+        for release in self.releases:
+            release.set()
+        for thread_pool in self.thread_pools:
+            thread_pool.shutdown()
+
+    def new_thread_pool(self, shared=(), **env):
+        """
+        Creates a ThreadPool configured by the environment variables `env`
+        (e.g. TP_NUM_OF_THREADS=1), shut down by tearDown.
+        """
+        with mock.patch.dict(os.environ, {name: str(value) for name, value in env.items()}):
+            thread_pool = ThreadPool(shared)
+        self.thread_pools.append(thread_pool)
+        return thread_pool
+
+    def blocking_job(self, job_id):
+        """
+        Returns a task blocking its worker, the Event set once it runs and the Event
+        releasing it (set by tearDown at the latest).
+        """
+        started, release = Event(), Event()
+        self.releases.append(release)
+        return (job_id, blocking_task, started, release), started, release
+
+    def wait_until(self, condition):
+        """
+        Waits for `condition()` to hold, failing the test after TIMEOUT seconds.
+        """
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the thread pool")
+            time.sleep(0.001)